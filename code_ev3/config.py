@@ -9,8 +9,22 @@ Configuration Robot EV3 - VA55 UTBM
 
 BROKER_IP = "192.168.0.103"   # A METTRE A JOUR AVEC TON IP NODE-RED
 BROKER_PORT = 1883
-TOPIC_STATUS = "intersection/status"    # Robot -> Controleur
-TOPIC_COMMAND = "intersection/command"  # Controleur -> Robot
+INTERSECTION_ID = "X1"        # Intersection servie (un controleur peut en gerer plusieurs)
+TOPIC_STATUS = "intersection/" + INTERSECTION_ID + "/status"    # Robot -> Controleur
+TOPIC_COMMAND = "intersection/" + INTERSECTION_ID + "/command"  # Controleur -> Robot
+# Le robot s'abonne a TOPIC_COMMAND/<ROBOT_ID> et TOPIC_COMMAND/ALL.
+# True : topic partage TOPIC_COMMAND (controleur lance avec --legacy-topic)
+LEGACY_COMMAND_TOPIC = False
+
+OUTBOX_SIZE = 16          # File d'envoi bornee (messages)
+MQTT_BUDGET_MS = 10       # Temps max d'envoi par iteration de boucle
+RECONNECT_MIN_MS = 500    # Backoff de reconnexion (double a chaque echec)
+RECONNECT_MAX_MS = 8000
+MQTT_CONNECT_MS = 300     # Delai de la reconnexion (tentee robot a l'arret)
+
+# Encodage binaire compact (cf. protocol.md) au lieu du JSON.
+# Necessite le controleur Python (python -m controller) : Node-RED ne parle que JSON.
+BINARY_PROTOCOL = False
 
 # =============================================================================
 # IDENTIFICATION ROBOT
@@ -19,6 +33,21 @@ TOPIC_COMMAND = "intersection/command"  # Controleur -> Robot
 ROBOT_ID = "R1"      # R1, R2, etc.
 VOIE = "A"           # A ou B
 
+# =============================================================================
+# PORTS
+# =============================================================================
+
+# Ports forces ("S1".."S4", "A".."D"), None = detection.
+# ULTRASONIC_PORT = "-" : pas d'ultrason (aucune recherche).
+COLOR_PORT = None
+ULTRASONIC_PORT = None
+LEFT_MOTOR_PORT = None
+RIGHT_MOTOR_PORT = None
+
+# Ports detectes, revalides (une lecture par peripherique) au demarrage suivant.
+# A supprimer pour forcer une detection complete ; None : pas de cache.
+PORT_MAP_FILE = "ports.map"
+
 # =============================================================================
 # PHYSIQUE
 # =============================================================================
@@ -35,6 +64,17 @@ BLACK_REFLECTION = 10
 MIDDLE_REFLECTION = 40  # Ajuster selon luminosite
 COLOR_DEBOUNCE_MS = 200 # Plus utilise, remplace par logique sur_ligne
 
+# =============================================================================
+# ECHANTILLONNAGE CAPTEURS
+# =============================================================================
+
+# Periode de lecture de chaque canal (ms), valeur en cache entre deux lectures.
+# 0 = lecture a chaque iteration de la boucle.
+REFLECTION_PERIOD = 0            # Suivi de ligne (PID)
+COLOR_PERIOD = 100               # Detection des lignes rouges
+COLOR_TRIGGER_REFLECTION = None  # Si defini : lecture couleur immediate quand reflexion >= seuil
+ULTRASONIC_PERIOD = 100          # Uniquement dans la zone de stockage (compteur_lignes == 1)
+
 # =============================================================================
 # PID
 # =============================================================================
@@ -56,3 +96,20 @@ LOOP_INTERVAL = 50   # ms
 OBSTACLE_STOP_DISTANCE = 120   # mm (12cm)
 
 DEBUG_INTERVAL = 1000
+
+# Bips aux lignes et au GO. beep() est bloquant (100-200 ms sans PID, MQTT,
+# capteurs ni bouton, compte comme un depassement de la boucle) : debug seulement.
+LOOP_BEEPS = False
+
+# =============================================================================
+# JOURNAL DE BORD
+# =============================================================================
+
+# Les evenements de la boucle sont notes dans un tampon circulaire prealloue
+# (enregistrements de taille fixe, sans allocation) et affiches seulement a
+# l'arret a la ligne 2 et en fin de programme (cf. ringlog.py).
+LOG_RING = 256         # Enregistrements en memoire ; 0 : affichage immediat
+LOG_LEVEL = 1          # 0 DEBUG (stats de boucle chaque seconde), 1 INFO, 2 WARN, 3 ERREUR
+LOG_FILE = None        # "log.bin" : vidage binaire dans ce fichier plutot que la console
+                       # (relecture : python ringlog.py log.bin)
+LOG_FLUSH_BATCH = 8    # Enregistrements vides par iteration a l'arret
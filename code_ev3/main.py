@@ -12,6 +12,7 @@ from pybricks.parameters import Port, Button, Color
 from pybricks.tools import wait, StopWatch
 from pybricks.robotics import DriveBase
 import time
+import struct
 
 # Configuration centralisee
 from config import (
@@ -21,154 +22,503 @@ from config import (
     MIDDLE_REFLECTION,
     KP, KI, KD, COMMAND_FACTOR, MAX_SUM_ERROR,
     BASE_SPEED, LOOP_INTERVAL,
-    OBSTACLE_STOP_DISTANCE, DEBUG_INTERVAL
+    OBSTACLE_STOP_DISTANCE, DEBUG_INTERVAL, LOOP_BEEPS,
+    REFLECTION_PERIOD, COLOR_PERIOD, COLOR_TRIGGER_REFLECTION, ULTRASONIC_PERIOD,
+    OUTBOX_SIZE, MQTT_BUDGET_MS, RECONNECT_MIN_MS, RECONNECT_MAX_MS, MQTT_CONNECT_MS,
+    BINARY_PROTOCOL, LEGACY_COMMAND_TOPIC,
+    COLOR_PORT, ULTRASONIC_PORT, LEFT_MOTOR_PORT, RIGHT_MOTOR_PORT, PORT_MAP_FILE,
+    LOG_RING, LOG_LEVEL, LOG_FILE, LOG_FLUSH_BATCH
+)
+from ringlog import (
+    RingLog, render, timestamp, LEVELS, CAUSES, ACTIONS,
+    EV_BOOT, EV_NET_OK, EV_NET_ERR, EV_SENT, EV_RECV_GO, EV_RECV, EV_LINE, EV_PASS,
+    EV_STOP, EV_RESET, EV_GO, EV_OBS, EV_OBS_CLEAR, EV_LOOP
 )
 
-# MQTT (optionnel)
+# MQTT (optionnel) - umqtt.simple : la reconnexion est geree par SimpleMQTT
+# (umqtt.robust bloquerait la boucle en reessayant indefiniment)
 try:
-    from umqtt.robust import MQTTClient
+    import umqtt.simple as umqtt_simple
+    from umqtt.simple import MQTTClient
     MQTT_AVAILABLE = True
 except ImportError:
     MQTT_AVAILABLE = False
     print("[WARN] umqtt non disponible")
 
+class TimedSocket:
+    """
+    Socket dont le mode "bloquant" a un delai : umqtt.simple repasse le
+    socket en bloquant (setblocking(True)) apres chaque check_msg() et
+    pendant connect() / subscribe().
+    """
+    
+    def __init__(self, sock, timeout):
+        self.sock = sock
+        self.limit(timeout)
+    
+    def limit(self, timeout):
+        """Delai (s) des lectures / ecritures en mode bloquant"""
+        self.timeout = timeout
+        self.sock.settimeout(timeout)
+    
+    def setblocking(self, flag):
+        self.sock.settimeout(self.timeout if flag else 0)
+    
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+    
+    def connect(self, addr):
+        self.sock.connect(addr)
+    
+    def read(self, n):
+        return self.sock.read(n)
+    
+    def write(self, data, n=None):
+        return self.sock.write(data) if n is None else self.sock.write(data, n)
+    
+    def close(self):
+        self.sock.close()
+
+class TimedSockets:
+    """
+    Module socket vu par umqtt.simple : sockets a delai (MQTT_CONNECT_MS
+    pour la poignee de main, puis MQTT_BUDGET_MS). Sans lui, connect()
+    (TCP + CONNACK) et publish() bloquent la boucle jusqu'au delai TCP du
+    systeme quand le broker ou le Wi-Fi ne repond plus.
+    """
+    
+    def __init__(self, mod, timeout_ms):
+        self.mod = mod
+        self.timeout = timeout_ms / 1000
+    
+    def socket(self, *args):
+        return TimedSocket(self.mod.socket(*args), self.timeout)
+    
+    def getaddrinfo(self, *args):
+        return self.mod.getaddrinfo(*args)
+
+if MQTT_AVAILABLE:
+    umqtt_simple.socket = TimedSockets(umqtt_simple.socket, MQTT_CONNECT_MS)
+
 # =============================================================================
-# AUTO-DETECTION DES PORTS (INCHANGE)
+# PORTS MATERIELS (CARTE EN CACHE + DETECTION)
 # =============================================================================
+#
+# La detection complete essaie chaque peripherique sur chaque port (plusieurs
+# secondes). La carte trouvee est gardee dans PORT_MAP_FILE : aux demarrages
+# suivants, une seule lecture par peripherique la valide, et la detection
+# complete n'a lieu que si un peripherique ne repond plus (cablage modifie).
 
-SENSOR_PORTS = [Port.S1, Port.S2, Port.S3, Port.S4]
-MOTOR_PORTS = [Port.A, Port.B, Port.C, Port.D]
+SENSOR_PORTS = ("S1", "S2", "S3", "S4")
+MOTOR_PORTS = ("A", "B", "C", "D")
+NO_PORT = "-"  # Pas d'ultrason
 
-def auto_detect_color_sensor():
-    for port in SENSOR_PORTS:
-        try:
-            sensor = ColorSensor(port)
-            _ = sensor.reflection()
-            print("[AUTO] Capteur Couleur sur", port)
-            return sensor, port
-        except:
-            continue
-    raise Exception("Pas de capteur couleur!")
+# (cle de la carte, classe, lecture de validation)
+DEVICES = (
+    ("color", ColorSensor, "reflection"),
+    ("ultrasonic", UltrasonicSensor, "distance"),
+    ("left", Motor, "angle"),
+    ("right", Motor, "angle"),
+)
 
-def auto_detect_ultrasonic():
-    for port in SENSOR_PORTS:
-        try:
-            sensor = UltrasonicSensor(port)
-            _ = sensor.distance()
-            print("[AUTO] Capteur Ultrason sur", port)
-            return sensor, port
-        except:
-            continue
-    print("[AUTO] Pas de capteur ultrason")
-    return None, None
+def open_device(cls, probe, name):
+    """Peripherique cls sur le port name apres une lecture, None si absent"""
+    try:
+        device = cls(getattr(Port, name))
+        getattr(device, probe)()
+        return device
+    except Exception:
+        return None  # Absent, autre peripherique ou port inconnu : detection complete
 
-def auto_detect_motors():
-    found = []
-    for port in MOTOR_PORTS:
-        try:
-            motor = Motor(port)
-            found.append((motor, port))
-            print("[AUTO] Moteur sur", port)
-        except:
+def load_port_map(path):
+    """Carte {cle: port} lue dans path, None si absente ou invalide"""
+    try:
+        with open(path) as f:
+            lines = f.read().split()
+    except OSError:
+        return None
+    ports = {}
+    for line in lines:
+        key, _, name = line.partition("=")
+        ports[key] = name
+    for key, cls, _ in DEVICES:
+        valid = MOTOR_PORTS if cls is Motor else SENSOR_PORTS
+        if ports.get(key) not in valid and not (key == "ultrasonic" and ports.get(key) == NO_PORT):
+            return None
+    return ports
+
+def save_port_map(path, ports):
+    try:
+        with open(path, "w") as f:
+            for key, _, _ in DEVICES:
+                f.write(key + "=" + ports[key] + "\n")
+    except OSError:
+        pass  # Carte non persistee : detection complete au prochain demarrage
+
+def validate_ports(ports, forced):
+    """
+    Une lecture par peripherique ; {cle: peripherique}, None au premier echec.
+    Un ultrason absent de la carte (non force) est recherche sur les ports
+    capteur libres : s'il a ete branche depuis, ports est mis a jour.
+    """
+    devices = {}
+    for key, cls, probe in DEVICES:
+        if ports[key] == NO_PORT:
+            devices[key] = None
+            if forced[key] is None:
+                used = list(ports.values())
+                for name in SENSOR_PORTS:
+                    if name not in used:
+                        devices[key] = open_device(cls, probe, name)
+                        if devices[key] is not None:
+                            ports[key] = name
+                            break
             continue
-    if len(found) < 2:
+        device = open_device(cls, probe, ports[key])
+        if device is None:
+            return None
+        devices[key] = device
+    return devices
+
+def scan_ports(forced):
+    """Detection complete (ports forces respectes) ; (carte, peripheriques)"""
+    ports, devices, used = {}, {}, []
+    for key, cls, probe in DEVICES:
+        ports[key], devices[key] = NO_PORT, None
+        if forced[key] is not None:
+            candidates = (forced[key],)
+        else:
+            candidates = MOTOR_PORTS if cls is Motor else SENSOR_PORTS
+        for name in candidates:
+            if name == NO_PORT or name in used:
+                continue
+            device = open_device(cls, probe, name)
+            if device is not None:
+                ports[key], devices[key] = name, device
+                used.append(name)
+                break
+    if devices["color"] is None:
+        raise Exception("Pas de capteur couleur!")
+    if devices["left"] is None or devices["right"] is None:
         raise Exception("Moins de 2 moteurs!")
-    return found[0][0], found[1][0], found[0][1], found[1][1]
+    return ports, devices
+
+def setup_ports(log):
+    """(capteur couleur, ultrason ou None, moteur gauche, moteur droit)"""
+    sw = StopWatch()
+    forced = {"color": COLOR_PORT, "ultrasonic": ULTRASONIC_PORT,
+              "left": LEFT_MOTOR_PORT, "right": RIGHT_MOTOR_PORT}
+    cached = load_port_map(PORT_MAP_FILE) if PORT_MAP_FILE else None
+    ports = {}
+    for key, _, _ in DEVICES:
+        ports[key] = forced[key] if forced[key] is not None else (cached[key] if cached else None)
+
+    devices = None
+    if None not in ports.values():
+        cached_ultrasonic = ports["ultrasonic"]
+        devices = validate_ports(ports, forced)
+        if devices is None:
+            log.log("[PORTS]", "Carte invalide (cablage modifie ?), detection complete")
+        elif ports["ultrasonic"] != cached_ultrasonic and PORT_MAP_FILE:
+            save_port_map(PORT_MAP_FILE, ports)  # Ultrason branche depuis la derniere detection
+    if devices is None:
+        ports, devices = scan_ports(forced)
+        if PORT_MAP_FILE:
+            save_port_map(PORT_MAP_FILE, ports)
+    log.log("[PORTS]", "Couleur " + ports["color"] + " | Ultrason " + ports["ultrasonic"] +
+            " | Moteurs " + ports["left"] + "," + ports["right"] + " (" + str(sw.time()) + "ms)")
+    return devices["color"], devices["ultrasonic"], devices["left"], devices["right"]
 
 # =============================================================================
-# CLASSE LOGGER (MISE A JOUR POUR LE NOUVEAU PROTOCOLE)
+# CLASSE LOGGER (TAMPON CIRCULAIRE, VIDAGE DIFFERE)
 # =============================================================================
 
 class RobotLogger:
-    def __init__(self, robot_id):
+    """
+    log() : texte affiche tout de suite (demarrage, fin de programme).
+    rec() : evenement de la boucle (code + entiers, cf. ringlog.py), note
+    sans allocation dans le tampon et vide par flush() quand le robot est
+    arrete. LOG_RING = 0 : rendu et affichage immediats.
+    """
+    
+    def __init__(self, robot_id, ring=LOG_RING, level=LOG_LEVEL, path=LOG_FILE):
         self.robot_id = robot_id
+        self.level = level
+        self.ring = RingLog(ring) if ring else None
+        self.file = None
+        if self.ring and path:
+            try:
+                self.file = open(path, "ab")  # Relecture : python ringlog.py <path>
+            except OSError:
+                print("[WARN] Journal " + path + " inaccessible, vidage console")
         self.sw = StopWatch()
         self.sw.reset()
-    
-    def _ts(self):
-        ms = self.sw.time()
-        return "{:02d}:{:02d}.{:03d}".format(ms // 60000, (ms // 1000) % 60, ms % 1000)
+        self.rec(EV_BOOT)
     
     def log(self, tag, msg):
-        print("[" + self._ts() + "] " + tag + " " + msg)
+        print("[" + timestamp(self.sw.time()) + "] " + tag + " " + msg)
+    
+    def rec(self, code, a=0, b=0, c=0):
+        if LEVELS[code] < self.level:
+            return
+        if self.ring:
+            self.ring.append(self.sw.time(), code, a, b, c)
+        else:
+            print(render(self.sw.time(), code, a, b, c))
     
     def event(self, etape, cause):
-        self.log("[MQTT >>]", "Etape: " + str(etape) + " | Cause: " + cause)
+        self.rec(EV_SENT, etape, CAUSES.index(cause) if cause in CAUSES else 0)
+    
+    def recv(self, action, rtt_ms=-1, re=-1):
+        if action == "GO":
+            self.rec(EV_RECV_GO, rtt_ms, re)
+        else:
+            self.rec(EV_RECV, ACTIONS.index(action) if action in ACTIONS else 0)
+    
+    def flush(self, count=None):
+        """Vide au plus count enregistrements (tous par defaut) vers la console ou LOG_FILE"""
+        ring = self.ring
+        if ring is None or not ring.pending():
+            return
+        if count is None:
+            count = ring.pending()
+        if ring.lost:
+            self.log("[LOG]", str(ring.lost) + " enregistrement(s) perdu(s) (tampon plein)")
+            ring.lost = 0
+        if self.file:
+            ring.write_to(self.file, count)
+            self.file.flush()
+            return
+        while count > 0 and ring.pending():
+            print(render(*ring.record(ring.tail)))
+            ring.tail += 1
+            count -= 1
+    
+    def dump(self):
+        """Reaffiche tout le tampon, deja vide ou non (bouton HAUT a l'arret)"""
+        if self.ring:
+            for line in self.ring.lines():
+                print(line)
     
-    def recv(self, action):
-        tag = "[GO!]" if action == "GO" else "[CMD]"
-        self.log(tag, "Recu: " + action)
+    def close(self):
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
 
 # =============================================================================
 # CLASSE MQTT (MISE A JOUR PAYLOAD UNIVERSEL)
 # =============================================================================
 
+# Encodage binaire (version 1) ; CAUSES et ACTIONS (ringlog.py) sont les
+# memes tables que controller/protocol.py
+BINARY_VERSION = 1
+NET_CONNECT, NET_PUBLISH, NET_CHECK = 0, 1, 2  # Etape en echec (ringlog.NET_STAGES)
+SENT_SLOTS = 8  # Derniers status envoyes (seq, instant) pour le temps aller-retour du GO
+
+def _errno(e):
+    return e.args[0] if e.args and isinstance(e.args[0], int) else -1
+
+def _json_str(p, key):
+    """Valeur texte de key dans un JSON plat (espaces et ordre indifferents)"""
+    i = p.find('"' + key + '"')
+    if i < 0:
+        return None
+    i = p.find(':', i + len(key) + 2)
+    if i < 0:
+        return None
+    i = p.find('"', i + 1)
+    j = p.find('"', i + 1)
+    if i < 0 or j < 0:
+        return None
+    return p[i + 1:j]
+
+def _json_int(p, key):
+    """Valeur entiere de key dans un JSON plat, None si absente"""
+    i = p.find('"' + key + '"')
+    if i < 0:
+        return None
+    i = p.find(':', i + len(key) + 2)
+    if i < 0:
+        return None
+    j = i + 1
+    while j < len(p) and p[j] not in ',}':
+        j += 1
+    try:
+        return int(p[i + 1:j])
+    except ValueError:
+        return None
+
 class SimpleMQTT:
+    """
+    Client MQTT non bloquant pour la boucle de controle :
+    - publish() met le message en file (bornee), sans E/S
+    - pump() envoie la file dans un budget de temps a chaque iteration
+    - reconnexion avec backoff exponentiel, tentee seulement robot a l'arret
+      (la poignee de main depasse MQTT_BUDGET_MS) ; les evenements en file
+      sont rejoues une fois reconnecte
+    - une fois connecte, chaque E/S est bornee par le reste du budget
+    """
+    
     def __init__(self, robot_id, voie, broker, port, topic_st, topic_cmd, log):
         self.robot_id = robot_id
         self.voie = voie
+        self.broker = broker
+        self.port = port
         self.topic_st = topic_st
+        self.topic_cmd = topic_cmd
         self.log = log
         self.client = None
         self.connected = False
         self.permis_recu = False # Stocke l'autorisation
         
+        self.outbox = []         # [etape, cause, dist_us] en attente d'envoi
+        self.dropped = 0         # Messages perdus (file pleine)
+        self.seq = 0             # Numero de sequence des status (16 bits)
+        self.sent_seq = [-1] * SENT_SLOTS  # Status envoyes : seq et instant (ms),
+        self.sent_ms = [0] * SENT_SLOTS    # preallouees (pas d'allocation par envoi)
+        self.sw = StopWatch()
+        self.backoff = RECONNECT_MIN_MS
+        self.next_retry = 0
+        
         if MQTT_AVAILABLE:
-            try:
-                cid = robot_id + "_" + str(int(time.time()) % 10000)
-                self.client = MQTTClient(cid, broker, port=port)
-                self.client.set_callback(self._on_msg)
-                self.client.connect()
-                self.client.subscribe(topic_cmd)
-                self.connected = True
-                log.log("[NET]", "Connecte " + broker)
-            except Exception as e:
-                log.log("[ERR]", "MQTT: " + str(e))
+            cid = robot_id + "_" + str(int(time.time()) % 10000)
+            self.client = MQTTClient(cid, broker, port=port)
+            self.client.set_callback(self._on_msg)
+            self._connect()
+    
+    def _connect(self):
+        try:
+            self.client.connect()
+            if LEGACY_COMMAND_TOPIC:
+                self.client.subscribe(self.topic_cmd)
+            else:
+                # Uniquement nos commandes et les diffusions
+                self.client.subscribe(self.topic_cmd + "/" + self.robot_id)
+                self.client.subscribe(self.topic_cmd + "/ALL")
+            self.client.sock.limit(MQTT_BUDGET_MS / 1000)  # check_msg() en roulant
+            self.connected = True
+            self.backoff = RECONNECT_MIN_MS
+            self.log.rec(EV_NET_OK)
+        except Exception as e:
+            try: self.client.sock.close()  # Connexion a moitie etablie
+            except: pass
+            self._lost(NET_CONNECT, e)
+    
+    def _lost(self, stage, e):
+        """Connexion perdue : prochaine tentative apres backoff"""
+        if self.connected:
+            try: self.client.sock.close()
+            except: pass
+        self.connected = False
+        self.next_retry = self.sw.time() + self.backoff
+        self.log.rec(EV_NET_ERR, stage, _errno(e), self.backoff)
+        self.backoff = min(self.backoff * 2, RECONNECT_MAX_MS)
     
     def _on_msg(self, topic, msg):
         try:
-            p = msg.decode()
-            # Parsing manuel rudimentaire pour eviter erreurs JSON
-            if '"target_id"' in p and '"action"' in p:
-                # Extraction ID cible
-                i = p.find('"target_id"') + 13
-                j = p.find('"', i + 1)
-                tid = p[i:j]
-                
-                # Extraction Action
-                i = p.find('"action"') + 10
-                j = p.find('"', i + 1)
-                act = p[i:j]
-                
-                if tid == self.robot_id or tid == "ALL":
+            if msg[0] == BINARY_VERSION:
+                # version | action | len(target_id) | target_id
+                act = ACTIONS[msg[1]]
+                tid = msg[3:3 + msg[2]].decode()
+                re = None
+            else:
+                # Parsing manuel rudimentaire pour eviter erreurs JSON
+                p = msg.decode()
+                tid = _json_str(p, "target_id")
+                act = _json_str(p, "action")
+                re = _json_int(p, "re")  # Dernier status vu par le controleur
+            
+            if tid == self.robot_id or tid == "ALL":
+                if act == "GO":
+                    self.log.recv(act, self._rtt(re), -1 if re is None else re)
+                else:
                     self.log.recv(act)
-                    if act == "GO":
-                        self.permis_recu = True
-                    elif act == "RESET":
-                        self.permis_recu = False
+                if act == "GO":
+                    self.permis_recu = True
+                elif act == "RESET":
+                    self.permis_recu = False
         except:
             pass
     
+    def _rtt(self, re):
+        """
+        Aller-retour (ms) du GO : depuis l'envoi du status re, ou a defaut
+        (commande binaire, re inconnu) depuis le dernier status envoye.
+        """
+        i = (re if re is not None else self.seq) % SENT_SLOTS
+        if self.sent_seq[i] < 0 or (re is not None and self.sent_seq[i] != re):
+            i = self.seq % SENT_SLOTS
+            if self.sent_seq[i] < 0:
+                return -1
+        return self.sw.time() - self.sent_ms[i]
+    
     def publish(self, etape, cause, dist_us=999):
-        """Envoie le format universel JSON"""
-        if not self.connected: return
-        
+        """Met un evenement en file (envoye par pump)"""
+        if cause == "obstacle":
+            # Coalescence : un seul obstacle en attente, distance la plus recente
+            for item in self.outbox:
+                if item[1] == "obstacle":
+                    item[2] = dist_us
+                    return
+        if len(self.outbox) >= OUTBOX_SIZE:
+            self.outbox.pop(0)
+            self.dropped += 1
+        self.outbox.append([etape, cause, dist_us])
+    
+    def _format(self, etape, cause, dist_us):
+        """Format universel JSON (ou binaire si BINARY_PROTOCOL), seq suivant"""
+        self.seq = (self.seq + 1) & 0xFFFF
+        if BINARY_PROTOCOL:
+            rid = self.robot_id.encode()
+            code = CAUSES.index(cause) if cause in CAUSES else 0
+            return struct.pack("!BBBBHHB", BINARY_VERSION, etape, code, ord(self.voie),
+                               min(dist_us, 0xFFFF), self.seq, len(rid)) + rid
         # Construction manuelle du JSON pour performance
-        msg = '{"id":"' + self.robot_id + '",' + \
-              '"voie":"' + self.voie + '",' + \
-              '"etape":' + str(etape) + ',' + \
-              '"cause":"' + cause + '",' + \
-              '"dist_us":' + str(dist_us) + '}'
-        try:
-            self.client.publish(self.topic_st, msg)
+        return '{"id":"' + self.robot_id + '",' + \
+               '"voie":"' + self.voie + '",' + \
+               '"etape":' + str(etape) + ',' + \
+               '"cause":"' + cause + '",' + \
+               '"dist_us":' + str(dist_us) + ',' + \
+               '"seq":' + str(self.seq) + ',' + \
+               '"ts":' + str(self.sw.time()) + '}'
+    
+    def pump(self, budget_ms=MQTT_BUDGET_MS, moving=False):
+        """
+        Vide la file dans la limite de budget_ms (appele a chaque iteration).
+        moving : moteurs en marche, la reconnexion (jusqu'a MQTT_CONNECT_MS)
+        est reportee au prochain arret (ligne 2 ou obstacle).
+        """
+        if self.client is None:
+            return
+        start = self.sw.time()
+        if not self.connected:
+            if moving or start < self.next_retry:
+                return
+            self._connect()
+            if not self.connected:
+                return
+        
+        while self.outbox and self.sw.time() - start < budget_ms:
+            etape, cause, dist_us = self.outbox[0]
+            try:
+                # Envoi borne par le reste du budget (connexion a moitie morte)
+                self.client.sock.settimeout((budget_ms - (self.sw.time() - start)) / 1000)
+                self.client.publish(self.topic_st, self._format(etape, cause, dist_us))
+            except Exception as e:
+                self.seq = (self.seq - 1) & 0xFFFF  # Renvoye avec le meme seq
+                self._lost(NET_PUBLISH, e)
+                return
+            i = self.seq % SENT_SLOTS
+            self.sent_seq[i] = self.seq
+            self.sent_ms[i] = self.sw.time()
+            self.outbox.pop(0)
             self.log.event(etape, cause)
-        except:
-            pass
     
     def check(self):
         if self.connected:
             try: self.client.check_msg()
-            except: pass
+            except Exception as e: self._lost(NET_CHECK, e)
     
     def reset_permis(self):
         self.permis_recu = False
@@ -189,22 +539,209 @@ class PIDController:
     def __init__(self, kp, ki, kd, target, dt_ms, cmd_factor=1.0, max_sum=1000):
         self.kp, self.ki, self.kd = kp, ki, kd
         self.target = target
-        self.dt = dt_ms / 1000.0
+        self.dt = dt_ms / 1000.0  # Periode nominale
         self.cmd_factor = cmd_factor
         self.max_sum = max_sum
         self.sum_err = 0
-        self.last_err = 0
+        self.last_err = None
     
-    def compute(self, val):
+    def reset(self):
+        """Vide l'integrateur (redemarrage apres un arret)"""
+        self.sum_err = 0
+        self.last_err = None
+    
+    def compute(self, val, dt_ms=None):
+        # dt_ms : periode reellement mesuree (defaut = periode nominale)
+        dt = dt_ms / 1000.0 if dt_ms else self.dt
         err = val - self.target
-        self.sum_err += err
+        # Integrale ponderee par dt/nominal : gains identiques a la periode nominale
+        self.sum_err += err * (dt / self.dt)
         if self.sum_err > self.max_sum: self.sum_err = self.max_sum
         elif self.sum_err < -self.max_sum: self.sum_err = -self.max_sum
-        deriv = (err - self.last_err) / self.dt
+        deriv = 0 if self.last_err is None else (err - self.last_err) / dt
         cmd = (self.kp * err + self.ki * self.sum_err + self.kd * deriv) * self.cmd_factor
         self.last_err = err
         return cmd
 
+# =============================================================================
+# CADENCEMENT DE LA BOUCLE (ECHEANCES FIXES)
+# =============================================================================
+
+class LoopTimer:
+    """Boucle a periode fixe : dort jusqu'a la prochaine echeance, mesure dt"""
+    
+    def __init__(self, period_ms):
+        self.period = period_ms
+        self.sw = StopWatch()
+        self.overruns = 0     # Iterations ayant depasse leur echeance
+        self.max_jitter = 0   # Retard max au reveil (ms)
+        self.resync()
+    
+    def resync(self):
+        """Repart d'une echeance fraiche"""
+        self.last = self.sw.time()
+        self.deadline = self.last + self.period
+    
+    def wait_next(self):
+        """Attend l'echeance suivante, retourne le dt mesure (ms)"""
+        now = self.sw.time()
+        if now < self.deadline:
+            wait(self.deadline - now)
+            now = self.sw.time()
+        else:
+            self.overruns += 1
+        
+        jitter = now - self.deadline
+        if jitter > self.max_jitter:
+            self.max_jitter = jitter
+        
+        dt = now - self.last
+        self.last = now
+        self.deadline += self.period
+        if self.deadline <= now:
+            # Trop en retard : on saute les periodes manquees
+            self.deadline = now + self.period
+        return dt
+
+# =============================================================================
+# ECHANTILLONNAGE MULTI-CADENCE DES CAPTEURS
+# =============================================================================
+
+class SensorSampler:
+    """
+    Lit chaque capteur a sa propre cadence (config.py) et garde la derniere
+    valeur en cache. L'ultrason n'est lu que dans la zone de stockage.
+    """
+    
+    def __init__(self, color_sensor, ultrasonic):
+        self.color_sensor = color_sensor
+        self.ultrasonic = ultrasonic
+        self.reflection = MIDDLE_REFLECTION
+        self.color = None
+        self.dist_us = 9999  # Pas d'ultrason : grande distance par defaut
+        self._next_reflection = 0
+        self._next_color = 0
+        self._next_us = 0
+    
+    def sample(self, now_ms, zone_stockage):
+        if now_ms >= self._next_reflection:
+            self.reflection = self.color_sensor.reflection()
+            self._next_reflection = now_ms + REFLECTION_PERIOD
+        
+        if now_ms >= self._next_color or (
+                COLOR_TRIGGER_REFLECTION is not None and self.reflection >= COLOR_TRIGGER_REFLECTION):
+            self.color = self.color_sensor.color()
+            self._next_color = now_ms + COLOR_PERIOD
+        
+        if self.ultrasonic and zone_stockage and now_ms >= self._next_us:
+            self.dist_us = self.ultrasonic.distance()
+            self._next_us = now_ms + ULTRASONIC_PERIOD
+
+# =============================================================================
+# SEQUENCEUR (MACHINE A ETATS NON BLOQUANTE)
+# =============================================================================
+
+# Etats du robot sur le parcours
+APPROCHE = 0    # Vers la ligne 1
+STOCKAGE = 1    # Entre ligne 1 et ligne 2 (zone de stockage)
+OBSTACLE = 2    # Arret derriere un robot dans la zone de stockage
+ARRET = 3       # A la ligne 2, en attente du GO
+TRAVERSEE = 4   # Entre ligne 2 et ligne 3 (zone de conflit)
+
+# Valeur de compteur_lignes pour chaque etat
+COMPTEUR_ETAT = (0, 1, 1, 2, 2)
+
+class Sequencer:
+    """
+    Sequenceur 3 etapes, avance d'un pas par iteration de la boucle.
+    Ne bloque jamais : MQTT, boutons et capteurs restent servis a chaque cycle.
+    """
+    
+    def __init__(self, robot, pid, mqtt, log):
+        self.robot = robot
+        self.pid = pid
+        self.mqtt = mqtt
+        self.log = log
+        self.etat = APPROCHE
+        self.sur_ligne = False   # Anti-rebond
+        self.beep = None         # (frequence, duree) a jouer si LOOP_BEEPS
+    
+    @property
+    def compteur_lignes(self):
+        return COMPTEUR_ETAT[self.etat]
+    
+    def _ligne(self, dist_us):
+        """Nouvelle ligne rouge detectee"""
+        self.log.rec(EV_LINE, self.compteur_lignes + 1)
+        
+        # --- ETAPE 1 : ENTREE ZONE ---
+        if self.etat == APPROCHE:
+            self.beep = (500, 100)
+            self.mqtt.publish(1, "marker_entry", dist_us)
+            self.etat = STOCKAGE
+        
+        # --- ETAPE 2 : LIGNE D'ARRET ---
+        elif self.etat == STOCKAGE:
+            if self.mqtt.has_permis():
+                # CAS A : PASS-THROUGH (Permis deja la)
+                self.log.rec(EV_PASS)
+                self.beep = (1000, 200)
+                self.mqtt.publish(2, "pass_through", dist_us)
+                self.etat = TRAVERSEE
+            else:
+                # CAS B : STOP & WAIT
+                self.robot.stop()
+                self.log.rec(EV_STOP)
+                self.mqtt.publish(2, "marker_stop", dist_us)
+                self.etat = ARRET
+        
+        # --- ETAPE 3 : SORTIE ---
+        elif self.etat == TRAVERSEE:
+            self.mqtt.publish(3, "marker_exit", dist_us)
+            self.beep = (500, 100)
+            self.log.rec(EV_RESET)
+            self.mqtt.reset_permis()
+            self.etat = APPROCHE
+    
+    def tick(self, color, dist_us):
+        """Un pas du sequenceur. Retourne True si le robot doit rouler."""
+        # --- ARRET A LA LIGNE : attente du GO ---
+        if self.etat == ARRET:
+            if not self.mqtt.has_permis():
+                return False
+            self.log.rec(EV_GO)
+            self.beep = (1000, 200)
+            self.pid.reset()
+            self.etat = TRAVERSEE
+            return True
+        
+        # --- LOGIQUE OBSTACLE (PELOTON) ---
+        if self.etat == OBSTACLE:
+            if dist_us < OBSTACLE_STOP_DISTANCE + 50:  # Hysteresis +50mm
+                return False
+            self.log.rec(EV_OBS_CLEAR)
+            self.pid.reset()
+            self.etat = STOCKAGE
+        elif self.etat == STOCKAGE and dist_us < OBSTACLE_STOP_DISTANCE:
+            # Dans la file (apres ligne 1, avant ligne 2) et on colle qqun
+            self.robot.stop()
+            self.log.rec(EV_OBS, dist_us)
+            self.mqtt.publish(1, "obstacle", dist_us)
+            self.etat = OBSTACLE
+            return False
+        
+        # --- LOGIQUE LIGNES ---
+        # Detection Rouge (Ton scotch orange)
+        if color == Color.RED:
+            if not self.sur_ligne:
+                self.sur_ligne = True
+                self._ligne(dist_us)
+        else:
+            # On a quitte la ligne rouge, on re-arme la detection
+            self.sur_ligne = False
+        
+        return self.etat != ARRET
+
 # =============================================================================
 # PROGRAMME PRINCIPAL
 # =============================================================================
@@ -216,111 +753,69 @@ def main():
     log.log("[INIT]", "Robot Ignorant 3-Etapes demarre")
     
     # 1. Hardware Setup
-    color_sensor, _ = auto_detect_color_sensor()
-    ultrasonic, _ = auto_detect_ultrasonic()
-    left_motor, right_motor, _, _ = auto_detect_motors()
+    color_sensor, ultrasonic, left_motor, right_motor = setup_ports(log)
     robot = DriveBase(left_motor, right_motor, WHEEL_DIAMETER, AXLE_TRACK)
     pid = PIDController(KP, KI, KD, MIDDLE_REFLECTION, LOOP_INTERVAL, COMMAND_FACTOR, MAX_SUM_ERROR)
     mqtt = SimpleMQTT(ROBOT_ID, VOIE, BROKER_IP, BROKER_PORT, TOPIC_STATUS, TOPIC_COMMAND, log)
     
-    # 2. Variables d'Etat (Sequencement)
-    compteur_lignes = 0
-    sur_ligne = False # Anti-rebond
+    # 2. Sequenceur et cadencement
+    sensors = SensorSampler(color_sensor, ultrasonic)
+    seq = Sequencer(robot, pid, mqtt, log)
     running = True
+    loop_timer = LoopTimer(LOOP_INTERVAL)
+    next_debug = DEBUG_INTERVAL
+    haut_avant = False
     
     log.log("[RDY]", "En attente de ligne...")
     
     while running:
-        start_time = time.time()
+        dt_ms = loop_timer.wait_next()
         
-        # --- LECTURE CAPTEURS ---
-        reflection = color_sensor.reflection()
-        color = color_sensor.color()
-        # Si pas d'ultrason, on met une grande distance par defaut
-        dist_us = ultrasonic.distance() if ultrasonic else 9999
+        # --- LECTURE CAPTEURS (multi-cadence) & MQTT ---
+        sensors.sample(loop_timer.last, seq.compteur_lignes == 1)
+        mqtt.check()
         
-        # --- LOGIQUE OBSTACLE (PELOTON) ---
-        # Si on est dans la file (apres ligne 1, avant ligne 2) et qu'on colle qqun
-        if compteur_lignes == 1 and dist_us < OBSTACLE_STOP_DISTANCE:
-            robot.stop()
-            log.log("[OBS]", "Obstacle detecte (" + str(dist_us) + "mm)")
-            mqtt.publish(1, "obstacle", dist_us)
-            
-            # Attente active que l'obstacle s'eloigne
-            while dist_us < (OBSTACLE_STOP_DISTANCE + 50): # Hysteresis +50mm
-                if ultrasonic: dist_us = ultrasonic.distance()
-                mqtt.check() # On continue d'ecouter MQTT au cas ou
-                wait(100)
-            
-            log.log("[OBS]", "Voie libre, redemarrage")
-            # On laisse le PID reprendre la main ensuite
-
-        # --- LOGIQUE LIGNES (SEQUENCEUR) ---
-        # Detection Rouge (Ton scotch orange)
-        if color == Color.RED:
-            if not sur_ligne:
-                sur_ligne = True
-                compteur_lignes += 1
-                log.log("[DET]", "Ligne detectee -> Compteur = " + str(compteur_lignes))
-                
-                # --- ETAPE 1 : ENTREE ZONE ---
-                if compteur_lignes == 1:
-                    ev3.speaker.beep(500, 100)
-                    mqtt.publish(1, "marker_entry", dist_us)
-                    # On continue de rouler
-                    
-                # --- ETAPE 2 : LIGNE D'ARRET ---
-                elif compteur_lignes == 2:
-                    mqtt.check() # Derniere verif avant decision
-                    
-                    if mqtt.has_permis():
-                        # CAS A : PASS-THROUGH (Permis deja la)
-                        log.log("[PASS]", "Permis OK -> Passage direct")
-                        ev3.speaker.beep(1000, 200)
-                        mqtt.publish(2, "pass_through", dist_us)
-                        # On ne s'arrete pas
-                    else:
-                        # CAS B : STOP & WAIT
-                        robot.stop()
-                        log.log("[STOP]", "Pas de permis -> Arret")
-                        mqtt.publish(2, "marker_stop", dist_us)
-                        
-                        # Boucle bloquante d'attente
-                        while not mqtt.has_permis():
-                            mqtt.check()
-                            wait(50)
-                        
-                        log.log("[GO]", "Permis recu -> Depart")
-                        ev3.speaker.beep(1000, 200)
-                        # Le robot redemarrera grace au PID a la prochaine iteration
-
-                # --- ETAPE 3 : SORTIE ---
-                elif compteur_lignes == 3:
-                    mqtt.publish(3, "marker_exit", dist_us)
-                    ev3.speaker.beep(500, 100)
-                    log.log("[RST]", "Reset Cycle")
-                    compteur_lignes = 0
-                    mqtt.reset_permis()
+        # --- SEQUENCEUR ---
+        moving = seq.tick(sensors.color, sensors.dist_us)
+        if moving:
+            # --- SUIVI DE LIGNE (PID) ---
+            turn = pid.compute(sensors.reflection, dt_ms)
+            robot.drive(BASE_SPEED, turn)
         
-        elif color != Color.RED:
-             # On a quitte la ligne rouge, on re-arme la detection
-             sur_ligne = False
+        if seq.beep:
+            if LOOP_BEEPS:
+                ev3.speaker.beep(seq.beep[0], seq.beep[1])  # Bloquant : debug seulement
+            seq.beep = None
         
-        # --- SUIVI DE LIGNE (PID) ---
-        # Le PID ne tourne que si on n'est pas bloque dans les boucles while ci-dessus
-        turn = pid.compute(reflection)
-        robot.drive(BASE_SPEED, turn)
+        # --- ENVOI MQTT (file sortante, budget borne ; reconnexion a l'arret) ---
+        mqtt.pump(moving=moving)
+        
+        # --- JOURNAL : vidage seulement a l'arret a la ligne 2 ---
+        if seq.etat == ARRET:
+            log.flush(LOG_FLUSH_BATCH)
         
         # --- DEBUG & MAINTENANCE ---
-        mqtt.check()
-        if Button.CENTER in ev3.buttons.pressed():
+        pressed = ev3.buttons.pressed()
+        if Button.CENTER in pressed:
             running = False
         
-        wait(LOOP_INTERVAL)
+        # Bouton HAUT, robot arrete : reaffiche tout le journal de bord
+        haut = Button.UP in pressed
+        if haut and not haut_avant and not moving:
+            log.dump()
+        haut_avant = haut
+        
+        if loop_timer.last >= next_debug:
+            next_debug = loop_timer.last + DEBUG_INTERVAL
+            log.rec(EV_LOOP, dt_ms, loop_timer.overruns, loop_timer.max_jitter)
 
     # Fin du programme
     robot.stop()
+    mqtt.pump(1000)  # Derniers evenements en file
     mqtt.close()
+    log.close()
+    log.log("[LOOP]", "Depassements=" + str(loop_timer.overruns) +
+            " | Gigue max=" + str(loop_timer.max_jitter) + "ms")
     log.log("[END]", "Programme termine")
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+#!/usr/bin/env pybricks-micropython
+"""
+Journal de bord en tampon circulaire - Robot EV3 VA55
+UTBM - Master VASA
+
+Dans la boucle de controle, print() formate et concatene des chaines
+(allocations, pauses du GC) puis bloque sur la console. Ici chaque
+evenement est un enregistrement de taille fixe (instant ms, code, 3 entiers)
+ecrit dans un tableau prealloue : aucune allocation. Le texte n'est produit
+qu'au vidage (robot arrete, fin de programme) ou hors du robot :
+
+    python ringlog.py log.bin
+"""
+
+from array import array
+
+RECORD = 5  # Entiers par enregistrement : instant ms, code, a, b, c
+
+# Niveaux (LOG_LEVEL dans config.py)
+DEBUG = 0
+INFO = 1
+WARN = 2
+ERROR = 3
+
+# Tables de noms (memes que controller/protocol.py pour CAUSES et ACTIONS)
+CAUSES = ("unknown", "marker_entry", "obstacle", "marker_stop", "pass_through", "marker_exit")
+ACTIONS = ("", "GO", "STOP", "RESET")
+NET_STAGES = ("MQTT", "Publish", "Check")
+
+# =============================================================================
+# EVENEMENTS
+# =============================================================================
+
+# Codes d'evenement
+EV_BOOT = 0
+EV_NET_OK = 1
+EV_NET_ERR = 2
+EV_SENT = 3
+EV_RECV_GO = 4
+EV_RECV = 5
+EV_LINE = 6
+EV_PASS = 7
+EV_STOP = 8
+EV_RESET = 9
+EV_GO = 10
+EV_OBS = 11
+EV_OBS_CLEAR = 12
+EV_LOOP = 13
+
+# code -> (niveau, etiquette, format sur a/b/c, tables de noms de a/b/c)
+EVENTS = (
+    (INFO, "[LOG]", "----- Demarrage -----", None),
+    (INFO, "[NET]", "Connecte", None),
+    (WARN, "[ERR]", "{0}: errno {1} (retry {2}ms)", (NET_STAGES, None, None)),
+    (INFO, "[MQTT >>]", "Etape: {0} | Cause: {1}", (None, CAUSES, None)),
+    (INFO, "[GO!]", "Recu: GO (aller-retour {0}ms, status {1})", None),
+    (INFO, "[CMD]", "Recu: {0}", (ACTIONS, None, None)),
+    (INFO, "[DET]", "Ligne detectee -> Compteur = {0}", None),
+    (INFO, "[PASS]", "Permis OK -> Passage direct", None),
+    (INFO, "[STOP]", "Pas de permis -> Arret", None),
+    (INFO, "[RST]", "Reset Cycle", None),
+    (INFO, "[GO]", "Permis recu -> Depart", None),
+    (INFO, "[OBS]", "Obstacle detecte ({0}mm)", None),
+    (INFO, "[OBS]", "Voie libre, redemarrage", None),
+    (DEBUG, "[LOOP]", "dt={0}ms | depassements={1} | gigue max={2}ms", None),
+)
+
+LEVELS = tuple(e[0] for e in EVENTS)
+
+
+def timestamp(ms):
+    return "{:02d}:{:02d}.{:03d}".format(ms // 60000, (ms // 1000) % 60, ms % 1000)
+
+
+def render(ms, code, a=0, b=0, c=0):
+    """Ligne de texte d'un enregistrement"""
+    if not 0 <= code < len(EVENTS):
+        return "[" + timestamp(ms) + "] [?] code " + str(code) + " " + str((a, b, c))
+    _, tag, fmt, names = EVENTS[code]
+    args = [a, b, c]
+    if names:
+        for i in range(3):
+            if names[i] and 0 <= args[i] < len(names[i]):
+                args[i] = names[i][args[i]]
+    return "[" + timestamp(ms) + "] " + tag + " " + fmt.format(*args)
+
+
+# =============================================================================
+# TAMPON CIRCULAIRE
+# =============================================================================
+
+class RingLog:
+    """
+    size enregistrements preallouees ; le plus ancien non vide est ecrase
+    quand le tampon est plein (compte dans lost).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.buf = array("i", [0] * (RECORD * size))
+        self.head = 0   # Numero du prochain enregistrement ecrit
+        self.tail = 0   # Numero du prochain enregistrement a vider
+        self.lost = 0   # Enregistrements ecrases avant vidage
+
+    def append(self, ms, code, a, b, c):
+        buf = self.buf
+        i = (self.head % self.size) * RECORD
+        buf[i] = ms
+        buf[i + 1] = code
+        buf[i + 2] = a
+        buf[i + 3] = b
+        buf[i + 4] = c
+        self.head += 1
+        if self.head - self.tail > self.size:
+            self.tail += 1
+            self.lost += 1
+
+    def pending(self):
+        return self.head - self.tail
+
+    def record(self, n):
+        """Enregistrement numero n : (ms, code, a, b, c)"""
+        i = (n % self.size) * RECORD
+        return tuple(self.buf[i:i + RECORD])
+
+    def lines(self, start=None):
+        """Rendu texte de start (defaut : le plus ancien conserve) a head"""
+        first = max(self.head - self.size, 0)
+        if start is None or start < first:
+            start = first
+        for n in range(start, self.head):
+            yield render(*self.record(n))
+
+    def write_to(self, f, count):
+        """
+        Ecrit au plus count enregistrements en attente dans f (int32 ordre
+        natif : little-endian sur l'EV3 comme sur PC)
+        """
+        count = min(count, self.pending())
+        mv = memoryview(self.buf)
+        while count > 0:
+            i = self.tail % self.size
+            n = min(count, self.size - i)  # Jusqu'a la fin du tableau, puis le debut
+            f.write(mv[i * RECORD:(i + n) * RECORD])
+            self.tail += n
+            count -= n
+
+
+def read_records(path):
+    """Enregistrements (ms, code, a, b, c) d'un fichier ecrit par write_to"""
+    data = array("i")
+    with open(path, "rb") as f:
+        raw = f.read()
+    raw = raw[:len(raw) - len(raw) % (RECORD * data.itemsize)]  # Dernier enregistrement tronque
+    data.frombytes(raw)
+    for i in range(0, len(data), RECORD):
+        yield tuple(data[i:i + RECORD])
+
+
+def main():
+    import sys
+    if len(sys.argv) != 2:
+        print("Usage: python ringlog.py <fichier journal>")
+        return 1
+    for rec in read_records(sys.argv[1]):
+        print(render(*rec))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
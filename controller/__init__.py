@@ -0,0 +1,14 @@
+"""
+Controleur d'Intersection Python - VA55 UTBM
+
+Alternative headless au node "Multi-Mode Controller" de Node-RED.
+"""
+
+from .engine import IntersectionEngine, MODES, LIBRE, OCCUPE
+from .journal import Journal
+from .metrics import IntersectionMetrics, MetricsServer, render_prometheus
+from .service import ControllerService
+from .pool import ControllerPool
+
+__all__ = ["IntersectionEngine", "ControllerService", "ControllerPool", "Journal",
+           "IntersectionMetrics", "MetricsServer", "render_prometheus", "MODES", "LIBRE", "OCCUPE"]
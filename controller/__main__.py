@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Lancement du controleur headless
+
+    python -m controller --mode FIFO --host localhost --port 1883
+    python -m controller --intersections X1 X2:FEU X3 --workers 2
+    python -m controller --metrics-port 9100    # curl localhost:9100/metrics
+"""
+
+import argparse
+import asyncio
+import logging
+
+from .engine import IntersectionEngine, MODES
+from .journal import SNAPSHOT_EVERY
+from .pool import ControllerPool
+from .protocol import INTERSECTION_ID
+from .service import ControllerService, BROKER_HOST, BROKER_PORT, METRICS_HOST
+
+
+def parse_intersections(specs: list, default_mode: str) -> dict:
+    """["X1", "X2:FEU"] -> {"X1": default_mode, "X2": "FEU"}"""
+    modes = {}
+    for spec in specs:
+        xid, _, mode = spec.partition(":")
+        mode = mode.upper() or default_mode
+        if not xid or "/" in xid or "+" in xid or "#" in xid:
+            raise ValueError("Id d'intersection invalide: " + spec)
+        if mode not in MODES:
+            raise ValueError("Mode inconnu: " + spec)
+        modes[xid] = mode
+    return modes
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="controller")
+    parser.add_argument("--mode", choices=MODES, default="FIFO",
+                        help="Mode des intersections sans mode explicite")
+    parser.add_argument("--intersections", nargs="+", default=[INTERSECTION_ID], metavar="XID[:MODE]",
+                        help="Intersections servies (topics intersection/<xid>/...)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processus (intersections reparties par hachage de leur id)")
+    parser.add_argument("--host", default=BROKER_HOST)
+    parser.add_argument("--port", type=int, default=BROKER_PORT)
+    parser.add_argument("--verbose", action="store_true", help="Trace chaque message (lent)")
+    parser.add_argument("--legacy-topic", action="store_true",
+                        help="Robots non migres : publie aussi sur intersection/<xid>/command ; "
+                             "pour %s seulement, ecoute aussi intersection/status et "
+                             "recopie ses commandes sur intersection/command" % INTERSECTION_ID)
+    parser.add_argument("--journal", metavar="DIR",
+                        help="Journal + snapshots (DIR/<xid>) pour la reprise apres crash")
+    parser.add_argument("--snapshot-every", type=int, default=SNAPSHOT_EVERY,
+                        help="Entrees de journal entre deux snapshots")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="GET /metrics (Prometheus) et /timelines ; processus i : PORT + i")
+    parser.add_argument("--metrics-host", default=METRICS_HOST,
+                        help="Interface du serveur de metriques")
+    args = parser.parse_args()
+
+    try:
+        modes = parse_intersections(args.intersections, args.mode)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="[%(asctime)s] %(message)s",
+    )
+
+    options = {"host": args.host, "port": args.port, "legacy_topic": args.legacy_topic,
+               "journal_dir": args.journal, "snapshot_every": args.snapshot_every,
+               "metrics_port": args.metrics_port, "metrics_host": args.metrics_host}
+    if args.workers > 1 and len(modes) > 1:
+        pool = ControllerPool(modes, args.workers, **options)
+        try:
+            pool.start()
+            pool.join()
+        except ConnectionError as e:
+            logging.getLogger("controller").error("[POOL] %s", e)
+            return 1
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.stop()
+        return 0
+
+    service = ControllerService({xid: IntersectionEngine(mode) for xid, mode in modes.items()},
+                                **options)
+    try:
+        asyncio.run(service.run())
+    except ConnectionError as e:
+        logging.getLogger("controller").error("[CTRL] %s", e)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,673 @@
+"""
+Moteur de decision - Intersection Cooperative VA55
+UTBM - Master VASA
+
+Portage Python du node "Multi-Mode Controller (FEU/FIFO/PELOTON)" de
+nodered/flows.json. Le moteur ne fait aucune E/S : il recoit les messages
+status et les ticks, et retourne la liste des commandes a publier.
+L'etat reste en memoire (pas de copie par flow.get/flow.set) et indexe
+par voie (controller/lanes.py) : le cout d'un message ne depend pas du
+nombre de robots suivis.
+
+Robustesse aux messages perdus (marker_exit en QoS 0, robot retire a la
+main) : en FIFO et PELOTON, chaque GO est un bail qui expire si le robot
+ne sort pas a temps (sortie presumee, le suivant est libere) ; dans tous
+les modes, un robot silencieux depuis ROBOT_TTL est oublie partout.
+"""
+
+import logging
+import time
+from collections import deque, OrderedDict
+
+from .lanes import LaneQueue, DistanceIndex
+from .trajets import Trajets, OCCUPATION
+from .protocol import GO, command
+
+log = logging.getLogger("controller")
+
+MODES = ("FEU", "ADAPTATIF", "FIFO", "PELOTON")
+MODES_FEU = ("FEU", "ADAPTATIF")   # Modes a feux (file_attente, phases)
+VOIES = ("A", "B")
+
+LIBRE = "LIBRE"
+OCCUPE = "OCCUPE"
+
+# Configuration FEU (durees en ticks de 1 seconde)
+TICK_INTERVAL = 1.0
+DUREE_VERT = 10
+DUREE_ROUGE_INTEGRAL = 3
+
+# Tick rapide (ADAPTATIF, FIFO, PELOTON) : decisions au 1/10 s
+TICK_RAPIDE = 0.1
+
+# Configuration ADAPTATIF (secondes)
+VERT_MIN = 3.0          # Vert garanti avant tout changement
+VERT_MAX = 20.0         # Vert maximal si l'autre voie attend
+INTERVALLE_MAX = 1.0    # Gap-out : fin du vert apres 1 s sans demande sur la voie
+
+# Configuration FIFO : GO anticipe (temps de parcours appris, controller/trajets.py)
+MARGE_ANTICIPATION = 0.2    # s, zone liberee au plus tard / arrivee du suivant au plus tot
+AVANCE_GO = 1.0             # s, GO envoye au plus tot AVANCE_GO s avant l'arrivee (aller-retour reseau)
+
+# Configuration PELOTON (cm)
+DISTANCE_INTER_ROBOT = 35
+DISTANCE_SEUL = 100
+
+# Liberation en peloton : les suivants de la meme voie recoivent GO a
+# intervalle HEADWAY pendant que le peloton traverse
+LONGUEUR_ROBOT = 20     # cm
+ECART_MIN = 15          # cm, ecart minimal entre deux robots du peloton
+VITESSE_ROBOT = 10      # cm/s (BASE_SPEED du robot)
+HEADWAY = (LONGUEUR_ROBOT + ECART_MIN) / VITESSE_ROBOT  # s entre deux GO
+PELOTON_MAX = 4         # Robots par peloton avant de laisser passer l'autre voie
+
+# Baux (FIFO, PELOTON) : un GO sans sortie expire apres BAIL_FACTEUR fois la
+# duree GO -> sortie observee (borne haute), BAIL_DEFAUT avant apprentissage
+BAIL_DEFAUT = 30.0      # s
+BAIL_MIN = 5.0          # s
+BAIL_FACTEUR = 3.0
+
+# Robot sans aucun status depuis ROBOT_TTL : oublie (toutes les structures), sauf
+# s'il attend en file un GO qui viendra (un robot arrete a la ligne est muet)
+ROBOT_TTL = 120.0       # s
+
+HISTORY_SIZE = 15
+
+# Feux par phase : 0=VertA, 1=RougeTout, 2=VertB, 3=RougeTout
+FEUX = (
+    {"A": "VERT", "B": "ROUGE"},
+    {"A": "ROUGE", "B": "ROUGE"},
+    {"A": "ROUGE", "B": "VERT"},
+    {"A": "ROUGE", "B": "ROUGE"},
+)
+
+
+class Robot:
+    """Enregistrement compact d'un robot connu du controleur"""
+
+    __slots__ = ("id", "voie", "etape", "cause", "distance", "time")
+
+    def __init__(self, robot_id, voie, etape, cause, distance=None, t=0.0):
+        self.id = robot_id
+        self.voie = voie
+        self.etape = etape
+        self.cause = cause
+        self.distance = distance
+        self.time = t
+
+    def as_dict(self) -> dict:
+        d = {"voie": self.voie, "etape": self.etape, "cause": self.cause, "time": self.time}
+        if self.distance is not None:
+            d["distance"] = self.distance
+        return d
+
+
+class IntersectionEngine:
+    """Controleur multi-mode (FEU / FIFO / PELOTON)"""
+
+    def __init__(self, mode: str = "FIFO"):
+        if mode not in MODES:
+            raise ValueError("Mode inconnu: " + str(mode))
+        self.mode = mode
+        self.trajets = Trajets()        # FIFO : temps de parcours appris (conserves au reset)
+        self.reset()
+
+    # =========================================================================
+    # ETAT
+    # =========================================================================
+
+    def reset(self):
+        """Reinitialisation complete (equivalent du bouton Reset)"""
+        self.intersection = LIBRE
+        self.robots = {}                # id -> Robot
+        self.queue = LaneQueue()        # FIFO : ordre d'arrivee
+        self.autorises = set()          # FIFO : robots avec GO, pas encore sortis
+        self.anticipe = None            # FIFO : robot ayant recu un GO anticipe
+        self.trajets.passage.clear()
+        self.baux = {}                  # FIFO, PELOTON : id -> echeance du GO
+        self.activite = OrderedDict()   # id -> dernier status, du plus ancien au plus recent
+        self.file_attente = LaneQueue() # FEU : robots bloques au rouge, par voie
+        self.en_ligne = set()           # Robots a l'etape 2 (liberation FEU)
+        self.par_voie = {}              # voie -> nombre de robots (tenu a jour)
+        self.distances = DistanceIndex()  # PELOTON : leader par distance inferee
+        self.phase = 0
+        self.timer = 0
+        self.debut_phase = None         # ADAPTATIF : instant du debut de phase
+        self.approche = {v: set() for v in VOIES}  # ADAPTATIF : robots a l'etape 1
+        self.derniere_demande = {}      # ADAPTATIF : voie -> dernier instant avec demande
+        self.queue_voie = {v: 0 for v in VOIES}  # PELOTON : distance cumulee
+        self.traversee = set()          # PELOTON : robots liberes, pas encore sortis
+        self.peloton_voie = None        # PELOTON : voie du peloton en cours (ou dernier)
+        self.peloton_taille = 0         # PELOTON : robots liberes dans ce peloton
+        self.dernier_go = None          # PELOTON : instant du dernier GO
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.total = 0
+        self.passed = 0
+        self.reclamations = 0           # Baux expires + robots oublies (TTL)
+        self.renouvellements = 0        # TTL renouveles (robots silencieux attendant le GO)
+
+    def set_mode(self, mode: str):
+        """Changement de mode (reset complet, comme 'Set Global Mode')"""
+        if mode not in MODES:
+            raise ValueError("Mode inconnu: " + str(mode))
+        self.mode = mode
+        self.reset()
+        log.info("Mode change: %s", mode)
+
+    def _store(self, robot: Robot):
+        old = self.robots.get(robot.id)
+        if old is None or old.voie != robot.voie:
+            if old is not None:
+                self.par_voie[old.voie] -= 1
+            self.par_voie[robot.voie] = self.par_voie.get(robot.voie, 0) + 1
+        self.robots[robot.id] = robot
+        self.activite[robot.id] = robot.time
+        self.activite.move_to_end(robot.id)
+        if robot.etape == 2:
+            self.en_ligne.add(robot.id)
+        else:
+            self.en_ligne.discard(robot.id)
+
+    def _forget(self, robot_id):
+        old = self.robots.pop(robot_id, None)
+        if old is not None:
+            self.par_voie[old.voie] -= 1
+        self.en_ligne.discard(robot_id)
+        self.activite.pop(robot_id, None)
+
+    @property
+    def feu(self) -> dict:
+        return FEUX[self.phase]
+
+    @property
+    def tick_interval(self) -> float:
+        return TICK_INTERVAL if self.mode == "FEU" else TICK_RAPIDE
+
+    def snapshot(self) -> dict:
+        """Etat complet au format du dashboard Node-RED"""
+        queue_ids = list(self.file_attente if self.mode in MODES_FEU else self.queue)
+        robots_a = self.par_voie.get("A", 0)
+        return {
+            "mode": self.mode,
+            "intersection": self.intersection,
+            "queue": queue_ids,
+            "feu": dict(self.feu),
+            "robots": {rid: r.as_dict() for rid, r in self.robots.items()},
+            "queue_count": len(queue_ids),
+            "robots_total": len(self.robots),
+            "robots_a": robots_a,
+            "robots_b": len(self.robots) - robots_a,
+            "history": list(self.history),
+            "stats": {"total": self.total, "passed": self.passed},
+            "phase": self.phase,
+            "timer": self.timer,
+            "queue_voie_A": self.queue_voie["A"],
+            "queue_voie_B": self.queue_voie["B"],
+        }
+
+    def state_dict(self) -> dict:
+        """Etat interne serialisable (JSON), ordres de file compris"""
+        return {
+            "mode": self.mode,
+            "intersection": self.intersection,
+            "robots": [[r.id, r.voie, r.etape, r.cause, r.distance, r.time]
+                       for r in self.robots.values()],
+            "queue": self.queue.entries(),
+            "autorises": sorted(self.autorises),
+            "anticipe": self.anticipe,
+            "trajets": self.trajets.state_dict(),
+            "file_attente": self.file_attente.entries(),
+            "distances": self.distances.ranked(),
+            "phase": self.phase,
+            "timer": self.timer,
+            "debut_phase": self.debut_phase,
+            "approche": {v: sorted(ids) for v, ids in self.approche.items()},
+            "derniere_demande": dict(self.derniere_demande),
+            "queue_voie": dict(self.queue_voie),
+            "traversee": sorted(self.traversee),
+            "peloton": [self.peloton_voie, self.peloton_taille, self.dernier_go],
+            "baux": dict(self.baux),
+            "activite": [[rid, vu] for rid, vu in self.activite.items()],
+            "history": list(self.history),
+            "total": self.total,
+            "passed": self.passed,
+            "reclamations": self.reclamations,
+            "renouvellements": self.renouvellements,
+        }
+
+    def load_state(self, state: dict):
+        """Restaure un etat produit par state_dict() (meme mode)"""
+        if state["mode"] != self.mode:
+            raise ValueError("Mode de l'etat: %s (attendu %s)" % (state["mode"], self.mode))
+        self.reset()
+        self.intersection = state["intersection"]
+        for fields in state["robots"]:
+            self._store(Robot(*fields))
+        for entry in state.get("activite", ()):
+            if isinstance(entry, str):
+                entry = (entry, self.activite[entry])  # Ancien snapshot : ordre seul
+            rid, vu = entry
+            self.activite[rid] = vu  # Instant renouvele par le TTL compris
+            self.activite.move_to_end(rid)
+        for rid, voie in state["queue"]:
+            self.queue.add(rid, voie)
+        self.autorises.update(state.get("autorises", ()))
+        self.anticipe = state.get("anticipe")
+        if "trajets" in state:
+            self.trajets.load_state(state["trajets"])
+        for rid, voie in state["file_attente"]:
+            self.file_attente.add(rid, voie)
+        for rid in state["distances"]:
+            self.distances.update(self.robots[rid])
+        self.phase = state["phase"]
+        self.timer = state["timer"]
+        self.debut_phase = state.get("debut_phase")
+        for v, ids in state.get("approche", {}).items():
+            self.approche.setdefault(v, set()).update(ids)
+        self.derniere_demande.update(state.get("derniere_demande", {}))
+        self.queue_voie.update(state["queue_voie"])
+        self.traversee.update(state.get("traversee", ()))
+        self.peloton_voie, self.peloton_taille, self.dernier_go = state.get("peloton", (None, 0, None))
+        self.baux.update(state.get("baux", {}))
+        self.history.extend(state["history"])
+        self.total = state["total"]
+        self.passed = state["passed"]
+        self.reclamations = state.get("reclamations", 0)
+        self.renouvellements = state.get("renouvellements", 0)
+
+    # =========================================================================
+    # EVENEMENT A : TIMER TICK (1 s en FEU, TICK_RAPIDE sinon) + baux et TTL
+    # =========================================================================
+
+    def on_tick(self, now: float = None) -> list:
+        if now is None:
+            now = time.time()
+        commands = self._entretien(now)
+        if self.mode == "ADAPTATIF":
+            return commands + self._actuate(now)
+        if self.mode == "PELOTON":
+            return commands + self._liberer(now)
+        if self.mode == "FIFO":
+            return commands + self._anticiper(now)
+
+        self.timer += 1
+
+        duree_phase = DUREE_VERT if self.phase in (0, 2) else DUREE_ROUGE_INTEGRAL
+        if self.timer >= duree_phase:
+            self.phase = (self.phase + 1) % 4
+            self.timer = 0
+            log.debug("[FEU] Nouvelle phase: %d", self.phase)
+
+        # Phase VERTE : debloquer les robots en attente sur cette voie
+        if self.phase in (0, 2):
+            voie_verte = "A" if self.phase == 0 else "B"
+            for rid in self.file_attente.take_lane(voie_verte):
+                commands.append(command(rid, GO))
+                self.intersection = OCCUPE
+                log.debug("[FEU] GO envoye a %s (feu vert %s)", rid, voie_verte)
+
+        return commands
+
+    # =========================================================================
+    # EVENEMENT B : MESSAGE ROBOT (MQTT)
+    # =========================================================================
+
+    def on_status(self, data: dict, now: float = None) -> list:
+        if not data or not data.get("id"):
+            return []
+        if now is None:
+            now = time.time()
+
+        robot_id = data["id"]
+        voie = data.get("voie")
+        etape = data.get("etape")
+        cause = data.get("cause") or "unknown"
+
+        log.debug("[%s] %s (%s) etape=%s cause=%s", self.mode, robot_id, voie, etape, cause)
+        self.history.appendleft({
+            "time": now, "robot": robot_id, "voie": voie, "etape": etape, "cause": cause,
+        })
+        if robot_id in self.baux:
+            self.baux[robot_id] = now + self._duree_bail(robot_id, voie)  # Signe de vie : bail renouvele
+
+        if self.mode == "FEU":
+            return self._feu(robot_id, voie, etape, cause, now)
+        if self.mode == "ADAPTATIF":
+            return self._adaptatif(robot_id, voie, etape, cause, now)
+        if self.mode == "FIFO":
+            return self._fifo(robot_id, voie, etape, cause, now)
+        return self._peloton(robot_id, voie, etape, cause, now)
+
+    # -------------------------------------------------------------------------
+    # ALGORITHME 1 : MODE FEU TRICOLORE (Temporel)
+    # -------------------------------------------------------------------------
+
+    def _feu(self, robot_id, voie, etape, cause, now):
+        commands = []
+
+        if etape == 1:
+            # Entree zone - le feu ne reagit pas
+            self.total += 1
+            self._store(Robot(robot_id, voie, etape, cause, t=now))
+
+        elif etape == 2:
+            self._store(Robot(robot_id, voie, etape, cause, t=now))
+            if self.feu.get(voie) == "VERT":
+                commands.append(command(robot_id, GO))
+                self.intersection = OCCUPE
+                log.debug("[FEU] GO immediat pour %s (feu vert)", robot_id)
+            else:
+                self.file_attente.add(robot_id, voie)
+                log.debug("[FEU] %s ajoute a file_attente (feu rouge)", robot_id)
+
+        elif etape == 3:
+            # Le Rouge Integral garantit la securite
+            self.passed += 1
+            self._forget(robot_id)
+            self.file_attente.remove(robot_id)
+            if not self.en_ligne:
+                self.intersection = LIBRE
+
+        return commands
+
+    # -------------------------------------------------------------------------
+    # ALGORITHME 1b : MODE FEU ADAPTATIF (Demande observee)
+    # -------------------------------------------------------------------------
+    # Memes phases et meme rouge integral que FEU, mais la duree du vert suit
+    # la demande (robots a l'etape 1 + file_attente de chaque voie) :
+    #   - vert minimal VERT_MIN, puis fin du vert (gap-out) des que la voie
+    #     verte est sans demande depuis INTERVALLE_MAX, ou a VERT_MAX ;
+    #   - le vert ne change que si l'autre voie a une demande : une voie
+    #     vide ne recoit pas de phase (le vert reste sur la voie courante).
+    # Evalue a chaque status et a chaque tick de TICK_RAPIDE.
+
+    def _demande(self, voie) -> bool:
+        return bool(self.approche.get(voie)) or self.file_attente.head(voie) is not None
+
+    def _adaptatif(self, robot_id, voie, etape, cause, now):
+        if etape == 1:
+            self.approche.setdefault(voie, set()).add(robot_id)
+        else:
+            for ids in self.approche.values():
+                ids.discard(robot_id)
+        commands = self._feu(robot_id, voie, etape, cause, now)
+        return commands + self._actuate(now)
+
+    def _actuate(self, now):
+        commands = []
+        if self.debut_phase is None:
+            self.debut_phase = now
+        for v in VOIES:
+            if self._demande(v):
+                self.derniere_demande[v] = now
+        ecoule = now - self.debut_phase
+
+        if self.phase in (0, 2):
+            verte, autre = ("A", "B") if self.phase == 0 else ("B", "A")
+            gap = now - self.derniere_demande.get(verte, self.debut_phase) >= INTERVALLE_MAX
+            if self._demande(autre) and ecoule >= VERT_MIN and (gap or ecoule >= VERT_MAX):
+                self.phase += 1
+                self.debut_phase = now
+                log.debug("[ADAPTATIF] Fin du vert %s apres %.1fs (%s)",
+                          verte, ecoule, "gap" if gap else "max")
+        elif ecoule >= DUREE_ROUGE_INTEGRAL:
+            suivante = (self.phase + 1) % 4
+            voie, precedente = ("A", "B") if suivante == 0 else ("B", "A")
+            if not self._demande(voie) and self._demande(precedente):
+                suivante = (suivante + 2) % 4  # Phase sautee : plus de demande
+                log.debug("[ADAPTATIF] Phase %s sautee", voie)
+            self.phase = suivante
+            self.debut_phase = now
+            log.debug("[ADAPTATIF] Nouvelle phase: %d", self.phase)
+
+        self.timer = int(now - self.debut_phase)
+
+        # Phase VERTE : debloquer les robots en attente sur cette voie
+        if self.phase in (0, 2):
+            voie_verte = "A" if self.phase == 0 else "B"
+            for rid in self.file_attente.take_lane(voie_verte):
+                commands.append(command(rid, GO))
+                self.intersection = OCCUPE
+                log.debug("[ADAPTATIF] GO envoye a %s (feu vert %s)", rid, voie_verte)
+
+        return commands
+
+    # -------------------------------------------------------------------------
+    # ALGORITHME 2 : MODE FIFO (Premier Arrive Premier Servi)
+    # -------------------------------------------------------------------------
+
+    def _fifo(self, robot_id, voie, etape, cause, now):
+        commands = []
+
+        if etape in (1, 2):
+            if etape == 1:
+                self.total += 1
+                self.trajets.etape1(robot_id, voie, now)
+            else:
+                self.trajets.ligne(robot_id, voie, now)
+            self._store(Robot(robot_id, voie, etape, cause, t=now))
+            self.queue.add(robot_id, voie)
+
+            # Etape 1 : pre-reservation / Etape 2 : securite
+            if self.intersection == LIBRE and self.queue.head() == robot_id:
+                commands.append(self._go_fifo(robot_id, now))
+                self.intersection = OCCUPE
+                log.debug("[FIFO] GO (etape %d) pour %s", etape, robot_id)
+
+        elif etape == 3:
+            self.passed += 1
+            self.trajets.sortie(robot_id, now)
+            commands = self._sortie_fifo(robot_id, now)
+
+        return commands + self._anticiper(now)
+
+    def _sortie_fifo(self, robot_id, now):
+        commands = []
+        self._forget(robot_id)
+        self.queue.remove(robot_id)
+        self.autorises.discard(robot_id)
+        self.baux.pop(robot_id, None)
+        self.anticipe = None  # Le robot anticipe (s'il y en a un) devient l'occupant
+
+        if not self.autorises:
+            self.intersection = LIBRE
+            # Appel du suivant
+            if self.queue:
+                suivant = self.queue.head()
+                commands.append(self._go_fifo(suivant, now))
+                self.intersection = OCCUPE
+                log.debug("[FIFO] GO pour suivant: %s", suivant)
+        return commands
+
+    def _go_fifo(self, robot_id, now):
+        self.autorises.add(robot_id)
+        self.trajets.go(robot_id, now)
+        self._accorder_bail(robot_id, now)
+        return command(robot_id, GO)
+
+    # GO anticipe : le suivant de la file, encore en approche, recoit GO juste
+    # avant d'atteindre la ligne (AVANCE_GO) si, d'apres les temps appris, il
+    # y arrivera au plus tot MARGE_ANTICIPATION s apres la sortie au plus tard
+    # de l'occupant. Il passe sans s'arreter ; l'exclusion mutuelle est
+    # garantie par les bornes prudentes. Un seul GO anticipe a la fois.
+    def _anticiper(self, now):
+        if self.intersection != OCCUPE or self.anticipe is not None:
+            return []
+        occupant, suivant = self.queue.head(), self.queue.second()
+        if suivant is None or occupant not in self.autorises:
+            return []
+        sortie = self.trajets.sortie_max(occupant)
+        arrivee = self.trajets.arrivee_min(suivant)
+        if sortie is None or arrivee is None:
+            return []
+        if arrivee < sortie + MARGE_ANTICIPATION or now < arrivee - AVANCE_GO:
+            return []
+        self.anticipe = suivant
+        log.debug("[FIFO] GO anticipe pour %s (arrivee %.2fs apres la sortie de %s)",
+                  suivant, arrivee - sortie, occupant)
+        return [self._go_fifo(suivant, now)]
+
+    # -------------------------------------------------------------------------
+    # ALGORITHME 3 : MODE PELOTON (Inference de Distance)
+    # -------------------------------------------------------------------------
+
+    def _peloton(self, robot_id, voie, etape, cause, now):
+        # PHASE 1 : Inference des distances
+        if etape == 1:
+            self.trajets.etape1(robot_id, voie, now)
+        elif etape == 2:
+            self.trajets.ligne(robot_id, voie, now)
+
+        if robot_id in self.traversee and etape in (1, 2):
+            # Deja libere (suivant d'un peloton) : plus candidat, seul l'etat change
+            self._store(Robot(robot_id, voie, etape, cause, 0, now))
+            if etape == 2:
+                self.queue_voie[voie] = 0
+
+        elif etape == 1:
+            self.total += 1
+            if cause == "obstacle":
+                distance = self.queue_voie.get(voie, 0) + DISTANCE_INTER_ROBOT
+                self.queue_voie[voie] = distance
+                log.debug("[PELOTON] %s bloque, distance=%d", robot_id, distance)
+            else:
+                distance = DISTANCE_SEUL
+                log.debug("[PELOTON] %s entre seul, distance=%d", robot_id, distance)
+            self._store(Robot(robot_id, voie, etape, cause, distance, now))
+            self.distances.update(self.robots[robot_id])
+
+        elif etape == 2:
+            self._store(Robot(robot_id, voie, etape, cause, 0, now))
+            self.distances.update(self.robots[robot_id])
+            self.queue_voie[voie] = 0
+            log.debug("[PELOTON] %s a la ligne, distance=0", robot_id)
+
+        elif etape == 3:
+            self.passed += 1
+            self.trajets.sortie(robot_id, now)
+            self._sortie_peloton(robot_id)
+            log.debug("[PELOTON] %s sorti", robot_id)
+
+        return self._liberer(now)
+
+    def _sortie_peloton(self, robot_id):
+        self._forget(robot_id)
+        self.distances.remove(robot_id)
+        self.traversee.discard(robot_id)
+        self.baux.pop(robot_id, None)
+        if not self.traversee:
+            self.intersection = LIBRE  # Peloton entierement sorti
+
+    # PHASE 2 & 3 : Leader = plus petite distance (tete des tas par voie), GO s'il est a la ligne.
+    # Peloton : tant qu'il traverse, le suivant de la meme voie (a la ligne ou
+    # bloque derriere, distance < DISTANCE_SEUL) recoit GO toutes les HEADWAY s,
+    # au plus PELOTON_MAX robots. L'autre voie attend la sortie du peloton.
+    def _liberer(self, now):
+        if self.intersection == LIBRE:
+            leader = self.distances.leader()
+            if leader is not None and self.peloton_taille >= PELOTON_MAX \
+                    and leader.voie == self.peloton_voie:
+                # Peloton precedent plein : priorite a l'autre voie si un robot y attend
+                for voie in VOIES:
+                    autre = self.distances.leader(voie) if voie != self.peloton_voie else None
+                    if autre is not None and autre.distance == 0:
+                        leader = autre
+                        break
+            if leader is None or leader.distance != 0:
+                return []
+            self.peloton_voie = leader.voie
+            self.peloton_taille = 0
+            self.intersection = OCCUPE
+            log.debug("[PELOTON] GO pour leader %s (distance 0)", leader.id)
+            return [self._go_peloton(leader, now)]
+
+        if (self.peloton_taille < PELOTON_MAX and self.traversee
+                and now - self.dernier_go >= HEADWAY):
+            suivant = self.distances.leader(self.peloton_voie)
+            if suivant is not None and suivant.distance < DISTANCE_SEUL:
+                log.debug("[PELOTON] GO pour suivant %s (peloton %s, %d)",
+                          suivant.id, self.peloton_voie, self.peloton_taille + 1)
+                return [self._go_peloton(suivant, now)]
+        return []
+
+    def _go_peloton(self, robot, now):
+        self.distances.remove(robot.id)
+        self.traversee.add(robot.id)
+        self.peloton_taille += 1
+        self.dernier_go = now
+        self.trajets.go(robot.id, now)
+        self._accorder_bail(robot.id, now)
+        return command(robot.id, GO)
+
+    # -------------------------------------------------------------------------
+    # BAUX ET ROBOTS PERDUS
+    # -------------------------------------------------------------------------
+    # Un GO (FIFO, PELOTON) tient l'intersection jusqu'a la sortie du robot.
+    # Si le marker_exit est perdu, le bail expire : sortie presumee, le
+    # suivant est libere. Tout status du robot renouvelle son bail.
+
+    def _duree_bail(self, robot_id, voie):
+        ema = self.trajets.estimation(robot_id, voie, OCCUPATION)
+        if ema is None:
+            return BAIL_DEFAUT
+        return max(BAIL_MIN, BAIL_FACTEUR * ema.borne_haute())
+
+    def _accorder_bail(self, robot_id, now):
+        robot = self.robots.get(robot_id)
+        self.baux[robot_id] = now + self._duree_bail(robot_id, robot.voie if robot else None)
+
+    def _entretien(self, now):
+        """Baux expires puis robots silencieux depuis ROBOT_TTL (a chaque tick)"""
+        commands = []
+        for rid, echeance in list(self.baux.items()):
+            if echeance <= now and rid in self.baux:
+                log.warning("[BAIL] %s: bail expire sans sortie, sortie presumee", rid)
+                commands.extend(self._liberer_bail(rid, now))
+
+        while self.activite:
+            rid, vu = next(iter(self.activite.items()))
+            if now - vu < ROBOT_TTL:
+                break
+            if self._attend_go(rid):
+                # Silencieux mais en file : recevra un GO (puis un bail) a son tour.
+                # Change l'etat sans commande : le tick doit etre journalise
+                self.activite[rid] = now
+                self.activite.move_to_end(rid)
+                self.renouvellements += 1
+                continue
+            log.warning("[TTL] %s: aucun status depuis %.0fs, oublie", rid, now - vu)
+            if rid in self.baux:
+                commands.extend(self._liberer_bail(rid, now))
+            else:
+                self._oublier(rid)
+        return commands
+
+    def _attend_go(self, robot_id) -> bool:
+        if self.mode == "FIFO":
+            return robot_id in self.queue and robot_id not in self.autorises
+        if self.mode == "PELOTON":
+            robot = self.robots.get(robot_id)
+            return robot_id not in self.traversee and robot is not None and robot.distance == 0
+        return robot_id in self.file_attente
+
+    def _liberer_bail(self, robot_id, now):
+        """Sortie presumee d'un robot autorise (sans echantillon de temps de parcours)"""
+        self.reclamations += 1
+        self.trajets.passage.pop(robot_id, None)
+        if self.mode == "FIFO":
+            return self._sortie_fifo(robot_id, now)
+        self._sortie_peloton(robot_id)
+        return []
+
+    def _oublier(self, robot_id):
+        """Retire un robot silencieux de toutes les structures"""
+        self.reclamations += 1
+        self._forget(robot_id)
+        self.queue.remove(robot_id)
+        self.file_attente.remove(robot_id)
+        self.distances.remove(robot_id)
+        self.trajets.passage.pop(robot_id, None)
+        for ids in self.approche.values():
+            ids.discard(robot_id)
+        if self.mode in MODES_FEU and not self.en_ligne:
+            self.intersection = LIBRE
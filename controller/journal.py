@@ -0,0 +1,185 @@
+"""
+Journal d'evenements du controleur - Intersection Cooperative VA55
+UTBM - Master VASA
+
+Le moteur est deterministe : son etat est entierement defini par la suite
+des status et ticks recus. Chaque evenement entrant et chaque commande
+publiee est ajoute a un journal sur disque (une ligne JSON compacte par
+enregistrement, numerotee) :
+
+    [n, "s", t, status]          status recu a l'instant t
+    [n, "k", t]                  tick (modes a feux, ou tick ayant change l'etat :
+                                 commande, bail expire, robot oublie, TTL renouvele)
+    [n, "c", target_id, action]  commande publiee
+
+Toutes les SNAPSHOT_EVERY entrees, l'etat du moteur est ecrit dans
+snapshot.json (ecriture atomique) et le journal est vide (compaction).
+Au redemarrage : chargement du snapshot, rejeu de la fin du journal, et
+republication des commandes produites mais jamais journalisees comme
+envoyees (crash entre decision et publication). Le rejeu est borne a
+SNAPSHOT_EVERY entrees : quelques millisecondes.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+log = logging.getLogger("controller")
+
+SNAPSHOT_EVERY = 1000      # Entrees de journal entre deux snapshots
+FSYNC_INTERVAL = 1.0       # s, fsync periodique du journal (0 : a chaque entree)
+
+JOURNAL_FILE = "journal.log"
+SNAPSHOT_FILE = "snapshot.json"
+
+
+class Journal:
+    """Journal append-only + snapshots pour un IntersectionEngine"""
+
+    def __init__(self, directory: str, snapshot_every: int = SNAPSHOT_EVERY,
+                 fsync_interval: float = FSYNC_INTERVAL):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync_interval = fsync_interval
+        self.path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.seq = 0            # Numero de la derniere entree
+        self.since_snapshot = 0
+        self._file = None
+        self._last_sync = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    # =========================================================================
+    # RECUPERATION
+    # =========================================================================
+
+    def recover(self, engine) -> list:
+        """
+        Restaure engine (snapshot + rejeu) et ouvre le journal en ajout.
+        Retourne les commandes a republier.
+        """
+        t0 = time.perf_counter()
+        base = 0
+        try:
+            with open(self.snapshot_path) as f:
+                snap = json.load(f)
+        except FileNotFoundError:
+            snap = None
+        except ValueError:
+            log.warning("[JOURNAL] Snapshot illisible, ignore")
+            snap = None
+
+        if snap is not None:
+            if snap["engine"]["mode"] != engine.mode:
+                # Autre mode : l'historique ne s'applique pas, on repart de zero
+                log.warning("[JOURNAL] Mode %s sur disque, %s demande : journal ignore",
+                            snap["engine"]["mode"], engine.mode)
+                self._open(truncate=True)
+                self.snapshot(engine)
+                return []
+            engine.load_state(snap["engine"])
+            base = self.seq = snap["seq"]
+
+        produced, sent = [], Counter()
+        replayed = 0
+        valid_end = 0
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        rec = json.loads(line)
+                        n, kind = rec[0], rec[1]
+                    except (ValueError, IndexError, TypeError):
+                        break  # Derniere ligne tronquee par le crash
+                    valid_end += len(line)
+                    if n <= base:
+                        continue  # Deja dans le snapshot (crash avant compaction)
+                    self.seq = n
+                    replayed += 1
+                    if kind == "s":
+                        produced.extend(engine.on_status(rec[3], rec[2]))
+                    elif kind == "k":
+                        produced.extend(engine.on_tick(rec[2]))
+                    elif kind == "c":
+                        sent[(rec[2], rec[3])] += 1
+        except FileNotFoundError:
+            pass
+
+        # Commandes decidees pendant le rejeu mais jamais publiees
+        pending = []
+        for cmd in produced:
+            key = (cmd["target_id"], cmd["action"])
+            if sent[key]:
+                sent[key] -= 1
+            else:
+                pending.append(cmd)
+
+        self._open(truncate_at=valid_end)
+        self.since_snapshot = replayed
+        log.info("[JOURNAL] Reprise: snapshot #%d + %d entrees en %.1f ms, %d commande(s) a republier",
+                 base, replayed, (time.perf_counter() - t0) * 1000, len(pending))
+        return pending
+
+    # =========================================================================
+    # ECRITURE
+    # =========================================================================
+
+    def _open(self, truncate: bool = False, truncate_at: int = None):
+        if self._file:
+            self._file.close()
+        self._file = open(self.path, "ab")
+        if truncate:
+            self._file.truncate(0)
+        elif truncate_at is not None:
+            self._file.truncate(truncate_at)
+
+    def _append(self, rec: list):
+        self.seq += 1
+        self.since_snapshot += 1
+        self._file.write(json.dumps([self.seq] + rec, separators=(",", ":")).encode() + b"\n")
+        self._file.flush()
+        now = time.monotonic()
+        if now - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    def record_status(self, data: dict, now: float):
+        self._append(["s", now, data])
+
+    def record_tick(self, now: float):
+        self._append(["k", now])
+
+    def record_command(self, cmd: dict):
+        self._append(["c", cmd["target_id"], cmd["action"]])
+
+    def maybe_snapshot(self, engine):
+        """A appeler apres publication des commandes d'un evenement"""
+        if self.since_snapshot >= self.snapshot_every:
+            self.snapshot(engine)
+
+    def snapshot(self, engine):
+        """Snapshot atomique puis compaction du journal"""
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"seq": self.seq, "engine": engine.state_dict()}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        # Un crash ici laisse des entrees <= seq dans le journal : ignorees au rejeu
+        self._file.truncate(0)
+        self.since_snapshot = 0
+        log.debug("[JOURNAL] Snapshot #%d", self.seq)
+
+    def close(self, engine=None):
+        """Arret propre : snapshot final (rejeu vide au prochain demarrage)"""
+        if self._file is None:
+            return
+        if engine is not None:
+            self.snapshot(engine)
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
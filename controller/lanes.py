@@ -0,0 +1,146 @@
+"""
+Index par voie du controleur - Intersection Cooperative VA55
+UTBM - Master VASA
+
+Structures utilisees par IntersectionEngine pour que chaque decision coute
+O(1) ou O(log n), quel que soit le nombre de robots suivis :
+  - LaneQueue     : file ordonnee par voie + table id -> position (FIFO, FEU)
+  - DistanceIndex : tas par voie trie par distance inferee (PELOTON)
+
+Les retraits sont paresseux : l'entree est oubliee dans la table, puis
+ecartee lorsqu'elle arrive en tete.
+"""
+
+import heapq
+from collections import deque
+from itertools import count, islice
+
+
+class LaneQueue:
+    """File d'arrivee globale, stockee en une deque par voie"""
+
+    def __init__(self):
+        self._seq = count()
+        self._lanes = {}    # voie -> deque[(seq, id)]
+        self._pos = {}      # id -> (voie, seq) des robots presents
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, robot_id):
+        return robot_id in self._pos
+
+    def __iter__(self):
+        """Ids dans l'ordre d'arrivee (fusion des voies, O(n))"""
+        live = [[e for e in lane if self._live(voie, e)] for voie, lane in self._lanes.items()]
+        return (rid for _, rid in heapq.merge(*live))
+
+    def _live(self, voie, entry) -> bool:
+        return self._pos.get(entry[1]) == (voie, entry[0])
+
+    def add(self, robot_id, voie) -> bool:
+        """Ajoute en queue de sa voie ; False si deja present"""
+        if robot_id in self._pos:
+            return False
+        seq = next(self._seq)
+        self._pos[robot_id] = (voie, seq)
+        self._lanes.setdefault(voie, deque()).append((seq, robot_id))
+        return True
+
+    def remove(self, robot_id) -> bool:
+        return self._pos.pop(robot_id, None) is not None
+
+    def _front(self, voie):
+        lane = self._lanes.get(voie)
+        while lane and not self._live(voie, lane[0]):
+            lane.popleft()
+        return lane[0] if lane else None
+
+    def head(self, voie=None):
+        """Premier arrive (sur une voie, ou toutes voies confondues)"""
+        if voie is not None:
+            front = self._front(voie)
+            return front[1] if front else None
+        fronts = [f for f in map(self._front, list(self._lanes)) if f]
+        return min(fronts)[1] if fronts else None
+
+    def second(self):
+        """Deuxieme arrive toutes voies confondues (celui qui suit head())"""
+        fronts = [f for f in map(self._front, list(self._lanes)) if f]
+        if not fronts:
+            return None
+        first = min(fronts)
+        voie = self._pos[first[1]][0]
+        candidats = [f for f in fronts if f is not first]
+        suivant = next((e for e in islice(self._lanes[voie], 1, None) if self._live(voie, e)), None)
+        if suivant:
+            candidats.append(suivant)
+        return min(candidats)[1] if candidats else None
+
+    def entries(self) -> list:
+        """[(id, voie), ...] dans l'ordre d'arrivee (sauvegarde de l'etat)"""
+        return [(rid, self._pos[rid][0]) for rid in self]
+
+    def take_lane(self, voie) -> list:
+        """Retire et retourne tous les robots d'une voie, dans l'ordre"""
+        lane = self._lanes.pop(voie, None)
+        if not lane:
+            return []
+        ids = [rid for seq, rid in lane if self._pos.get(rid) == (voie, seq)]
+        for rid in ids:
+            del self._pos[rid]
+        return ids
+
+
+class DistanceIndex:
+    """Tas (distance, ordre d'arrivee) par voie ; leader = plus petite distance"""
+
+    def __init__(self):
+        self._heaps = {}    # voie -> [(distance, ordre, n, Robot)]
+        self._current = {}  # id -> Robot indexe (les autres entrees sont perimees)
+        self._ordre = {}    # id -> rang d'arrivee (departage des egalites)
+        self._seq = count()
+        self._push = count()  # n : jamais d'egalite entre deux entrees
+
+    def __len__(self):
+        return len(self._current)
+
+    def update(self, robot):
+        """Indexe la derniere version d'un robot (l'ancienne devient perimee)"""
+        ordre = self._ordre.get(robot.id)
+        if ordre is None:
+            ordre = self._ordre[robot.id] = next(self._seq)
+        self._current[robot.id] = robot
+        heap = self._heaps.setdefault(robot.voie, [])
+        heapq.heappush(heap, (robot.distance, ordre, next(self._push), robot))
+        if len(heap) > 2 * len(self._current) + 16:
+            self._compact()
+
+    def remove(self, robot_id):
+        self._current.pop(robot_id, None)
+        self._ordre.pop(robot_id, None)
+
+    def ranked(self) -> list:
+        """Ids par ordre d'arrivee (departage des egalites, sauvegarde de l'etat)"""
+        return sorted(self._current, key=self._ordre.__getitem__)
+
+    def _top(self, voie):
+        heap = self._heaps[voie]
+        while heap and self._current.get(heap[0][3].id) is not heap[0][3]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def leader(self, voie=None):
+        """Robot de plus petite distance (sur une voie, ou toutes voies confondues)"""
+        if voie is not None:
+            top = self._top(voie) if voie in self._heaps else None
+            return top[3] if top else None
+        tops = [t for t in map(self._top, list(self._heaps)) if t]
+        if not tops:
+            return None
+        return min(tops, key=lambda t: t[:2])[3]
+
+    def _compact(self):
+        for voie, heap in self._heaps.items():
+            heap[:] = [e for e in heap if self._current.get(e[3].id) is e[3]]
+            heapq.heapify(heap)
@@ -0,0 +1,358 @@
+"""
+Metriques du controleur - Intersection Cooperative VA55
+UTBM - Master VASA
+
+Instrumentation d'une intersection, alimentee par le service a chaque
+status recu, tick et commande publiee (aucune E/S) :
+
+  - chronologie par robot : etape 1, etape 2, GO, etape 3 (cycles en
+    cours + derniers cycles termines)
+  - histogrammes : attente a la ligne d'arret, traversee, zone libre alors
+    que des robots attendent (lock-idle : debit perdu), latence GO cote
+    controleur, temps de decision du moteur
+  - compteurs : status par etape, commandes par action, status perdus ou
+    dupliques (champ seq), reclamations (baux expires, robots oublies)
+
+Chaque commande publiee est estampillee (seq, ts, re = dernier seq recu
+du destinataire) : le robot mesure le temps aller-retour de son GO sur sa
+propre horloge. Rendu au format texte Prometheus (render_prometheus) et
+servi en HTTP par MetricsServer : GET /metrics, GET /timelines (JSON).
+"""
+
+import asyncio
+import json
+import logging
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+
+from .engine import MODES_FEU
+from .protocol import GO, TARGET_ALL
+
+log = logging.getLogger("controller")
+
+TIMELINES_MAX = 1000    # Cycles en cours (et derniers seq) suivis, LRU
+RECENT_CYCLES = 200     # Cycles termines gardes pour /timelines
+SEQ_MOD = 65536         # seq des status : compteur 16 bits par robot
+SEQ_RESTART = 1000      # Saut de seq au-dela duquel le robot a redemarre
+
+# Bornes des histogrammes (s)
+WAIT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+DECISION_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 5e-2)
+
+# (cle, nom Prometheus, aide, bornes)
+HISTOGRAMS = (
+    ("stop_wait", "intersection_stop_wait_seconds",
+     "Attente a la ligne d'arret (etape 2 marker_stop -> GO)", WAIT_BUCKETS),
+    ("crossing", "intersection_crossing_seconds",
+     "Traversee (GO ou pass_through -> etape 3)", WAIT_BUCKETS),
+    ("lock_idle", "intersection_lock_idle_seconds",
+     "Zone de conflit vide alors que des robots attendent, jusqu'au GO suivant", WAIT_BUCKETS),
+    ("go_latency", "intersection_go_latency_seconds",
+     "Derniere requete recue (etape 1 ou 2) -> GO publie", WAIT_BUCKETS),
+    ("decision", "intersection_decision_seconds",
+     "Temps de decision du moteur (status ou tick)", DECISION_BUCKETS),
+)
+
+
+class Histogram:
+    """Histogramme cumulatif a la Prometheus (le = borne incluse)"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # Dernier : au-dela de la plus grande borne
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Timeline:
+    """Cycle d'un robot : instants (s) des etapes et du GO"""
+
+    __slots__ = ("id", "voie", "etape1", "etape2", "go", "etape3", "pass_through", "requete")
+
+    def __init__(self, robot_id, voie):
+        self.id = robot_id
+        self.voie = voie
+        self.etape1 = self.etape2 = self.go = self.etape3 = None
+        self.pass_through = False
+        self.requete = None         # Derniere requete (status etape 1 ou 2)
+
+    def as_dict(self) -> dict:
+        def duree(a, b):
+            return None if a is None or b is None else round(b - a, 6)
+        debut = self.etape2 if self.pass_through else self.go
+        return {
+            "id": self.id, "voie": self.voie,
+            "etape1": self.etape1, "etape2": self.etape2, "go": self.go, "etape3": self.etape3,
+            "pass_through": self.pass_through,
+            "attente": None if self.pass_through else duree(self.etape2, self.go),
+            "traversee": duree(debut, self.etape3),
+        }
+
+
+class IntersectionMetrics:
+    """Metriques et chronologies d'une intersection"""
+
+    def __init__(self, xid: str):
+        self.xid = xid
+        self.histograms = {key: Histogram(bounds) for key, _, _, bounds in HISTOGRAMS}
+        self.status_total = Counter()      # etape -> status recus
+        self.commands_total = Counter()    # action -> commandes publiees
+        self.status_lost = 0               # Trous dans les seq recus
+        self.status_duplicate = 0          # seq recu deux fois (QoS 1)
+        self.cmd_seq = 0                   # seq des commandes publiees
+        self.last_seq = OrderedDict()      # id -> dernier seq recu
+        self.cycles = OrderedDict()        # id -> Timeline en cours
+        self.recent = deque(maxlen=RECENT_CYCLES)
+        self.waiting = set()               # Requete envoyee, pas encore de GO
+        self.in_zone = set()               # GO recu, pas encore sorti
+        self.idle_since = None             # Zone vide avec des robots en attente depuis
+
+    # =========================================================================
+    # EVENEMENTS
+    # =========================================================================
+
+    def on_status(self, data: dict, now: float, decision: float, seq: int = None):
+        """Apres la decision du moteur, avant publication de ses commandes (seq du robot)"""
+        rid = data["id"]
+        etape = data.get("etape")
+        cause = data.get("cause")
+        self.status_total[etape] += 1
+        self.histograms["decision"].observe(decision)
+        self._check_seq(rid, seq)
+
+        if etape == 3:
+            tl = self.cycles.pop(rid, None)
+            self.waiting.discard(rid)
+            self.in_zone.discard(rid)
+            if tl is not None:
+                tl.etape3 = now
+                debut = tl.etape2 if tl.pass_through else tl.go
+                if debut is not None:
+                    self.histograms["crossing"].observe(now - debut)
+                self.recent.append(tl.as_dict())
+            self._update_idle(now)
+            return
+
+        tl = self.cycles.get(rid)
+        if tl is None or (etape == 1 and cause == "marker_entry"):
+            tl = self._new_cycle(rid, data.get("voie"))
+        if etape == 1:
+            if tl.etape1 is None:
+                tl.etape1 = now
+        elif etape == 2:
+            tl.etape2 = now
+            tl.pass_through = cause == "pass_through"
+        if tl.go is None and not tl.pass_through:
+            tl.requete = now
+            self.waiting.add(rid)
+            self._update_idle(now)
+
+    def on_tick(self, decision: float):
+        self.histograms["decision"].observe(decision)
+
+    def on_command(self, cmd: dict, now: float) -> dict:
+        """Commande estampillee a publier (seq, ts en ms, re) ; met a jour les chronologies"""
+        tid = cmd["target_id"]
+        action = cmd["action"]
+        self.commands_total[action] += 1
+        self.cmd_seq += 1
+        stamped = dict(cmd, seq=self.cmd_seq, ts=int(now * 1000))
+        if tid in self.last_seq:
+            stamped["re"] = self.last_seq[tid]
+
+        if action == GO:
+            if self.idle_since is not None and now > self.idle_since:
+                self.histograms["lock_idle"].observe(now - self.idle_since)  # GO immediat exclu
+            self.idle_since = None
+            for rid in (list(self.waiting) if tid == TARGET_ALL else (tid,)):
+                self._go(rid, now)
+        return stamped
+
+    def prune(self, engine, now: float):
+        """Apres un bail expire ou un robot oublie : retire ce que le moteur ne suit plus"""
+        autorises = engine.robots if engine.mode in MODES_FEU else engine.baux
+        self.in_zone.intersection_update(autorises)
+        self.waiting.intersection_update(engine.robots)
+        for rid in [r for r in self.cycles if r not in engine.robots]:
+            del self.cycles[rid]
+        self._update_idle(now)
+
+    # =========================================================================
+    # INTERNE
+    # =========================================================================
+
+    def _new_cycle(self, rid, voie) -> Timeline:
+        tl = Timeline(rid, voie)
+        self.cycles[rid] = tl
+        self.cycles.move_to_end(rid)
+        if len(self.cycles) > TIMELINES_MAX:
+            old, _ = self.cycles.popitem(last=False)
+            self.waiting.discard(old)
+            self.in_zone.discard(old)
+        return tl
+
+    def _go(self, rid, now):
+        tl = self.cycles.get(rid)
+        self.waiting.discard(rid)
+        self.in_zone.add(rid)
+        if tl is None or tl.go is not None:
+            return
+        tl.go = now
+        if tl.requete is not None:
+            self.histograms["go_latency"].observe(now - tl.requete)
+        if tl.etape2 is not None and not tl.pass_through:
+            self.histograms["stop_wait"].observe(now - tl.etape2)
+
+    def _update_idle(self, now):
+        """Debut de lock-idle : zone vide et au moins un robot en attente"""
+        if self.in_zone or not self.waiting:
+            if not self.waiting:
+                self.idle_since = None
+            return
+        if self.idle_since is None:
+            self.idle_since = now
+
+    def _check_seq(self, rid, seq):
+        if not isinstance(seq, int):
+            return
+        last = self.last_seq.get(rid)
+        self.last_seq[rid] = seq
+        self.last_seq.move_to_end(rid)
+        if len(self.last_seq) > TIMELINES_MAX:
+            self.last_seq.popitem(last=False)
+        if last is None:
+            return
+        delta = (seq - last) % SEQ_MOD
+        if delta == 0:
+            self.status_duplicate += 1
+        elif delta < SEQ_RESTART:
+            self.status_lost += delta - 1
+        # Sinon : robot redemarre (compteur repris a zero) ou message tres en retard
+
+    def timelines(self) -> dict:
+        return {"en_cours": [tl.as_dict() for tl in self.cycles.values()],
+                "termines": list(self.recent)}
+
+
+# =============================================================================
+# RENDU PROMETHEUS
+# =============================================================================
+
+def _le(bound: float) -> str:
+    return repr(float(bound))
+
+
+def render_prometheus(intersections) -> str:
+    """intersections : [(xid, IntersectionMetrics, IntersectionEngine)] -> texte Prometheus 0.0.4"""
+    lines = []
+
+    def family(name, kind, text):
+        lines.append("# HELP %s %s" % (name, text))
+        lines.append("# TYPE %s %s" % (name, kind))
+
+    for key, name, text, bounds in HISTOGRAMS:
+        family(name, "histogram", text)
+        for xid, m, _ in intersections:
+            h = m.histograms[key]
+            total = 0
+            for bound, n in zip(bounds, h.counts):
+                total += n
+                lines.append('%s_bucket{intersection="%s",le="%s"} %d' % (name, xid, _le(bound), total))
+            lines.append('%s_bucket{intersection="%s",le="+Inf"} %d' % (name, xid, h.count))
+            lines.append('%s_sum{intersection="%s"} %r' % (name, xid, h.sum))
+            lines.append('%s_count{intersection="%s"} %d' % (name, xid, h.count))
+
+    family("intersection_status_total", "counter", "Status recus par etape")
+    for xid, m, _ in intersections:
+        for etape, n in sorted(m.status_total.items(), key=lambda kv: str(kv[0])):
+            lines.append('intersection_status_total{intersection="%s",etape="%s"} %d' % (xid, etape, n))
+    family("intersection_commands_total", "counter", "Commandes publiees par action")
+    for xid, m, _ in intersections:
+        for action, n in sorted(m.commands_total.items()):
+            lines.append('intersection_commands_total{intersection="%s",action="%s"} %d' % (xid, action, n))
+
+    simples = (
+        ("intersection_status_lost_total", "counter", "Status manquants (trous dans seq)",
+         lambda m, e: m.status_lost),
+        ("intersection_status_duplicate_total", "counter", "Status recus en double (meme seq)",
+         lambda m, e: m.status_duplicate),
+        ("intersection_reclamations_total", "counter", "Baux expires et robots oublies",
+         lambda m, e: e.reclamations),
+        ("intersection_robots", "gauge", "Robots suivis par le moteur", lambda m, e: len(e.robots)),
+        ("intersection_waiting_robots", "gauge", "Robots en attente de GO", lambda m, e: len(m.waiting)),
+        ("intersection_zone_robots", "gauge", "Robots autorises pas encore sortis", lambda m, e: len(m.in_zone)),
+    )
+    for name, kind, text, value in simples:
+        family(name, kind, text)
+        for xid, m, e in intersections:
+            lines.append('%s{intersection="%s"} %d' % (name, xid, value(m, e)))
+
+    family("intersection_mode", "gauge", "Mode actif (1 pour le mode courant)")
+    for xid, _, e in intersections:
+        lines.append('intersection_mode{intersection="%s",mode="%s"} 1' % (xid, e.mode))
+    return "\n".join(lines) + "\n"
+
+
+# =============================================================================
+# SERVEUR HTTP
+# =============================================================================
+
+class MetricsServer:
+    """GET /metrics (Prometheus) et GET /timelines (JSON), sur la boucle asyncio du service"""
+
+    REQUEST_TIMEOUT = 5.0
+
+    def __init__(self, source, host: str = "127.0.0.1", port: int = 0):
+        """source() -> [(xid, IntersectionMetrics, IntersectionEngine)]"""
+        self.source = source
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # En-tetes ignores
+        return line.decode("latin-1").split()
+
+    def _response(self, request):
+        if len(request) < 2 or request[0] != "GET":
+            return "405 Method Not Allowed", "text/plain", b"GET uniquement\n"
+        path = request[1].split("?")[0]
+        if path == "/metrics":
+            body = render_prometheus(self.source()).encode()
+            return "200 OK", "text/plain; version=0.0.4; charset=utf-8", body
+        if path == "/timelines":
+            data = {xid: m.timelines() for xid, m, _ in self.source()}
+            return "200 OK", "application/json", json.dumps(data).encode()
+        return "404 Not Found", "text/plain", b"/metrics ou /timelines\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(self._read_request(reader), self.REQUEST_TIMEOUT)
+            status, ctype, body = self._response(request)
+            writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                          "Connection: close\r\n\r\n" % (status, ctype, len(body))).encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
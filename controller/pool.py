@@ -0,0 +1,134 @@
+"""
+Pool de controleurs - Plusieurs intersections sur un broker
+UTBM - Master VASA
+
+Les intersections sont reparties entre des processus par hachage stable de
+leur id (crc32, identique d'un lancement a l'autre). Chaque processus est un
+ControllerService complet : sa connexion MQTT, abonnee aux seules
+intersections de sa partition, et pour chacune son moteur, son mode et son
+journal. Aucun etat partage : le broker fait le tri, et une intersection
+chargee n'ajoute pas de latence a celles des autres processus.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import zlib
+
+from .engine import IntersectionEngine
+from .journal import SNAPSHOT_EVERY
+from .service import ControllerService, BROKER_HOST, BROKER_PORT, METRICS_HOST
+
+log = logging.getLogger("controller")
+
+START_TIMEOUT = 10.0    # s, connexion de tous les processus au broker
+STOP_TIMEOUT = 5.0      # s, arret propre (snapshots) avant SIGKILL
+
+
+def shard(xid: str, workers: int) -> int:
+    """Processus charge de l'intersection xid"""
+    return zlib.crc32(xid.encode()) % workers
+
+
+def partition(modes: dict, workers: int) -> list:
+    """{xid: mode} -> une table {xid: mode} par processus (vides exclues)"""
+    parts = [{} for _ in range(workers)]
+    for xid, mode in modes.items():
+        parts[shard(xid, workers)][xid] = mode
+    return [p for p in parts if p]
+
+
+def _worker(index: int, modes: dict, options: dict, ready, log_level: int):
+    """Point d'entree d'un processus : un ControllerService pour sa partition"""
+    logging.basicConfig(level=log_level, format="[%%(asctime)s] [W%d] %%(message)s" % index)
+    if options.get("metrics_port"):
+        options = dict(options, metrics_port=options["metrics_port"] + index)  # Un port par processus
+
+    async def serve():
+        service = ControllerService({xid: IntersectionEngine(mode) for xid, mode in modes.items()},
+                                    **options)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(service.stop()))
+        try:
+            await service.start()
+        except ConnectionError as e:
+            ready.put((index, str(e)))
+            return 1
+        ready.put((index, None))
+        await service.wait_stopped()
+        return 0
+
+    raise SystemExit(asyncio.run(serve()))
+
+
+class ControllerPool:
+    """Processus ControllerService, intersections reparties par shard()"""
+
+    def __init__(self, modes: dict, workers: int, host: str = BROKER_HOST,
+                 port: int = BROKER_PORT, legacy_topic: bool = False,
+                 journal_dir: str = None, snapshot_every: int = SNAPSHOT_EVERY,
+                 metrics_port: int = None, metrics_host: str = METRICS_HOST):
+        """
+        modes : {xid: mode} ; workers : nombre de processus (au plus un par intersection).
+        metrics_port : le processus i sert ses metriques sur metrics_port + i.
+        """
+        self.parts = partition(modes, max(1, workers))
+        self.options = {"host": host, "port": port, "legacy_topic": legacy_topic,
+                        "journal_dir": journal_dir, "snapshot_every": snapshot_every,
+                        "metrics_port": metrics_port, "metrics_host": metrics_host}
+        # spawn : pas de copie des threads du parent (paho, broker de test)
+        self._ctx = multiprocessing.get_context("spawn")
+        self.processes = []
+
+    def start(self, timeout: float = START_TIMEOUT):
+        """Lance les processus et attend leur connexion au broker"""
+        ready = self._ctx.Queue()
+        level = logging.getLogger("controller").getEffectiveLevel()
+        for index, modes in enumerate(self.parts):
+            p = self._ctx.Process(target=_worker, name="controller-%d" % index,
+                                  args=(index, modes, self.options, ready, level), daemon=True)
+            p.start()
+            self.processes.append(p)
+        try:
+            for _ in self.processes:
+                index, error = ready.get(timeout=timeout)
+                if error:
+                    raise ConnectionError("Processus %d: %s" % (index, error))
+        except queue.Empty:
+            self.stop()
+            raise ConnectionError("Processus non connectes apres %.0fs" % timeout)
+        except ConnectionError:
+            self.stop()
+            raise
+        for index, modes in enumerate(self.parts):
+            log.info("[POOL] Processus %d (pid %d): %s", index, self.processes[index].pid,
+                     ", ".join("%s=%s" % (xid, mode) for xid, mode in modes.items()))
+
+    def join(self):
+        """Attend la fin des processus (arret par stop() ou signal)"""
+        for p in self.processes:
+            p.join()
+            if p.exitcode:
+                log.error("[POOL] %s termine (code %s)", p.name, p.exitcode)
+
+    def stop(self, timeout: float = STOP_TIMEOUT):
+        """Arret propre (SIGTERM : snapshot des journaux), SIGKILL au-dela de timeout"""
+        for p in self.processes:
+            if p.is_alive():
+                p.terminate()
+        for p in self.processes:
+            p.join(timeout)
+            if p.is_alive():
+                p.kill()
+                p.join()
+        self.processes = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
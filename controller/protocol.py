@@ -0,0 +1,216 @@
+"""
+Protocole MQTT - Intersection Cooperative VA55
+UTBM - Master VASA
+
+Topics et (de)serialisation des messages, identiques a protocol.md.
+
+Deux encodages coexistent sur les memes topics :
+  - JSON (defaut, lisible pour le debug)
+  - binaire compact a disposition fixe, reconnu a son octet de version
+    (un message JSON commence toujours par '{')
+"""
+
+import json
+import struct
+
+# Plusieurs intersections sur un broker : topics prefixes par l'id de l'intersection
+#   intersection/<xid>/status          Robot -> Controleur
+#   intersection/<xid>/command/<id>    Controleur -> Robot (ALL : diffusion)
+#   intersection/<xid>/command         topic partage historique (migration)
+TOPIC_ROOT = "intersection"
+INTERSECTION_ID = "X1"                  # Intersection par defaut (une seule piste)
+
+# Topics d'avant les intersections (robots non migres, --legacy-topic) :
+# rattaches a l'intersection par defaut
+LEGACY_STATUS_TOPIC = TOPIC_ROOT + "/status"
+LEGACY_COMMAND_TOPIC = TOPIC_ROOT + "/command"
+
+TARGET_ALL = "ALL"
+STATUS_STAMP = ("seq", "ts")            # Estampille des status (metriques seulement)
+
+
+def status_topic(xid: str = INTERSECTION_ID) -> str:
+    return "%s/%s/status" % (TOPIC_ROOT, xid)
+
+
+def shared_command_topic(xid: str = INTERSECTION_ID) -> str:
+    """Topic partage historique d'une intersection (--legacy-topic)"""
+    return "%s/%s/command" % (TOPIC_ROOT, xid)
+
+
+def parse_topic(topic: str):
+    """
+    (xid, "status" | "command", target_id) d'un topic du protocole, sinon None.
+    target_id vaut None pour un status et pour le topic partage. Les topics
+    d'avant les intersections designent l'intersection par defaut.
+    """
+    if topic == LEGACY_STATUS_TOPIC:
+        return INTERSECTION_ID, "status", None
+    if topic == LEGACY_COMMAND_TOPIC:
+        return INTERSECTION_ID, "command", None
+    parts = topic.split("/")
+    if len(parts) < 3 or parts[0] != TOPIC_ROOT or not parts[1]:
+        return None
+    if parts[2] == "status" and len(parts) == 3:
+        return parts[1], "status", None
+    if parts[2] == "command" and len(parts) <= 4:
+        return parts[1], "command", parts[3] if len(parts) == 4 else None
+    return None
+
+
+# Topics de l'intersection par defaut (outils mono-intersection)
+TOPIC_STATUS = status_topic()
+TOPIC_COMMAND = shared_command_topic()
+
+# Un topic par robot (intersection/<xid>/command/<id>) + diffusion (.../command/ALL) :
+# chaque robot ne recoit que ses commandes et les diffusions de son intersection.
+TOPIC_BROADCAST = TOPIC_COMMAND + "/" + TARGET_ALL
+
+# Actions disponibles
+GO = "GO"
+STOP = "STOP"
+RESET = "RESET"
+
+# =============================================================================
+# ENCODAGE BINAIRE (version 1)
+# =============================================================================
+#
+# Status  : version u8 | etape u8 | cause u8 | voie u8 (ASCII) | dist_us u16
+#           | seq u16 | len(id) u8 | id (UTF-8)
+# Command : version u8 | action u8 | len(target_id) u8 | target_id (UTF-8)
+#
+# Entiers en big-endian. dist_us sature a 65535.
+
+BINARY_VERSION = 1
+
+STATUS_HEADER = struct.Struct("!BBBBHHB")
+COMMAND_HEADER = struct.Struct("!BBB")
+
+CAUSES = ("unknown", "marker_entry", "obstacle", "marker_stop", "pass_through", "marker_exit")
+ACTIONS = ("", GO, STOP, RESET)
+
+_CAUSE_CODES = {c: i for i, c in enumerate(CAUSES)}
+_ACTION_CODES = {a: i for i, a in enumerate(ACTIONS)}
+
+
+def is_binary(payload: bytes) -> bool:
+    return payload[:1] == bytes((BINARY_VERSION,))
+
+
+def encode_status_binary(data: dict, seq: int = 0) -> bytes:
+    rid = data["id"].encode()
+    return STATUS_HEADER.pack(
+        BINARY_VERSION,
+        data["etape"],
+        _CAUSE_CODES.get(data.get("cause"), 0),
+        ord(data["voie"]),
+        min(int(data.get("dist_us", 9999)), 0xFFFF),
+        seq & 0xFFFF,
+        len(rid),
+    ) + rid
+
+
+def _decode_status_binary(payload: bytes) -> dict:
+    _, etape, cause, voie, dist_us, seq, n = STATUS_HEADER.unpack_from(payload)
+    rid = payload[STATUS_HEADER.size:STATUS_HEADER.size + n].decode()
+    return {
+        "id": rid,
+        "voie": chr(voie),
+        "etape": etape,
+        "cause": CAUSES[cause] if cause < len(CAUSES) else "unknown",
+        "dist_us": dist_us,
+        "seq": seq,
+    }
+
+
+def encode_command_binary(cmd: dict) -> bytes:
+    tid = cmd["target_id"].encode()
+    return COMMAND_HEADER.pack(BINARY_VERSION, _ACTION_CODES[cmd["action"]], len(tid)) + tid
+
+
+# =============================================================================
+# API COMMUNE
+# =============================================================================
+
+def command_topic(target_id: str, xid: str = INTERSECTION_ID) -> str:
+    """Topic de commande d'un robot (ou de diffusion pour ALL)"""
+    return shared_command_topic(xid) + "/" + target_id
+
+
+def command(target_id: str, action: str) -> dict:
+    """Construit une commande {target_id, action}"""
+    return {"target_id": target_id, "action": action}
+
+
+def encode_command(cmd: dict, binary: bool = False) -> bytes:
+    if binary:
+        return encode_command_binary(cmd)
+    return json.dumps(cmd, separators=(",", ":")).encode()
+
+
+def encode_status(data: dict, binary: bool = False, seq: int = 0) -> bytes:
+    if binary:
+        return encode_status_binary(data, seq)
+    return json.dumps(data).encode()
+
+
+def decode_status(payload: bytes):
+    """Decode un message status (JSON ou binaire). Retourne None si invalide."""
+    try:
+        if is_binary(payload):
+            return _decode_status_binary(payload)
+        data = json.loads(payload)
+    except (ValueError, UnicodeDecodeError, struct.error, IndexError):
+        return None
+    if not isinstance(data, dict) or not data.get("id"):
+        return None
+    return data
+
+
+def split_stamp(data: dict) -> dict:
+    """
+    Retire l'estampille du robot (seq, ts) d'un status decode et la retourne :
+    elle ne sert qu'aux metriques, le moteur et le journal ne la voient pas.
+    """
+    return {k: data.pop(k) for k in STATUS_STAMP if k in data}
+
+
+def decode_command(payload: bytes):
+    """Decode une commande (JSON ou binaire). Retourne None si invalide."""
+    try:
+        if is_binary(payload):
+            _, action, n = COMMAND_HEADER.unpack_from(payload)
+            tid = payload[COMMAND_HEADER.size:COMMAND_HEADER.size + n].decode()
+            return command(tid, ACTIONS[action])
+        cmd = json.loads(payload)
+    except (ValueError, UnicodeDecodeError, struct.error, IndexError):
+        return None
+    if not isinstance(cmd, dict) or "target_id" not in cmd:
+        return None
+    return cmd
+
+
+class ReplyFormat:
+    """
+    Negociation par robot : les commandes sont encodees dans le format du
+    dernier status recu de leur destinataire (JSON par defaut).
+    """
+
+    def __init__(self):
+        self.binary_ids = set()
+
+    def observe(self, robot_id: str, payload: bytes):
+        if is_binary(payload):
+            self.binary_ids.add(robot_id)
+        else:
+            self.binary_ids.discard(robot_id)
+
+    def encode(self, cmd: dict) -> list:
+        """Payloads a publier pour cette commande"""
+        tid = cmd["target_id"]
+        if tid == TARGET_ALL:
+            payloads = [encode_command(cmd)]
+            if self.binary_ids:
+                payloads.append(encode_command_binary(cmd))
+            return payloads
+        return [encode_command(cmd, tid in self.binary_ids)]
@@ -0,0 +1,229 @@
+"""
+Service asyncio du controleur - Intersection Cooperative VA55
+UTBM - Master VASA
+
+Relie les moteurs de decision (un par intersection) au broker MQTT :
+  intersection/<xid>/status      -> IntersectionEngine.on_status de <xid>
+  timer (1s en FEU, 0.1s sinon)  -> IntersectionEngine.on_tick
+  commandes                      -> intersection/<xid>/command/<id> (ALL : .../command/ALL)
+
+Le service ne s'abonne qu'aux intersections qu'il sert : plusieurs services
+(controller/pool.py) se partagent un broker sans recevoir le trafic des autres.
+Chaque intersection a ses metriques (controller/metrics.py), servies en HTTP
+si metrics_port est donne.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import paho.mqtt.client as mqtt
+
+from .engine import IntersectionEngine, MODES_FEU
+from .journal import Journal, SNAPSHOT_EVERY
+from .metrics import IntersectionMetrics, MetricsServer
+from .protocol import (
+    INTERSECTION_ID, LEGACY_COMMAND_TOPIC, LEGACY_STATUS_TOPIC,
+    ReplyFormat, command_topic, decode_status, parse_topic, shared_command_topic, split_stamp,
+    status_topic
+)
+
+log = logging.getLogger("controller")
+
+BROKER_HOST = "localhost"
+BROKER_PORT = 1883
+METRICS_HOST = "127.0.0.1"
+
+
+class Intersection:
+    """Une intersection servie : moteur, journal, format des reponses et metriques"""
+
+    __slots__ = ("xid", "engine", "journal", "formats", "pending", "metrics")
+
+    def __init__(self, xid: str, engine: IntersectionEngine, journal: Journal = None):
+        self.xid = xid
+        self.engine = engine
+        self.journal = journal            # Reprise apres crash (optionnel)
+        self.formats = ReplyFormat()      # JSON ou binaire, par robot
+        self.pending = journal.recover(engine) if journal else []  # A republier apres reprise
+        self.metrics = IntersectionMetrics(xid)
+
+
+class ControllerService:
+    """Controleur headless : MQTT (thread paho) -> boucle asyncio -> moteurs"""
+
+    def __init__(self, engines: dict, host: str = BROKER_HOST,
+                 port: int = BROKER_PORT, tick_interval: float = None,
+                 legacy_topic: bool = False, journal_dir: str = None,
+                 snapshot_every: int = SNAPSHOT_EVERY, metrics_port: int = None,
+                 metrics_host: str = METRICS_HOST):
+        """
+        engines : {xid: IntersectionEngine}, chaque intersection avec son mode.
+        journal_dir : journal + snapshots de chaque intersection dans journal_dir/<xid>.
+        metrics_port : GET /metrics et /timelines sur metrics_host:metrics_port (0 : port libre).
+        """
+        self.host = host
+        self.port = port
+        self.tick_interval = tick_interval  # Sinon celui du mode ("Tick 1s" / "Tick 100ms")
+        # Migration : publie aussi sur intersection/<xid>/command ; pour l'intersection
+        # par defaut, sert aussi les robots non migres (intersection/status, intersection/command)
+        self.legacy_topic = legacy_topic
+        self.intersections = {}
+        for xid, engine in engines.items():
+            journal = Journal(os.path.join(journal_dir, xid), snapshot_every) if journal_dir else None
+            self.intersections[xid] = Intersection(xid, engine, journal)
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(self.metrics_sources, metrics_host, metrics_port)
+        self.client = mqtt.Client(
+            client_id=f"controller_{os.getpid()}_{int(time.time())}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self._loop = None
+        self._connected = None
+        self._stopped = None
+        self._tick_tasks = []
+
+    # =========================================================================
+    # CALLBACKS PAHO (thread reseau)
+    # =========================================================================
+
+    def _on_connect(self, client, userdata, flags, rc, props=None):
+        if rc == 0:
+            topics = [status_topic(xid) for xid in self.intersections]
+            if self.legacy_topic and INTERSECTION_ID in self.intersections:
+                topics.append(LEGACY_STATUS_TOPIC)
+            client.subscribe([(t, 1) for t in topics])
+            log.info("[MQTT] Connecte %s:%d (%d intersection(s))",
+                     self.host, self.port, len(self.intersections))
+            self._loop.call_soon_threadsafe(self._connected.set)
+        else:
+            log.error("[MQTT] Connexion refusee: %s", rc)
+
+    def _on_message(self, client, userdata, msg):
+        parsed = parse_topic(msg.topic)
+        inter = self.intersections.get(parsed[0]) if parsed else None
+        if inter is None:
+            return
+        # Les moteurs ne sont manipules que depuis la boucle asyncio
+        self._loop.call_soon_threadsafe(self._handle_status, inter, msg.payload)
+
+    # =========================================================================
+    # BOUCLE ASYNCIO
+    # =========================================================================
+
+    def _handle_status(self, inter: Intersection, payload: bytes, now: float = None):
+        data = decode_status(payload)
+        if data is None:
+            return
+        inter.formats.observe(data["id"], payload)
+        stamp = split_stamp(data)  # seq, ts : metriques seulement (reprise deterministe)
+        now = time.time() if now is None else now
+        if inter.journal:
+            inter.journal.record_status(data, now)  # Avant traitement (write-ahead)
+        t0 = time.perf_counter()
+        commands = inter.engine.on_status(data, now)
+        inter.metrics.on_status(data, now, time.perf_counter() - t0, stamp.get("seq"))
+        self._publish(inter, commands, now)
+
+    def _publish(self, inter: Intersection, commands: list, now: float = None):
+        now = time.time() if now is None else now
+        for cmd in commands:
+            topic = command_topic(cmd["target_id"], inter.xid)
+            stamped = inter.metrics.on_command(cmd, now)  # seq, ts, re (hors journal)
+            for payload in inter.formats.encode(stamped):
+                self.client.publish(topic, payload, qos=1)
+                if self.legacy_topic:
+                    self.client.publish(shared_command_topic(inter.xid), payload, qos=1)
+                    if inter.xid == INTERSECTION_ID:
+                        self.client.publish(LEGACY_COMMAND_TOPIC, payload, qos=1)
+            if inter.journal:
+                inter.journal.record_command(cmd)
+            log.info("[CMD] %s %s: %s", inter.xid, cmd["target_id"], cmd["action"])
+        if inter.journal:
+            inter.journal.maybe_snapshot(inter.engine)
+
+    def _tick(self, inter: Intersection, now: float):
+        engine = inter.engine
+        reclamations, renouvellements = engine.reclamations, engine.renouvellements
+        t0 = time.perf_counter()
+        commands = engine.on_tick(now)
+        inter.metrics.on_tick(time.perf_counter() - t0)
+        if engine.reclamations != reclamations:
+            inter.metrics.prune(engine, now)
+        # Hors modes a feux, un tick sans commande, bail expire, robot oublie
+        # ni TTL renouvele ne change pas l'etat : non journalise
+        if inter.journal and (commands or engine.mode in MODES_FEU
+                              or engine.reclamations != reclamations
+                              or engine.renouvellements != renouvellements):
+            inter.journal.record_tick(now)
+        self._publish(inter, commands, now)
+
+    async def _tick_loop(self, interval: float, group: list):
+        # Une tache par periode : toutes les intersections du groupe a chaque tick
+        next_tick = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            next_tick += interval
+            now = time.time()
+            for inter in group:
+                self._tick(inter, now)
+
+    def metrics_sources(self) -> list:
+        return [(xid, inter.metrics, inter.engine) for xid, inter in self.intersections.items()]
+
+    async def start(self, timeout: float = 3.0):
+        """Connexion au broker, demarrage des timers et du serveur de metriques"""
+        self._loop = asyncio.get_running_loop()
+        self._connected = asyncio.Event()
+        self._stopped = asyncio.Event()
+        if self.metrics_server:
+            try:
+                port = await self.metrics_server.start()
+            except OSError as e:
+                raise ConnectionError("Serveur de metriques: %s" % e)
+            log.info("[METRICS] http://%s:%d/metrics", self.metrics_server.host, port)
+        self.client.connect(self.host, self.port, 60)
+        self.client.loop_start()
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.client.loop_stop()
+            if self.metrics_server:
+                await self.metrics_server.stop()
+            raise ConnectionError("Broker injoignable: %s:%d" % (self.host, self.port))
+        groups = {}
+        for inter in self.intersections.values():
+            groups.setdefault(self.tick_interval or inter.engine.tick_interval, []).append(inter)
+        self._tick_tasks = [asyncio.create_task(self._tick_loop(interval, group))
+                            for interval, group in groups.items()]
+        for inter in self.intersections.values():
+            log.info("[CTRL] %s: mode %s actif", inter.xid, inter.engine.mode)
+            if inter.pending:
+                self._publish(inter, inter.pending)
+                inter.pending = []
+
+    async def stop(self):
+        for task in self._tick_tasks:
+            task.cancel()
+        self._tick_tasks = []
+        self.client.loop_stop()
+        self.client.disconnect()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        for inter in self.intersections.values():
+            if inter.journal:
+                inter.journal.close(inter.engine)
+        if self._stopped:
+            self._stopped.set()
+
+    async def wait_stopped(self):
+        await self._stopped.wait()
+
+    async def run(self):
+        """Demarre le service et tourne jusqu'a stop()"""
+        await self.start()
+        await self.wait_stopped()
@@ -0,0 +1,162 @@
+"""
+Temps de parcours appris - Intersection Cooperative VA55
+UTBM - Master VASA
+
+Moyennes mobiles exponentielles (EMA) des temps entre marqueurs, par robot
+et par voie :
+  - approche  : etape 1 -> etape 2 (arrivee a la ligne d'arret)
+  - traversee : etape 2 -> etape 3, robot passe sans s'arreter (GO recu avant la ligne)
+  - demarrage : GO -> etape 3, robot arrete a la ligne (latence + redemarrage)
+  - occupation: GO -> etape 3, quel que soit le moment du GO (duree des baux)
+
+Chaque estimateur suit aussi l'ecart moyen, comme le RTO de TCP : les
+decisions utilisent des bornes prudentes (moyenne -/+ K_ECART * ecart).
+Les estimations survivent au reset du moteur (elles decrivent la piste et
+les robots, pas la session). Les estimations par robot sont bornees aux
+ROBOTS_MAX robots les plus recemment vus.
+"""
+
+ALPHA = 0.25            # Poids d'un nouvel echantillon (moyenne)
+BETA = 0.25             # Poids d'un nouvel echantillon (ecart)
+K_ECART = 2.0           # Largeur des bornes, en ecarts moyens
+ECHANTILLONS_MIN = 3    # Pas de prediction avant ce nombre d'echantillons
+ROBOTS_MAX = 1000       # Robots suivis individuellement (les plus anciens sont oublies)
+
+APPROCHE = "approche"
+TRAVERSEE = "traversee"
+DEMARRAGE = "demarrage"
+OCCUPATION = "occupation"
+
+
+class EMA:
+    """Moyenne et ecart moyen exponentiels d'une duree (s)"""
+
+    __slots__ = ("moyenne", "ecart", "n")
+
+    def __init__(self, moyenne: float = 0.0, ecart: float = 0.0, n: int = 0):
+        self.moyenne = moyenne
+        self.ecart = ecart
+        self.n = n
+
+    def ajouter(self, x: float):
+        if self.n == 0:
+            self.moyenne, self.ecart = x, x / 2
+        else:
+            self.ecart += BETA * (abs(x - self.moyenne) - self.ecart)
+            self.moyenne += ALPHA * (x - self.moyenne)
+        self.n += 1
+
+    @property
+    def fiable(self) -> bool:
+        return self.n >= ECHANTILLONS_MIN
+
+    def borne_basse(self) -> float:
+        return self.moyenne - K_ECART * self.ecart
+
+    def borne_haute(self) -> float:
+        return self.moyenne + K_ECART * self.ecart
+
+
+class Trajets:
+    """Estimations par robot (prioritaires) et par voie, et passage en cours"""
+
+    def __init__(self):
+        self.robots = {}    # id -> {APPROCHE|TRAVERSEE|DEMARRAGE|OCCUPATION: EMA}, du moins recent au plus recent
+        self.voies = {}     # voie -> {APPROCHE|TRAVERSEE|DEMARRAGE|OCCUPATION: EMA}
+        self.passage = {}   # id -> [voie, t_etape1, t_ligne, t_go] du passage en cours
+
+    def _apprendre(self, robot_id, voie, kind, x):
+        if x < 0:
+            return
+        # Robot le plus recent en fin de table, le plus ancien oublie au-dela de ROBOTS_MAX
+        self.robots[robot_id] = self.robots.pop(robot_id, None) or {}
+        if len(self.robots) > ROBOTS_MAX:
+            del self.robots[next(iter(self.robots))]
+        for table, key in ((self.robots, robot_id), (self.voies, voie)):
+            ema = table.setdefault(key, {}).get(kind)
+            if ema is None:
+                ema = table[key][kind] = EMA()
+            ema.ajouter(x)
+
+    def estimation(self, robot_id, voie, kind):
+        """EMA fiable du robot, sinon de sa voie, sinon None"""
+        for table, key in ((self.robots, robot_id), (self.voies, voie)):
+            ema = table.get(key, {}).get(kind)
+            if ema is not None and ema.fiable:
+                return ema
+        return None
+
+    # --- Evenements ---
+
+    def etape1(self, robot_id, voie, now):
+        p = self.passage.get(robot_id)
+        if p is None or p[2] is not None:  # Un obstacle (etape 1 repetee) ne redemarre pas le passage
+            self.passage[robot_id] = [voie, now, None, None]
+
+    def ligne(self, robot_id, voie, now):
+        p = self.passage.setdefault(robot_id, [voie, None, None, None])
+        if p[2] is None:
+            p[2] = now
+            if p[1] is not None:
+                self._apprendre(robot_id, p[0], APPROCHE, now - p[1])
+
+    def go(self, robot_id, now):
+        p = self.passage.get(robot_id)
+        if p is not None and p[3] is None:
+            p[3] = now
+
+    def sortie(self, robot_id, now):
+        p = self.passage.pop(robot_id, None)
+        if p is None:
+            return
+        if p[3] is not None:
+            self._apprendre(robot_id, p[0], OCCUPATION, now - p[3])
+        if p[2] is None:
+            return
+        if p[3] is not None and p[3] > p[2]:
+            self._apprendre(robot_id, p[0], DEMARRAGE, now - p[3])
+        else:
+            self._apprendre(robot_id, p[0], TRAVERSEE, now - p[2])
+
+    # --- Predictions prudentes ---
+
+    def arrivee_min(self, robot_id):
+        """Arrivee a la ligne au plus tot (robot encore en approche), sinon None"""
+        p = self.passage.get(robot_id)
+        if p is None or p[1] is None or p[2] is not None:
+            return None
+        ema = self.estimation(robot_id, p[0], APPROCHE)
+        return None if ema is None else p[1] + ema.borne_basse()
+
+    def sortie_max(self, robot_id):
+        """Sortie de la zone au plus tard (robot autorise), sinon None"""
+        p = self.passage.get(robot_id)
+        if p is None or p[3] is None:
+            return None
+        if p[2] is not None and p[3] > p[2]:
+            debut, kind = p[3], DEMARRAGE          # Arrete a la ligne, repart au GO
+        elif p[2] is not None:
+            debut, kind = p[2], TRAVERSEE          # Passe la ligne lance
+        else:
+            approche = self.estimation(robot_id, p[0], APPROCHE)
+            if approche is None or p[1] is None:
+                return None
+            debut, kind = p[1] + approche.borne_haute(), TRAVERSEE
+        duree = self.estimation(robot_id, p[0], kind)
+        return None if duree is None else debut + duree.borne_haute()
+
+    # --- Sauvegarde (journal) ---
+
+    def state_dict(self) -> dict:
+        def dump(table):
+            return {k: {kind: [e.moyenne, e.ecart, e.n] for kind, e in d.items()}
+                    for k, d in table.items()}
+        return {"robots": dump(self.robots), "voies": dump(self.voies),
+                "passage": {k: list(p) for k, p in self.passage.items()}}
+
+    def load_state(self, state: dict):
+        def load(table):
+            return {k: {kind: EMA(*v) for kind, v in d.items()} for k, d in table.items()}
+        self.robots = load(state["robots"])
+        self.voies = load(state["voies"])
+        self.passage = {k: list(p) for k, p in state["passage"].items()}
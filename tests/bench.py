@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Benchmark de Charge - Latence GO et Débit
+VA55 - UTBM
+
+Génère des centaines/milliers de SimpleRobot selon un processus d'arrivée
+(Poisson, rafales, voies déséquilibrées) et mesure pour chaque mode :
+latence GO (p50/p95/p99), temps d'arrêt à la ligne et débit en robots/min.
+Avec --intersections N, chaque intersection reçoit la même suite d'arrivées.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import random
+import time
+
+from test_unified import TestRunner, C, BROKER_HOST, BROKER_PORT, intersection_ids
+from broker import BrokerThread
+
+MODES = ["FEU", "ADAPTATIF", "FIFO", "PELOTON"]
+ARRIVALS = ["poisson", "burst", "skewed"]
+
+CSV_FIELDS = [
+    "mode", "intersection", "robot", "voie", "success", "pass_through",
+    "t_depart", "t_etape1", "t_etape2", "t_go", "t_redemarrage", "t_etape3",
+    "latence_go", "temps_arret", "rtt_go",
+]
+
+
+# =============================================================================
+# PROCESSUS D'ARRIVÉE
+# =============================================================================
+
+def generate_arrivals(kind: str, count: int, rate: float, seed: int = 0,
+                      burst_size: int = 5, skew: float = 0.8) -> list:
+    """
+    Retourne [(instant_depart_s, voie), ...] trié par instant.
+
+    rate : débit moyen d'arrivée en robots/minute.
+    """
+    rng = random.Random(seed)
+    mean_gap = 60.0 / rate
+    arrivals = []
+    t = 0.0
+
+    if kind == "poisson":
+        for _ in range(count):
+            t += rng.expovariate(1.0 / mean_gap)
+            arrivals.append((t, rng.choice("AB")))
+
+    elif kind == "burst":
+        # Rafales de burst_size robots espacés de 0.2s, même débit moyen
+        while len(arrivals) < count:
+            t += rng.expovariate(1.0 / (mean_gap * burst_size))
+            for k in range(min(burst_size, count - len(arrivals))):
+                arrivals.append((t + 0.2 * k, rng.choice("AB")))
+
+    elif kind == "skewed":
+        for _ in range(count):
+            t += rng.expovariate(1.0 / mean_gap)
+            arrivals.append((t, "A" if rng.random() < skew else "B"))
+
+    else:
+        raise ValueError("Processus d'arrivée inconnu: " + kind)
+
+    return arrivals
+
+
+# =============================================================================
+# STATISTIQUES
+# =============================================================================
+
+def percentile(values: list, p: float):
+    """Percentile (rang le plus proche) d'une liste, None si vide"""
+    if not values:
+        return None
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, math.ceil(p / 100.0 * len(s)) - 1))
+    return s[k]
+
+
+def robot_record(mode: str, robot, t0: float) -> dict:
+    def rel(t):
+        return None if t is None else round(t - t0, 6)
+
+    # Latence GO : GO reçu - dernière requête envoyée avant le GO
+    latence = None
+    if robot.t_go is not None:
+        requete = robot.t_etape2 if (robot.t_etape2 is not None and robot.t_etape2 <= robot.t_go) \
+            else robot.t_etape1
+        if requete is not None:
+            latence = robot.t_go - requete
+
+    arret = None
+    if robot.t_etape2 is not None and robot.t_redemarrage is not None:
+        arret = robot.t_redemarrage - robot.t_etape2
+
+    return {
+        "mode": mode,
+        "intersection": robot.xid,
+        "robot": robot.name,
+        "voie": robot.voie,
+        "success": robot.success,
+        "pass_through": robot.pass_through,
+        "t_depart": rel(robot.t_depart),
+        "t_etape1": rel(robot.t_etape1),
+        "t_etape2": rel(robot.t_etape2),
+        "t_go": rel(robot.t_go),
+        "t_redemarrage": rel(robot.t_redemarrage),
+        "t_etape3": rel(robot.t_etape3),
+        "latence_go": latence,
+        "temps_arret": arret,
+        "rtt_go": robot.rtt_go,
+    }
+
+
+def summarize(mode: str, records: list) -> dict:
+    ok = [r for r in records if r["success"]]
+    latences = [r["latence_go"] for r in ok if r["latence_go"] is not None]
+    arrets = [r["temps_arret"] for r in ok if r["temps_arret"] is not None]
+    rtts = [r["rtt_go"] for r in ok if r["rtt_go"] is not None]
+
+    debit = None
+    if len(ok) > 1:
+        debut = min(r["t_etape1"] for r in ok)
+        fin = max(r["t_etape3"] for r in ok)
+        if fin > debut:
+            debit = len(ok) / (fin - debut) * 60.0
+
+    return {
+        "mode": mode,
+        "robots": len(records),
+        "succes": len(ok),
+        "pass_through": sum(1 for r in ok if r["pass_through"]),
+        "latence_go_p50": percentile(latences, 50),
+        "latence_go_p95": percentile(latences, 95),
+        "latence_go_p99": percentile(latences, 99),
+        "arret_moyen": sum(arrets) / len(arrets) if arrets else None,
+        "arret_p95": percentile(arrets, 95),
+        "rtt_go_p50": percentile(rtts, 50),
+        "rtt_go_p95": percentile(rtts, 95),
+        "debit_robots_min": debit,
+    }
+
+
+# =============================================================================
+# EXÉCUTION
+# =============================================================================
+
+class BenchRunner(TestRunner):
+    """TestRunner piloté par une liste d'arrivées"""
+
+    def __init__(self, mode: str, arrivals: list, sim: bool = False, seed: int = 0,
+                 timeout: float = 600.0, host: str = BROKER_HOST, port: int = BROKER_PORT,
+                 intersections: int = 1):
+        super().__init__(mode, len(arrivals), sim=sim, seed=seed, verbose=False, host=host, port=port,
+                         intersections=intersections)
+        self.arrivals = arrivals
+        self.timeout = timeout
+
+    async def run_arrivals(self):
+        n = len(self.arrivals)
+        tasks = [robot.run(delay_before=self.arrivals[i % n][0], timeout=self.timeout)
+                 for i, robot in enumerate(self.robots.values())]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run_bench(self):
+        """Retourne (résumé, enregistrements par robot) ou None si erreur MQTT"""
+        if not self.connect():
+            return None
+
+        for xid in self.xids:
+            for i, (_, voie) in enumerate(self.arrivals):
+                self.add_robot(f"R{i+1}_{voie}", voie, xid)
+
+        t0 = self.client.time() if self.sim else time.monotonic()
+        self._execute(self.run_arrivals())
+        self.close()
+
+        records = [robot_record(self.mode, r, t0) for r in self.robots.values()]
+        return summarize(self.mode, records), records
+
+
+def _fmt(v, unit="s"):
+    return "-" if v is None else f"{v:.3f}{unit}"
+
+
+def print_summary(s: dict):
+    print(f"  {C.BOLD}{s['mode']:<8}{C.RST} "
+          f"succès {s['succes']}/{s['robots']}  "
+          f"pass-through {s['pass_through']}  "
+          f"débit {_fmt(s['debit_robots_min'], ' r/min')}")
+    print(f"           latence GO p50 {_fmt(s['latence_go_p50'])}  "
+          f"p95 {_fmt(s['latence_go_p95'])}  p99 {_fmt(s['latence_go_p99'])}  "
+          f"arrêt moyen {_fmt(s['arret_moyen'])}")
+    print(f"           aller-retour GO p50 {_fmt(s['rtt_go_p50'])}  p95 {_fmt(s['rtt_go_p95'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--robots", type=int, default=200, help="Robots par intersection")
+    parser.add_argument("--intersections", type=int, default=1, help="Intersections chargées en parallèle")
+    parser.add_argument("--workers", type=int, default=1, help="Processus du contrôleur embarqué (--local)")
+    parser.add_argument("--arrival", choices=ARRIVALS, default="poisson")
+    parser.add_argument("--rate", type=float, default=10.0, help="Débit d'arrivée moyen (robots/min)")
+    parser.add_argument("--burst-size", type=int, default=5, help="Robots par rafale (burst)")
+    parser.add_argument("--skew", type=float, default=0.8, help="Part de la voie A (skewed)")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Timeout par robot (secondes)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sim", action="store_true", help="Simulation horloge virtuelle (sans broker)")
+    parser.add_argument("--local", action="store_true",
+                        help="Broker embarqué + contrôleur Python par mode (temps réel)")
+    parser.add_argument("--json", help="Fichier de sortie JSON")
+    parser.add_argument("--csv", help="Fichier de sortie CSV (un robot par ligne)")
+    args = parser.parse_args()
+
+    if not (args.sim or args.local) and len(args.modes) > 1:
+        parser.error("sans --sim, un seul mode (celui actif sur le contrôleur)")
+
+    arrivals = generate_arrivals(args.arrival, args.robots, args.rate, args.seed,
+                                 args.burst_size, args.skew)
+
+    print(f"\n{C.MAG}{'═'*60}")
+    print(f"  BENCHMARK: {args.robots} robots × {args.intersections} intersection(s), "
+          f"arrivée {args.arrival} ({args.rate} r/min)")
+    print(f"{'═'*60}{C.RST}\n")
+
+    summaries, all_records = [], []
+    for mode in args.modes:
+        if args.local:
+            with BrokerThread(mode=mode, intersections=intersection_ids(args.intersections),
+                              workers=args.workers) as stack:
+                result = BenchRunner(mode, arrivals, timeout=args.timeout, host=stack.host,
+                                     port=stack.port, intersections=args.intersections).run_bench()
+        else:
+            result = BenchRunner(mode, arrivals, args.sim, args.seed, args.timeout,
+                                 intersections=args.intersections).run_bench()
+        if result is None:
+            return 1
+        summary, records = result
+        print_summary(summary)
+        summaries.append(summary)
+        all_records.extend(records)
+    print()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "resultats": summaries, "robots": all_records}, f, indent=2)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(all_records)
+
+    return 0 if all(s["succes"] == s["robots"] for s in summaries) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
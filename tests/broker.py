@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Broker MQTT Embarqué - Tests Hermétiques
+VA55 - UTBM
+
+Sous-ensemble de MQTT 3.1.1 suffisant pour le projet : CONNECT, PUBLISH
+QoS 0/1, SUBSCRIBE/UNSUBSCRIBE avec jokers (+, #), messages retenus,
+PING, DISCONNECT et message de testament. TCP en clair, sans persistance.
+
+Remplace Mosquitto (docker-compose.yml) pour les tests : démarrage en
+quelques millisecondes sur un port éphémère, plusieurs instances isolées
+en parallèle sur une même machine.
+
+    with BrokerThread(mode="FIFO") as stack:   # broker + contrôleur Python
+        runner = TestRunner("FIFO", port=stack.port)
+"""
+
+import asyncio
+import os
+import struct
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Types de paquets MQTT
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+# =============================================================================
+# ENCODAGE
+# =============================================================================
+
+def _packet(ptype: int, flags: int, body: bytes) -> bytes:
+    n = len(body)
+    header = bytearray([(ptype << 4) | flags])
+    while True:
+        b = n % 128
+        n //= 128
+        header.append(b | 0x80 if n else b)
+        if not n:
+            break
+    return bytes(header) + body
+
+
+def _str(s: str) -> bytes:
+    b = s.encode()
+    return struct.pack("!H", len(b)) + b
+
+
+def _publish_packet(topic: str, payload: bytes, qos: int, retain: bool, pid: int) -> bytes:
+    body = _str(topic)
+    if qos:
+        body += struct.pack("!H", pid)
+    return _packet(PUBLISH, (qos << 1) | int(retain), body + payload)
+
+
+class _Reader:
+    """Lecture des champs d'un corps de paquet"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def u8(self) -> int:
+        v = self.data[self.pos]
+        self.pos += 1
+        return v
+
+    def u16(self) -> int:
+        v = struct.unpack_from("!H", self.data, self.pos)[0]
+        self.pos += 2
+        return v
+
+    def bytes_(self) -> bytes:
+        n = self.u16()
+        v = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return v
+
+    def str_(self) -> str:
+        return self.bytes_().decode()
+
+    def rest(self) -> bytes:
+        return self.data[self.pos:]
+
+    def more(self) -> bool:
+        return self.pos < len(self.data)
+
+
+def topic_matches(filtre: str, topic: str) -> bool:
+    """Correspondance d'un filtre (+, #) avec un topic"""
+    if filtre == topic:
+        return True
+    f_parts = filtre.split("/")
+    t_parts = topic.split("/")
+    if topic.startswith("$") and f_parts[0] in ("+", "#"):
+        return False
+    for i, f in enumerate(f_parts):
+        if f == "#":
+            return True
+        if i >= len(t_parts):
+            return False
+        if f != "+" and f != t_parts[i]:
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+# =============================================================================
+# SESSION CLIENT
+# =============================================================================
+
+class _Session:
+    __slots__ = ("client_id", "writer", "subscriptions", "next_pid", "will")
+
+    def __init__(self, client_id: str, writer: asyncio.StreamWriter):
+        self.client_id = client_id
+        self.writer = writer
+        self.subscriptions = {}   # filtre -> qos
+        self.next_pid = 0
+        self.will = None          # (topic, payload, qos, retain)
+
+    def send(self, data: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def deliver(self, topic: str, payload: bytes, qos: int, retain: bool = False):
+        pid = 0
+        if qos:
+            self.next_pid = self.next_pid % 65535 + 1
+            pid = self.next_pid
+        self.send(_publish_packet(topic, payload, qos, retain, pid))
+
+
+# =============================================================================
+# BROKER
+# =============================================================================
+
+class MQTTBroker:
+    """Broker asyncio en mémoire"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.sessions = {}     # client_id -> _Session
+        self.retained = {}     # topic -> (payload, qos)
+        self._server = None
+        self._tasks = set()    # une tache par connexion
+
+    async def start(self) -> int:
+        """Démarre l'écoute ; retourne le port effectif (éphémère si 0)"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        self.sessions.clear()
+
+    # --- Routage ---
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False):
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        for session in list(self.sessions.values()):
+            granted = -1
+            for filtre, sub_qos in session.subscriptions.items():
+                if sub_qos > granted and topic_matches(filtre, topic):
+                    granted = sub_qos
+            if granted >= 0:
+                session.deliver(topic, payload, min(qos, granted))
+
+    # --- Connexion ---
+
+    async def _read_packet(self, reader: asyncio.StreamReader):
+        first = (await reader.readexactly(1))[0]
+        length, mult = 0, 1
+        while True:
+            b = (await reader.readexactly(1))[0]
+            length += (b & 0x7F) * mult
+            if not b & 0x80:
+                break
+            mult *= 128
+        body = await reader.readexactly(length) if length else b""
+        return first >> 4, first & 0x0F, body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        session = None
+        try:
+            ptype, _, body = await asyncio.wait_for(self._read_packet(reader), 10.0)
+            if ptype != CONNECT:
+                return
+            session, keepalive = self._connect(body, writer)
+            timeout = keepalive * 1.5 if keepalive else None
+
+            while True:
+                if timeout:
+                    ptype, flags, body = await asyncio.wait_for(self._read_packet(reader), timeout)
+                else:
+                    ptype, flags, body = await self._read_packet(reader)
+                if ptype == DISCONNECT:
+                    session.will = None
+                    break
+                self._dispatch(session, ptype, flags, body)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError,
+                ValueError, IndexError, struct.error, asyncio.CancelledError):
+            pass  # Deconnexion, paquet invalide ou arret du broker
+        finally:
+            if session and self.sessions.get(session.client_id) is session:
+                del self.sessions[session.client_id]
+                if session.will:
+                    self.publish(*session.will)
+            writer.close()
+            self._tasks.discard(task)
+
+    def _connect(self, body: bytes, writer):
+        r = _Reader(body)
+        r.str_()                      # "MQTT"
+        r.u8()                        # niveau de protocole
+        flags = r.u8()
+        keepalive = r.u16()
+        client_id = r.str_() or "anon_%d" % id(writer)
+        will = None
+        if flags & 0x04:
+            will_topic = r.str_()
+            will = (will_topic, r.bytes_(), (flags >> 3) & 0x03, bool(flags & 0x20))
+        # Nom d'utilisateur / mot de passe ignorés (allow_anonymous)
+
+        old = self.sessions.get(client_id)
+        if old:
+            old.writer.close()
+        session = _Session(client_id, writer)
+        session.will = will
+        self.sessions[client_id] = session
+        session.send(_packet(CONNACK, 0, b"\x00\x00"))
+        return session, keepalive
+
+    def _dispatch(self, session: _Session, ptype: int, flags: int, body: bytes):
+        if ptype == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            r = _Reader(body)
+            topic = r.str_()
+            if qos:
+                pid = r.u16()
+                session.send(_packet(PUBACK, 0, struct.pack("!H", pid)))
+            self.publish(topic, r.rest(), min(qos, 1), bool(flags & 0x01))
+
+        elif ptype == SUBSCRIBE:
+            r = _Reader(body)
+            pid = r.u16()
+            granted = []
+            filtres = []
+            while r.more():
+                filtre = r.str_()
+                qos = min(r.u8() & 0x03, 1)
+                session.subscriptions[filtre] = qos
+                granted.append(qos)
+                filtres.append((filtre, qos))
+            session.send(_packet(SUBACK, 0, struct.pack("!H", pid) + bytes(granted)))
+            for topic, (payload, rqos) in self.retained.items():
+                for filtre, qos in filtres:
+                    if topic_matches(filtre, topic):
+                        session.deliver(topic, payload, min(qos, rqos), retain=True)
+                        break
+
+        elif ptype == UNSUBSCRIBE:
+            r = _Reader(body)
+            pid = r.u16()
+            while r.more():
+                session.subscriptions.pop(r.str_(), None)
+            session.send(_packet(UNSUBACK, 0, struct.pack("!H", pid)))
+
+        elif ptype == PINGREQ:
+            session.send(_packet(PINGRESP, 0, b""))
+
+        # PUBACK des clients : pas de retransmission (TCP local), ignoré
+
+
+# =============================================================================
+# EXECUTION DANS UN THREAD (broker + contrôleur optionnel)
+# =============================================================================
+
+class BrokerThread:
+    """
+    Broker (et contrôleur Python si mode est donné) dans une boucle asyncio
+    dédiée, pour les scripts synchrones comme TestRunner. Avec workers > 1,
+    le contrôleur est un ControllerPool (un processus par partition).
+    """
+
+    def __init__(self, mode: str = None, host: str = "127.0.0.1", port: int = 0,
+                 legacy_topic: bool = False, intersections: list = None, workers: int = 1,
+                 metrics_port: int = None):
+        self.mode = mode
+        self.legacy_topic = legacy_topic
+        self.intersections = intersections  # Ids servis (défaut : intersection par défaut)
+        self.workers = workers
+        self.metrics_port = metrics_port  # GET /metrics du contrôleur (0 : port libre)
+        self.broker = MQTTBroker(host, port)
+        self.controller = None
+        self.pool = None
+        self.loop = None
+        self._thread = None
+
+    @property
+    def host(self) -> str:
+        return self.broker.host
+
+    @property
+    def port(self) -> int:
+        return self.broker.port
+
+    def _modes(self) -> dict:
+        from controller.protocol import INTERSECTION_ID
+        return {xid: self.mode for xid in self.intersections or [INTERSECTION_ID]}
+
+    async def _start(self):
+        await self.broker.start()
+        if self.mode and self.workers <= 1:
+            from controller import IntersectionEngine, ControllerService
+            engines = {xid: IntersectionEngine(mode) for xid, mode in self._modes().items()}
+            self.controller = ControllerService(engines, self.host, self.port,
+                                                legacy_topic=self.legacy_topic,
+                                                metrics_port=self.metrics_port)
+            await self.controller.start()
+
+    async def _stop(self):
+        if self.controller:
+            await self.controller.stop()
+        await self.broker.stop()
+
+    def start(self) -> int:
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(5.0)
+        if self.mode and self.workers > 1:
+            # Processus séparés : démarrés hors de la boucle du broker qu'ils joignent
+            from controller import ControllerPool
+            self.pool = ControllerPool(self._modes(), self.workers, self.host, self.port,
+                                       legacy_topic=self.legacy_topic,
+                                       metrics_port=self.metrics_port)
+            self.pool.start()
+        return self.port
+
+    def stop(self):
+        if not self.loop:
+            return
+        if self.pool:
+            self.pool.stop()
+            self.pool = None
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result(5.0)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    async def serve():
+        broker = MQTTBroker(args.host, args.port)
+        port = await broker.start()
+        print(f"[BROKER] Écoute sur {args.host}:{port}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
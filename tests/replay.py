@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Enregistrement et Rejeu du Trafic MQTT
+VA55 - UTBM
+
+record : capture tout le trafic intersection/# d'une session réelle dans un
+         fichier append-only (enregistrements préfixés par leur longueur,
+         horodatage monotone).
+replay : renvoie les status capturés à un contrôleur (1×, N× ou vitesse max)
+         et compare les commandes produites aux commandes enregistrées,
+         intersection par intersection (l'entrelacement entre intersections
+         servies par des processus différents n'est pas déterministe).
+
+La capture est lue par mmap : une session de plusieurs heures se rejoue
+sans être chargée en mémoire.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import paho.mqtt.client as mqtt
+
+from test_unified import C, BROKER_HOST, BROKER_PORT
+from broker import BrokerThread
+from bench import percentile
+from controller.engine import IntersectionEngine, MODES
+from controller.journal import Journal, JOURNAL_FILE
+from controller.protocol import (
+    STATUS_STAMP, TOPIC_ROOT, decode_status, decode_command, parse_topic, split_stamp
+)
+from controller.service import ControllerService
+
+TOPIC_ALL = TOPIC_ROOT + "/#"
+DRAIN = 1.0                   # s, attente des dernières commandes (rejeu MQTT)
+RECOVERY_EVERY = 10           # Status entre deux reprises simulées (--recovery)
+RECOVERY_SNAPSHOT = 100       # Entrées entre deux snapshots (--recovery)
+
+# =============================================================================
+# FORMAT DU FICHIER
+# =============================================================================
+#
+# En-tête     : magic "VA55REC1" | début (epoch, f64)
+# Enregistr.  : longueur u32 | t f64 (s depuis le début de l'en-tête,
+#               monotone, y compris après reprise du fichier)
+#               | len(topic) u16 | topic (UTF-8) | payload (brut)
+#
+# Entiers et flottants en big-endian. La longueur couvre tout ce qui suit
+# le champ longueur : un enregistrement incomplet (arrêt brutal) est ignoré.
+
+MAGIC = b"VA55REC1"
+FILE_HEADER = struct.Struct("!8sd")
+RECORD_HEADER = struct.Struct("!IdH")
+LENGTH = struct.Struct("!I")
+
+
+class CaptureWriter:
+    """Ajout d'enregistrements (appelé depuis le thread paho)"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            started = time.time()
+            self._file.write(FILE_HEADER.pack(MAGIC, started))
+        else:
+            # Reprise d'une capture : t reste compté depuis le début de son en-tête
+            with open(path, "rb") as f:
+                header = f.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size or header[:len(MAGIC)] != MAGIC:
+                self._file.close()
+                raise ValueError("Pas une capture VA55: " + path)
+            started = FILE_HEADER.unpack(header)[1]
+        self._t0 = time.monotonic() - max(0.0, time.time() - started)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, topic: str, payload: bytes, t: float = None):
+        if t is None:
+            t = time.monotonic() - self._t0
+        topic_b = topic.encode()
+        body = RECORD_HEADER.size - LENGTH.size + len(topic_b) + len(payload)
+        with self._lock:
+            self._file.write(RECORD_HEADER.pack(body, t, len(topic_b)) + topic_b + payload)
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+class Capture:
+    """Lecture d'une capture par mmap ; itération sur (t, topic, payload)"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            raise ValueError("Capture vide ou tronquée: " + path)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.started = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("Pas une capture VA55: " + path)
+
+    def __iter__(self):
+        m = self._map
+        pos, end = FILE_HEADER.size, len(m)
+        while pos + RECORD_HEADER.size <= end:
+            body, t, topic_len = RECORD_HEADER.unpack_from(m, pos)
+            nxt = pos + LENGTH.size + body
+            if nxt > end:
+                break  # Dernier enregistrement incomplet
+            start = pos + RECORD_HEADER.size
+            topic = m[start:start + topic_len].decode()
+            yield t, topic, m[start + topic_len:nxt]
+            pos = nxt
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# =============================================================================
+# ENREGISTREMENT
+# =============================================================================
+
+def record(path: str, host: str, port: int, duration: float = None) -> int:
+    try:
+        writer = CaptureWriter(path)
+    except ValueError as e:
+        print(f"{C.RED}❌ {e}{C.RST}")
+        return 1
+
+    def on_connect(client, userdata, flags, rc, props=None):
+        client.subscribe(TOPIC_ALL, qos=1)
+        print(f"{C.GREEN}✅ Enregistrement de {TOPIC_ALL} → {path}{C.RST}")
+
+    def on_message(client, userdata, msg):
+        if not msg.retain:  # Les messages retenus ne font pas partie de la session
+            writer.write(msg.topic, msg.payload)
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"recorder_{int(time.time())}")
+    client.on_connect = on_connect
+    client.on_message = on_message
+    try:
+        client.connect(host, port, 60)
+    except OSError as e:
+        print(f"{C.RED}❌ MQTT: {e}{C.RST}")
+        writer.close()
+        return 1
+
+    client.loop_start()
+    try:
+        deadline = time.monotonic() + duration if duration else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    writer.close()
+    print(f"{C.GRAY}{writer.count} messages enregistrés{C.RST}")
+    return 0
+
+
+# =============================================================================
+# REJEU
+# =============================================================================
+
+def status_xids(capture: Capture) -> list:
+    """Intersections présentes dans la capture (ordre d'apparition)"""
+    xids = {}
+    for _, topic, _ in capture:
+        parsed = parse_topic(topic)
+        if parsed and parsed[1] == "status":
+            xids[parsed[0]] = None
+    return list(xids)
+
+
+def _keep_per_robot(split: dict) -> dict:
+    """{xid: ([par robot], [partagé])} -> {xid: commandes}"""
+    return {xid: per_robot or legacy for xid, (per_robot, legacy) in split.items()}
+
+
+def recorded_commands(capture: Capture) -> dict:
+    """
+    Commandes enregistrées {xid: [(target_id, action), ...]}.
+    Avec --legacy-topic chaque commande existe sur deux topics : on garde
+    les topics par robot s'il y en a, sinon le topic partagé.
+    """
+    split = defaultdict(lambda: ([], []))
+    for _, topic, payload in capture:
+        parsed = parse_topic(topic)
+        if parsed is None or parsed[1] != "command":
+            continue
+        cmd = decode_command(bytes(payload))
+        if cmd:
+            split[parsed[0]][parsed[2] is None].append((cmd["target_id"], cmd["action"]))
+    return _keep_per_robot(split)
+
+
+def replay_engine(capture: Capture, mode: str):
+    """
+    Rejeu direct sur un IntersectionEngine par intersection, en temps
+    virtuel (vitesse max). Les ticks sont recréés à la période du mode
+    depuis le début de la capture (capture lancée avec le contrôleur).
+    Retourne ({xid: commandes}, durées de décision en s).
+    """
+    engines = {xid: IntersectionEngine(mode) for xid in status_xids(capture)}
+    commands = {xid: [] for xid in engines}
+    costs = []
+    interval = IntersectionEngine(mode).tick_interval
+    next_tick = interval
+    for t, topic, payload in capture:
+        while next_tick <= t:
+            for xid, engine in engines.items():
+                commands[xid].extend((c["target_id"], c["action"]) for c in engine.on_tick(next_tick))
+            next_tick += interval
+        parsed = parse_topic(topic)
+        if parsed is None or parsed[1] != "status":
+            continue
+        data = decode_status(bytes(payload))
+        if data is None:
+            continue
+        split_stamp(data)  # Comme le service : seq/ts ne vont qu'aux métriques
+        t0 = time.perf_counter()
+        out = engines[parsed[0]].on_status(data, t)
+        costs.append(time.perf_counter() - t0)
+        commands[parsed[0]].extend((c["target_id"], c["action"]) for c in out)
+    return commands, costs
+
+
+def replay_recovery(capture: Capture, mode: str, every: int = RECOVERY_EVERY):
+    """
+    Reprise après crash : la capture passe par ControllerService (journal et
+    snapshots, sans broker) en temps virtuel. Tous les `every` status, un
+    moteur neuf est restauré depuis le journal de chaque intersection et
+    comparé au moteur en service. Retourne (durées de reprise en s, écarts).
+    """
+    costs, diffs = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        service = ControllerService({xid: IntersectionEngine(mode) for xid in status_xids(capture)},
+                                    journal_dir=directory, snapshot_every=RECOVERY_SNAPSHOT)
+        service.client.publish = lambda *args, **kwargs: None  # Pas de broker
+        interval = IntersectionEngine(mode).tick_interval
+        next_tick = interval
+        nb_status = 0
+        for t, topic, payload in capture:
+            while next_tick <= t:
+                for inter in service.intersections.values():
+                    service._tick(inter, next_tick)
+                next_tick += interval
+            parsed = parse_topic(topic)
+            if parsed is None or parsed[1] != "status" or parsed[0] not in service.intersections:
+                continue
+            service._handle_status(service.intersections[parsed[0]], bytes(payload), t)
+            nb_status += 1
+            if nb_status % every:
+                continue
+            for xid, inter in service.intersections.items():
+                path = os.path.join(directory, xid)
+                diffs.extend(f"{xid} #{nb_status}: {d}" for d in _stamped_entries(path))
+                engine = IntersectionEngine(mode)
+                journal = Journal(path, RECOVERY_SNAPSHOT)
+                t0 = time.perf_counter()
+                pending = journal.recover(engine)
+                costs.append(time.perf_counter() - t0)
+                journal.close()  # Sans snapshot : le journal reste celui du service
+                expected, got = inter.engine.state_dict(), engine.state_dict()
+                differents = [k for k in expected if expected[k] != got.get(k)]
+                if differents:
+                    diffs.append(f"{xid} #{nb_status}: état repris différent ({', '.join(differents)})")
+                if pending:
+                    diffs.append(f"{xid} #{nb_status}: {len(pending)} commande(s) republiée(s) à tort")
+        for inter in service.intersections.values():
+            inter.journal.close()
+    return costs, diffs
+
+
+def _stamped_entries(directory: str) -> list:
+    """Status journalisés portant encore l'estampille du robot"""
+    found = []
+    with open(os.path.join(directory, JOURNAL_FILE), "rb") as f:
+        for line in f:
+            rec = json.loads(line)
+            if rec[1] == "s" and any(k in rec[3] for k in STATUS_STAMP):
+                found.append(f"status journalisé avec estampille (entrée {rec[0]})")
+    return found
+
+
+def replay_mqtt(capture: Capture, host: str, port: int, speed: float):
+    """
+    Republie les status vers un contrôleur réel (Node-RED ou Python).
+    speed : 1 = temps réel, N = N fois plus vite, 0 = sans attente.
+    Retourne ({xid: commandes}, délais status → commande en s).
+    """
+    # xid -> ([(commande, délai)] par robot, [(commande, délai)] partagé)
+    received = defaultdict(lambda: ([], []))
+    last_sent = [None]
+
+    def on_message(client, userdata, msg):
+        parsed = parse_topic(msg.topic)
+        cmd = decode_command(msg.payload)
+        if parsed and cmd and last_sent[0] is not None:
+            received[parsed[0]][parsed[2] is None].append(
+                ((cmd["target_id"], cmd["action"]), time.monotonic() - last_sent[0]))
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"replay_{int(time.time())}")
+    client.on_message = on_message
+    client.connect(host, port, 60)
+    client.subscribe([(TOPIC_ROOT + "/+/command", 1), (TOPIC_ROOT + "/+/command/#", 1)])
+    client.loop_start()
+    time.sleep(0.2)
+
+    start = time.monotonic()
+    for t, topic, payload in capture:
+        parsed = parse_topic(topic)
+        if parsed is None or parsed[1] != "status":
+            continue
+        if speed > 0:
+            wait = start + t / speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        client.publish(topic, bytes(payload), qos=1)
+        last_sent[0] = time.monotonic()
+
+    time.sleep(DRAIN)
+    client.loop_stop()
+    client.disconnect()
+    # Même règle que recorded_commands
+    kept = _keep_per_robot(received)
+    return ({xid: [c for c, _ in seq] for xid, seq in kept.items()},
+            [d for seq in kept.values() for _, d in seq])
+
+
+def compare(expected: dict, got: dict) -> list:
+    """Différences lisibles entre deux {xid: commandes} (vide si identiques)"""
+    diffs = []
+    xids = list(expected) + [x for x in got if x not in expected]
+    for xid in xids:
+        exp, rej = expected.get(xid, []), got.get(xid, [])
+        prefix = f"{xid} " if len(xids) > 1 else ""
+        for i, (a, b) in enumerate(zip(exp, rej)):
+            if a != b:
+                diffs.append(f"{prefix}#{i}: enregistré {a[0]}:{a[1]}, rejoué {b[0]}:{b[1]}")
+                break
+        if len(exp) != len(rej):
+            diffs.append(f"{prefix}{len(exp)} commandes enregistrées, {len(rej)} rejouées")
+
+        par_robot = defaultdict(lambda: [[], []])
+        for k, seq in enumerate((exp, rej)):
+            for target, action in seq:
+                par_robot[target][k].append(action)
+        differents = [t for t, (a, b) in par_robot.items() if a != b]
+        if differents:
+            diffs.append(f"{prefix}{len(differents)} robot(s) avec d'autres commandes: "
+                         f"{', '.join(differents[:5])}")
+    return diffs
+
+
+def _fmt_us(v):
+    return "-" if v is None else f"{v * 1e6:.0f}µs"
+
+
+def replay(args) -> int:
+    with Capture(args.file) as capture:
+        expected = recorded_commands(capture)
+        xids = status_xids(capture)
+        nb_status = sum(1 for _, topic, _ in capture
+                        if (parse_topic(topic) or (None, None))[1] == "status")
+        nb_cmd = sum(len(seq) for seq in expected.values())
+        print(f"{C.CYAN}▶ {nb_status} status, {nb_cmd} commandes enregistrées "
+              f"({len(xids)} intersection(s)){C.RST}")
+
+        if args.recovery:
+            return _check_recovery(capture, args.mode)
+
+        wall = time.perf_counter()
+        if args.engine:
+            got, costs = replay_engine(capture, args.mode)
+        elif args.local:
+            with BrokerThread(mode=args.mode, intersections=xids, workers=args.workers) as stack:
+                got, costs = replay_mqtt(capture, stack.host, stack.port, args.speed)
+        else:
+            got, costs = replay_mqtt(capture, args.host, args.port, args.speed)
+        wall = time.perf_counter() - wall
+
+    label = "décision" if args.engine else "status → commande"
+    print(f"{C.GRAY}Rejeu en {wall:.2f}s ({nb_status / wall:.0f} status/s), {label} "
+          f"p50 {_fmt_us(percentile(costs, 50))} p99 {_fmt_us(percentile(costs, 99))}{C.RST}")
+
+    diffs = compare(expected, got)
+    if not diffs:
+        print(f"{C.GREEN}✅ {sum(len(seq) for seq in got.values())} commandes identiques{C.RST}")
+        return 0
+    for d in diffs:
+        print(f"{C.RED}❌ {d}{C.RST}")
+    return 1
+
+
+def _check_recovery(capture: Capture, mode: str) -> int:
+    costs, diffs = replay_recovery(capture, mode)
+    print(f"{C.GRAY}{len(costs)} reprises simulées, durée p50 {_fmt_us(percentile(costs, 50))} "
+          f"p99 {_fmt_us(percentile(costs, 99))}{C.RST}")
+    if not diffs:
+        print(f"{C.GREEN}✅ État repris identique au moteur en service, journal sans estampille{C.RST}")
+        return 0
+    for d in diffs[:10]:
+        print(f"{C.RED}❌ {d}{C.RST}")
+    if len(diffs) > 10:
+        print(f"{C.RED}   ... {len(diffs) - 10} autre(s){C.RST}")
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    rec = sub.add_parser("record", help="Enregistre intersection/# dans un fichier")
+    rec.add_argument("file")
+    rec.add_argument("--host", default=BROKER_HOST)
+    rec.add_argument("--port", type=int, default=BROKER_PORT)
+    rec.add_argument("--duration", type=float, help="Durée (s), sinon jusqu'à Ctrl+C")
+
+    rep = sub.add_parser("replay", help="Rejoue une capture et compare les commandes")
+    rep.add_argument("file")
+    rep.add_argument("--mode", choices=MODES, default="FIFO", help="Mode du contrôleur rejoué")
+    rep.add_argument("--speed", type=float, default=1.0, help="Facteur de vitesse (0 = max)")
+    rep.add_argument("--engine", action="store_true",
+                     help="Moteur Python en direct, temps virtuel (vitesse max, sans broker)")
+    rep.add_argument("--local", action="store_true", help="Broker embarqué + contrôleur Python")
+    rep.add_argument("--recovery", action="store_true",
+                     help="Reprise après crash : journal rejoué tous les %d status, "
+                          "comparé au moteur en service" % RECOVERY_EVERY)
+    rep.add_argument("--workers", type=int, default=1, help="Processus du contrôleur embarqué (--local)")
+    rep.add_argument("--host", default=BROKER_HOST)
+    rep.add_argument("--port", type=int, default=BROKER_PORT)
+
+    args = parser.parse_args()
+    if args.cmd == "record":
+        return record(args.file, args.host, args.port, args.duration)
+    return replay(args)
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Simulation a Evenements Discrets - Horloge Virtuelle
+VA55 - UTBM
+
+Execute SimpleRobot et le moteur du controleur (controller/engine.py) sans
+broker ni temps reel : la boucle asyncio saute directement a la prochaine
+echeance au lieu de dormir. Une heure de trafic se simule en quelques
+secondes, et le resultat est reproductible a partir d'une graine.
+"""
+
+import asyncio
+import os
+import random
+import selectors
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from controller.engine import IntersectionEngine  # noqa: E402
+from controller.metrics import IntersectionMetrics  # noqa: E402
+from controller.protocol import (  # noqa: E402
+    INTERSECTION_ID, LEGACY_COMMAND_TOPIC, ReplyFormat, command_topic, decode_status, parse_topic,
+    shared_command_topic, split_stamp
+)
+
+LATENCY = (0.005, 0.020)      # s, latence reseau simulee (min, max)
+
+
+# =============================================================================
+# BOUCLE ASYNCIO A HORLOGE VIRTUELLE
+# =============================================================================
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """Selecteur qui avance l'horloge au lieu de bloquer"""
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events and timeout:
+            self.loop._virtual_time += timeout
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Boucle dont loop.time() est virtuel : asyncio.sleep() est instantane"""
+
+    def __init__(self):
+        selector = _VirtualSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self._virtual_time = 0.0
+
+    def time(self):
+        return self._virtual_time
+
+
+# =============================================================================
+# BUS MQTT SIMULE (interface compatible paho pour TestRunner)
+# =============================================================================
+
+class SimMessage:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+class SimBus:
+    """
+    Remplace le client paho + broker + controleur.
+
+    Les status publies par les robots sont livres au moteur de leur
+    intersection apres une latence aleatoire (graine fixe), les commandes
+    reviennent par on_message. L'ordre des messages est conserve dans chaque
+    sens, comme avec MQTT.
+    """
+
+    def __init__(self, mode: str, seed: int = 0, latency=LATENCY, legacy_topic: bool = False,
+                 intersections=(INTERSECTION_ID,)):
+        self.engines = {xid: IntersectionEngine(mode) for xid in intersections}
+        self.formats = {xid: ReplyFormat() for xid in intersections}
+        self.metrics = {xid: IntersectionMetrics(xid) for xid in intersections}  # Estampille seq/ts/re
+        self.legacy_topic = legacy_topic
+        self.subscriptions = set()
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.on_connect = None
+        self.on_message = None
+        self.loop = None
+        self._last_up = 0.0
+        self._last_down = 0.0
+
+    # --- Interface paho utilisee par TestRunner / SimpleRobot ---
+
+    def connect(self, host=None, port=None, keepalive=60):
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic, qos=0):
+        # Topic seul ou liste [(topic, qos), ...] comme paho ; pas de jokers
+        for t in ([topic] if isinstance(topic, str) else [t for t, _ in topic]):
+            self.subscriptions.add(t)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic: str, payload, qos=0):
+        parsed = parse_topic(topic)
+        if parsed and parsed[1] == "status" and parsed[0] in self.engines:
+            self._last_up = self._send(self._last_up, self._deliver_status, parsed[0], payload)
+
+    # --- Horloge et acheminement ---
+
+    def time(self) -> float:
+        return self.loop.time() if self.loop else 0.0
+
+    def _send(self, last: float, callback, *args) -> float:
+        at = max(self.loop.time() + self.rng.uniform(*self.latency), last)
+        self.loop.call_at(at, callback, *args)
+        return at
+
+    def _deliver_status(self, xid, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        data = decode_status(payload)
+        if data is None:
+            return
+        self.formats[xid].observe(data["id"], payload)
+        stamp = split_stamp(data)  # Comme ControllerService : le moteur ne voit pas seq/ts
+        now = self.loop.time()
+        commands = self.engines[xid].on_status(data, now)
+        self.metrics[xid].on_status(data, now, 0.0, stamp.get("seq"))
+        self._dispatch(xid, commands)
+
+    def _dispatch(self, xid, commands: list):
+        for cmd in commands:
+            cmd = self.metrics[xid].on_command(cmd, self.loop.time())
+            topics = [command_topic(cmd["target_id"], xid)]
+            if self.legacy_topic:
+                topics.append(shared_command_topic(xid))
+                if xid == INTERSECTION_ID:
+                    topics.append(LEGACY_COMMAND_TOPIC)
+            for payload in self.formats[xid].encode(cmd):
+                for topic in topics:
+                    if topic in self.subscriptions:
+                        self._last_down = self._send(self._last_down, self._deliver_command,
+                                                     SimMessage(topic, payload))
+
+    def _deliver_command(self, msg: SimMessage):
+        if self.on_message:
+            self.on_message(self, None, msg)
+
+    async def _tick_loop(self):
+        # Meme mode partout : une seule periode de tick
+        interval = next(iter(self.engines.values())).tick_interval
+        while True:
+            await asyncio.sleep(interval)
+            for xid, engine in self.engines.items():
+                now = self.loop.time()
+                reclamations = engine.reclamations
+                commands = engine.on_tick(now)
+                if engine.reclamations != reclamations:
+                    self.metrics[xid].prune(engine, now)
+                self._dispatch(xid, commands)
+
+    async def run(self, coro):
+        """Execute coro avec le timer du controleur en tache de fond"""
+        self.loop = asyncio.get_running_loop()
+        ticker = asyncio.create_task(self._tick_loop())
+        try:
+            return await coro
+        finally:
+            ticker.cancel()
+
+
+def run_virtual(bus: SimBus, coro):
+    """Equivalent de asyncio.run() sur une horloge virtuelle"""
+    loop = VirtualClockLoop()
+    try:
+        return loop.run_until_complete(bus.run(coro))
+    finally:
+        loop.close()
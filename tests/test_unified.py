@@ -7,17 +7,27 @@ Un robot à la fois, séquence claire, pour vérifier les algorithmes.
 """
 
 import asyncio
-import json
 import time
 import argparse
 from datetime import datetime
 
 import paho.mqtt.client as mqtt
 
+from sim import SimBus, run_virtual
+from broker import BrokerThread
+from controller.protocol import (
+    INTERSECTION_ID, LEGACY_COMMAND_TOPIC, LEGACY_STATUS_TOPIC, TARGET_ALL,
+    command_topic, shared_command_topic, status_topic,
+    parse_topic, encode_status, decode_command
+)
+
 BROKER_HOST = "localhost"
 BROKER_PORT = 1883
-TOPIC_STATUS = "intersection/status"
-TOPIC_COMMAND = "intersection/command"
+
+
+def intersection_ids(n: int) -> list:
+    """Ids des n intersections de test : X1 (intersection par défaut), X2, ..."""
+    return [INTERSECTION_ID] + [f"X{i}" for i in range(2, n + 1)]
 
 # Couleurs
 class C:
@@ -34,29 +44,74 @@ class C:
 class SimpleRobot:
     """Robot simple avec comportement EV3 exact"""
     
-    def __init__(self, name: str, voie: str, client: mqtt.Client):
+    def __init__(self, name: str, voie: str, client: mqtt.Client, clock=None, verbose: bool = True,
+                 binary: bool = False, xid: str = INTERSECTION_ID, legacy: bool = False):
         self.name = name
         self.voie = voie
+        self.xid = xid  # Intersection du robot (topics intersection/<xid>/...)
+        # Robot non migré : topics d'avant les intersections (intersection/status)
+        self.topic = LEGACY_STATUS_TOPIC if legacy else status_topic(xid)
         self.client = client
+        self.clock = clock  # Horloge virtuelle (--sim), sinon heure reelle
+        self.verbose = verbose
+        self.binary = binary  # Encodage binaire compact (sinon JSON)
+        self.seq = 0
+        self.sent = {}  # seq -> instant d'envoi (temps aller-retour du GO)
         self.permis_recu = False
         self.waiting = False
+        self.go_event = asyncio.Event()  # Signalé par on_go (boucle asyncio uniquement)
         self.finished = False
         self.success = False
+        
+        # Horodatage des événements (s, horloge de la boucle)
+        self.t_depart = None
+        self.t_etape1 = None
+        self.t_etape2 = None
+        self.t_go = None
+        self.t_redemarrage = None
+        self.t_etape3 = None
+        self.rtt_go = None  # GO reçu - envoi du status désigné par "re" (horloge du robot)
+        self.pass_through = False
+    
+    def now(self) -> float:
+        return self.clock() if self.clock else time.monotonic()
     
     def log(self, msg: str):
-        ts = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        if not self.verbose:
+            return
+        if self.clock:
+            ts = f"T+{self.clock():.3f}s"
+        else:
+            ts = datetime.now().strftime("%H:%M:%S.%f")[:-3]
         color = C.CYAN if self.voie == "A" else C.YELLOW
-        print(f"{C.GRAY}[{ts}]{C.RST} {color}{C.BOLD}{self.name}{C.RST} {msg}")
+        label = self.name if self.xid == INTERSECTION_ID else f"{self.xid}/{self.name}"
+        print(f"{C.GRAY}[{ts}]{C.RST} {color}{C.BOLD}{label}{C.RST} {msg}")
     
     def publish(self, etape: int, cause: str):
-        msg = {"id": self.name, "voie": self.voie, "etape": etape, "cause": cause, "dist_us": 9999}
-        self.client.publish(TOPIC_STATUS, json.dumps(msg), qos=1)
+        self.seq += 1
+        now = self.now()
+        msg = {"id": self.name, "voie": self.voie, "etape": etape, "cause": cause, "dist_us": 9999,
+               "seq": self.seq, "ts": int(now * 1000)}
+        self.sent[self.seq] = now
+        self.client.publish(self.topic, encode_status(msg, self.binary, self.seq), qos=1)
         self.log(f"📤 Envoi: etape={etape} cause={cause}")
     
-    def on_go(self):
+    def on_go(self, re: int = None):
+        if self.t_go is None:
+            self.t_go = self.now()
+            # Sans "re" (commande binaire, Node-RED ancien) : depuis le dernier status envoyé
+            envoi = self.sent.get(re, self.sent.get(self.seq))
+            if envoi is not None:
+                self.rtt_go = self.t_go - envoi
         self.log(f"🟢 GO REÇU!")
         self.permis_recu = True
         self.waiting = False
+        self.go_event.set()
+    
+    def on_reset(self):
+        self.log("🔄 RESET")
+        self.permis_recu = False
+        self.go_event.clear()
     
     async def run(self, delay_before: float = 0.0, timeout: float = 30.0):
         if delay_before > 0:
@@ -64,38 +119,47 @@ class SimpleRobot:
             await asyncio.sleep(delay_before)
         
         self.log("🚗 DÉPART")
-        start = time.time()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.t_depart = self.now()
         
         # Avancer vers LIGNE 1
         await asyncio.sleep(1.0)
         self.log("🔴 LIGNE 1 → Entrée zone")
+        self.t_etape1 = self.now()
         self.publish(1, "marker_entry")
         await asyncio.sleep(0.5)
         
         # Avancer vers LIGNE 2
         await asyncio.sleep(1.5)
         self.log("🔴 LIGNE 2 → Arrêt")
+        self.t_etape2 = self.now()
         
         if self.permis_recu:
             self.log("⚡ PASS-THROUGH (pré-autorisé)")
+            self.pass_through = True
+            self.t_redemarrage = self.t_etape2
             self.publish(2, "pass_through")
         else:
             self.publish(2, "marker_stop")
             self.waiting = True
             self.log("🛑 ARRÊT - Attente GO...")
             
-            while self.waiting:
-                if time.time() - start > timeout:
-                    self.log("❌ TIMEOUT!")
-                    self.finished = True
-                    return False
-                await asyncio.sleep(0.1)
+            try:
+                remaining = timeout - (loop.time() - start)
+                await asyncio.wait_for(self.go_event.wait(), max(0.0, remaining))
+            except asyncio.TimeoutError:
+                self.log("❌ TIMEOUT!")
+                self.finished = True
+                return False
             
+            self.t_redemarrage = self.now()
             self.log("🚗 GO reçu → Traverse")
         
         # Traverser + sortir
         await asyncio.sleep(1.0)
         self.log("🔴 LIGNE 3 → Sortie")
+        self.t_etape3 = self.now()
         self.publish(3, "marker_exit")
         
         self.log("✅ TERMINÉ")
@@ -105,15 +169,29 @@ class SimpleRobot:
 
 
 class TestRunner:
-    def __init__(self, mode: str, num_robots: int = 4):
+    def __init__(self, mode: str, num_robots: int = 4, sim: bool = False, seed: int = 0,
+                 verbose: bool = True, host: str = BROKER_HOST, port: int = BROKER_PORT,
+                 binary: bool = False, legacy_topic: bool = False, intersections: int = 1):
         self.mode = mode
-        self.num_robots = num_robots
-        self.client = mqtt.Client(
-            client_id=f"test_{int(time.time())}",
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
-        )
-        self.robots = {}
+        self.binary = binary
+        self.legacy_topic = legacy_topic
+        self.num_robots = num_robots  # Par intersection
+        self.xids = intersection_ids(intersections)
+        self.host = host
+        self.port = port
+        self.sim = sim
+        self.verbose = verbose
+        if sim:
+            # Simulation : controleur en memoire, horloge virtuelle
+            self.client = SimBus(mode, seed, legacy_topic=legacy_topic, intersections=self.xids)
+        else:
+            self.client = mqtt.Client(
+                client_id=f"test_{int(time.time())}",
+                callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+            )
+        self.robots = {}  # Table de dispatch : (xid, target_id) -> SimpleRobot
         self.connected = False
+        self._loop = None
         
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
@@ -121,27 +199,56 @@ class TestRunner:
     def _on_connect(self, client, userdata, flags, rc, props=None):
         if rc == 0:
             print(f"{C.GREEN}[MQTT] Connecté{C.RST}")
-            client.subscribe(TOPIC_COMMAND, qos=1)
+            if self.legacy_topic:
+                # Intersection par défaut : robots non migrés (intersection/command),
+                # autres intersections : topic partagé intersection/<xid>/command
+                client.subscribe([(LEGACY_COMMAND_TOPIC if xid == INTERSECTION_ID
+                                   else shared_command_topic(xid), 1) for xid in self.xids])
+            else:
+                # Diffusion de chaque intersection + topic de chaque robot déjà créé (reconnexion)
+                topics = [command_topic(TARGET_ALL, xid) for xid in self.xids]
+                topics += [command_topic(name, xid) for xid, name in self.robots]
+                client.subscribe([(t, 1) for t in topics])
             self.connected = True
     
     def _on_message(self, client, userdata, msg):
-        try:
-            p = json.loads(msg.payload.decode())
-            tid = p.get("target_id")
-            act = p.get("action")
-            
-            print(f"{C.MAG}[BROKER→] {tid}: {act}{C.RST}")
-            
-            if tid in self.robots and act == "GO":
-                self.robots[tid].on_go()
-        except Exception as e:
-            print(f"[ERR] {e}")
+        # Thread réseau paho : on ne touche pas aux robots, on passe la main à la boucle
+        p = decode_command(msg.payload)
+        if p is None:
+            print(f"[ERR] Commande invalide: {msg.payload!r}")
+            return
+        tid = p.get("target_id")
+        act = p.get("action")
+        parsed = parse_topic(msg.topic)
+        if parsed is None:
+            return
+        
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._dispatch, parsed[0], tid, act, p.get("re"))
+    
+    def _dispatch(self, xid: str, tid: str, act: str, re: int = None):
+        if self.verbose:
+            print(f"{C.MAG}[BROKER→] {xid} {tid}: {act}{C.RST}")
+        
+        if tid == TARGET_ALL:
+            targets = [r for (x, _), r in self.robots.items() if x == xid]
+        elif (xid, tid) in self.robots:
+            targets = (self.robots[(xid, tid)],)
+        else:
+            return
+        
+        for robot in targets:
+            if act == "GO":
+                robot.on_go(re if tid != TARGET_ALL else None)
+            elif act == "RESET":
+                robot.on_reset()
     
     async def run_sequential(self):
         """Exécute les robots UN PAR UN pour voir clairement"""
-        for name, robot in self.robots.items():
+        for robot in self.robots.values():
             print(f"\n{C.CYAN}{'─'*50}")
-            print(f"  Robot {name} - Voie {robot.voie}")
+            print(f"  Robot {robot.name} - Voie {robot.voie} - Intersection {robot.xid}")
             print(f"{'─'*50}{C.RST}\n")
             
             await robot.run(timeout=15.0)
@@ -149,20 +256,29 @@ class TestRunner:
     
     async def run_parallel(self, stagger: float = 2.0):
         """Exécute les robots en parallèle avec décalage"""
+        # Même séquence de départs sur chaque intersection
         tasks = []
-        for i, (name, robot) in enumerate(self.robots.items()):
+        rang = {}
+        for robot in self.robots.values():
+            i = rang[robot.xid] = rang.get(robot.xid, -1) + 1
             tasks.append(robot.run(delay_before=i * stagger, timeout=30.0))
         
         await asyncio.gather(*tasks, return_exceptions=True)
     
-    def run(self, parallel: bool = True, stagger: float = 2.0):
-        print(f"\n{C.MAG}{'═'*60}")
-        print(f"  TEST MODE: {self.mode}")
-        print(f"  Robots: {self.num_robots}")
-        print(f"  Mode: {'Parallèle' if parallel else 'Séquentiel'}")
-        print(f"{'═'*60}{C.RST}\n")
-        
-        self.client.connect(BROKER_HOST, BROKER_PORT, 60)
+    async def _bind_loop(self, coro):
+        self._loop = asyncio.get_running_loop()
+        try:
+            return await coro
+        finally:
+            self._loop = None
+    
+    def _execute(self, coro):
+        if self.sim:
+            return run_virtual(self.client, self._bind_loop(coro))
+        return asyncio.run(self._bind_loop(coro))
+    
+    def connect(self) -> bool:
+        self.client.connect(self.host, self.port, 60)
         self.client.loop_start()
         
         for _ in range(30):
@@ -172,63 +288,124 @@ class TestRunner:
         
         if not self.connected:
             print(f"{C.RED}Erreur MQTT{C.RST}")
+        return self.connected
+    
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+    
+    def add_robot(self, name: str, voie: str, xid: str = INTERSECTION_ID) -> SimpleRobot:
+        clock = self.client.time if self.sim else None
+        robot = SimpleRobot(name, voie, self.client, clock, self.verbose, self.binary, xid,
+                            legacy=self.legacy_topic and xid == INTERSECTION_ID)
+        self.robots[(xid, name)] = robot
+        if self.connected and not self.legacy_topic:
+            self.client.subscribe(command_topic(name, xid), qos=1)
+        return robot
+    
+    def run(self, parallel: bool = True, stagger: float = 2.0):
+        print(f"\n{C.MAG}{'═'*60}")
+        print(f"  TEST MODE: {self.mode}")
+        print(f"  Robots: {self.num_robots}" + (f" × {len(self.xids)} intersections" if len(self.xids) > 1 else ""))
+        print(f"  Mode: {'Parallèle' if parallel else 'Séquentiel'}")
+        if self.sim:
+            print("  Simulation: horloge virtuelle")
+        print(f"{'═'*60}{C.RST}\n")
+        
+        if not self.connect():
             return False
         
-        # Créer robots
+        # Créer robots (mêmes noms sur chaque intersection)
         half = self.num_robots // 2
-        for i in range(half + self.num_robots % 2):
-            name = f"R{i+1}_A"
-            self.robots[name] = SimpleRobot(name, "A", self.client)
-        for i in range(half):
-            name = f"R{i+1}_B"
-            self.robots[name] = SimpleRobot(name, "B", self.client)
-        
-        print("Robots:")
-        for name, r in self.robots.items():
-            color = C.CYAN if r.voie == "A" else C.YELLOW
-            print(f"  {color}● {name}{C.RST} (Voie {r.voie})")
-        print()
+        for xid in self.xids:
+            for i in range(half + self.num_robots % 2):
+                self.add_robot(f"R{i+1}_A", "A", xid)
+            for i in range(half):
+                self.add_robot(f"R{i+1}_B", "B", xid)
+        
+        if self.verbose:
+            print("Robots:")
+            for r in self.robots.values():
+                color = C.CYAN if r.voie == "A" else C.YELLOW
+                print(f"  {color}● {r.name}{C.RST} (Voie {r.voie}, {r.xid})")
+            print()
         
-        print(f"{C.YELLOW}⚠️  Mode {self.mode} doit être sélectionné dans Node-RED!{C.RST}\n")
+        if not self.sim and self.port == BROKER_PORT:
+            print(f"{C.YELLOW}⚠️  Mode {self.mode} doit être sélectionné dans Node-RED!{C.RST}\n")
         
         # Exécution
+        wall_start = time.perf_counter()
         if parallel:
-            asyncio.run(self.run_parallel(stagger))
+            self._execute(self.run_parallel(stagger))
         else:
-            asyncio.run(self.run_sequential())
+            self._execute(self.run_sequential())
+        if self.sim:
+            print(f"{C.GRAY}[SIM] {self.client.time():.1f}s simulées en "
+                  f"{time.perf_counter() - wall_start:.2f}s réelles{C.RST}")
         
-        self.client.loop_stop()
-        self.client.disconnect()
+        self.close()
         
         # Résultats
         ok = sum(1 for r in self.robots.values() if r.success)
         print(f"\n{C.MAG}{'═'*60}")
-        print(f"  RÉSULTATS: {ok}/{self.num_robots}")
+        print(f"  RÉSULTATS: {ok}/{len(self.robots)}")
         print(f"{'═'*60}{C.RST}\n")
         
-        for name, r in self.robots.items():
+        if len(self.xids) > 1:
+            for xid in self.xids:
+                n = sum(1 for (x, _), r in self.robots.items() if x == xid and r.success)
+                print(f"  {xid}: {n}/{self.num_robots}")
+            print()
+        
+        for r in self.robots.values():
+            if not self.verbose and r.success:
+                continue
             status = f"{C.GREEN}✅{C.RST}" if r.success else f"{C.RED}❌{C.RST}"
             color = C.CYAN if r.voie == "A" else C.YELLOW
-            print(f"  {status} {color}{name}{C.RST}")
+            print(f"  {status} {color}{r.xid}/{r.name}{C.RST}")
         
         print()
-        return ok == self.num_robots
+        return ok == len(self.robots)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--mode", choices=["FEU", "FIFO", "PELOTON"], default="FIFO")
-    parser.add_argument("--robots", type=int, default=4)
+    parser.add_argument("--mode", choices=["FEU", "ADAPTATIF", "FIFO", "PELOTON"], default="FIFO")
+    parser.add_argument("--robots", type=int, default=4, help="Robots par intersection")
+    parser.add_argument("--intersections", type=int, default=1,
+                        help="Intersections pilotées en même temps (X1, X2, ...)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processus du contrôleur embarqué (--local)")
     parser.add_argument("--sequential", action="store_true", help="Exécuter un robot à la fois")
     parser.add_argument("--stagger", type=float, default=2.0, help="Décalage entre robots (parallèle)")
+    parser.add_argument("--sim", action="store_true", help="Simulation horloge virtuelle (sans broker)")
+    parser.add_argument("--seed", type=int, default=0, help="Graine de la simulation (--sim)")
+    parser.add_argument("--quiet", action="store_true", help="N'afficher que le résumé")
+    parser.add_argument("--local", action="store_true",
+                        help="Broker embarqué + contrôleur Python (sans Docker)")
+    parser.add_argument("--binary", action="store_true",
+                        help="Encodage binaire compact (contrôleur Python uniquement)")
+    parser.add_argument("--legacy-topic", action="store_true",
+                        help="Commandes sur le topic partagé intersection/<xid>/command")
     args = parser.parse_args()
     
     print(f"\n{C.CYAN}╔{'═'*58}╗")
     print(f"║{'TEST VA55 - MODE TEXTE':^58}║")
     print(f"╚{'═'*58}╝{C.RST}")
     
-    runner = TestRunner(args.mode, args.robots)
-    success = runner.run(parallel=not args.sequential, stagger=args.stagger)
+    if args.local:
+        with BrokerThread(mode=args.mode, legacy_topic=args.legacy_topic,
+                          intersections=intersection_ids(args.intersections),
+                          workers=args.workers) as stack:
+            runner = TestRunner(args.mode, args.robots, verbose=not args.quiet,
+                                host=stack.host, port=stack.port, binary=args.binary,
+                                legacy_topic=args.legacy_topic, intersections=args.intersections)
+            success = runner.run(parallel=not args.sequential, stagger=args.stagger)
+    else:
+        runner = TestRunner(args.mode, args.robots, sim=args.sim, seed=args.seed,
+                            verbose=not args.quiet, binary=args.binary,
+                            legacy_topic=args.legacy_topic, intersections=args.intersections)
+        success = runner.run(parallel=not args.sequential, stagger=args.stagger)
     
     return 0 if success else 1
 
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Réglage Hors Ligne du Suivi de Ligne (PID)
+VA55 - UTBM
+
+Évalue en parallèle (NumPy) des milliers de combinaisons KP / KI / KD /
+COMMAND_FACTOR / MAX_SUM_ERROR / BASE_SPEED / LOOP_INTERVAL, avec la
+sémantique exacte de PIDController.compute (code_ev3/main.py) : période
+mesurée, intégrale pondérée par dt/nominal et bornée, dérivée sur dt,
+réflexion entière.
+
+sim   : robot différentiel (WHEEL_DIAMETER, AXLE_TRACK, vitesse moteur
+        bornée) sur une piste en stade dont il suit le bord de ligne ;
+        classement par erreur de suivi et temps au tour.
+trace : rejeu en boucle ouverte d'une trace de réflexion enregistrée
+        (CSV dt_ms,reflection[,turn]) : saturation des moteurs et de
+        l'intégrale pour chaque combinaison, et écart à la commande
+        enregistrée pour les gains de config.py.
+"""
+
+import argparse
+import ast
+import csv
+import itertools
+import math
+import os
+import sys
+
+import numpy as np
+
+CODE_EV3 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code_ev3")
+sys.path.insert(0, CODE_EV3)
+import config  # noqa: E402  (config.py du robot : constantes seules)
+
+from test_unified import C  # noqa: E402
+
+PARAMS = ("kp", "ki", "kd", "factor", "max_sum", "speed", "interval")
+
+# =============================================================================
+# PID VECTORISÉ
+# =============================================================================
+
+class BatchPID:
+    """PIDController.compute pour n combinaisons à la fois (tableaux de forme (n,))"""
+
+    def __init__(self, kp, ki, kd, target, dt_ms, cmd_factor, max_sum):
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.target = target
+        self.dt = dt_ms / 1000.0  # Période nominale
+        self.cmd_factor = cmd_factor
+        self.max_sum = max_sum
+        self.sum_err = np.zeros_like(self.dt)
+        self.last_err = np.full_like(self.dt, np.nan)  # NaN : pas encore de mesure
+
+    def compute(self, val, dt_ms):
+        dt = np.where(dt_ms > 0, dt_ms / 1000.0, self.dt)
+        err = val - self.target
+        self.sum_err = np.clip(self.sum_err + err * (dt / self.dt), -self.max_sum, self.max_sum)
+        deriv = np.where(np.isnan(self.last_err), 0.0, (err - self.last_err) / dt)
+        cmd = (self.kp * err + self.ki * self.sum_err + self.kd * deriv) * self.cmd_factor
+        self.last_err = err
+        return cmd
+
+    def select(self, keep):
+        """Ne garde que les combinaisons keep (masque booléen)"""
+        for name in ("kp", "ki", "kd", "target", "dt", "cmd_factor", "max_sum", "sum_err", "last_err"):
+            value = getattr(self, name)
+            if isinstance(value, np.ndarray):
+                setattr(self, name, value[keep])
+
+
+def load_robot_pid():
+    """Classe PIDController de code_ev3/main.py, extraite sans importer pybricks"""
+    path = os.path.join(CODE_EV3, "main.py")
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    node = next(n for n in tree.body if isinstance(n, ast.ClassDef) and n.name == "PIDController")
+    namespace = {}
+    exec(compile(ast.Module(body=[node], type_ignores=[]), path, "exec"), namespace)
+    return namespace["PIDController"]
+
+
+def verify(steps: int = 2000, seed: int = 0) -> float:
+    """Écart max entre BatchPID et PIDController sur des gains et périodes aléatoires"""
+    rng = np.random.default_rng(seed)
+    n = 64
+    gains = dict(kp=rng.uniform(0, 3, n), ki=rng.uniform(0, 0.5, n), kd=rng.uniform(0, 0.05, n),
+                 factor=rng.uniform(0.2, 1, n), max_sum=rng.uniform(10, 500, n))
+    nominal = rng.integers(10, 100, n).astype(float)
+    batch = BatchPID(gains["kp"], gains["ki"], gains["kd"], config.MIDDLE_REFLECTION, nominal,
+                     gains["factor"], gains["max_sum"])
+    PIDController = load_robot_pid()
+    robots = [PIDController(gains["kp"][i], gains["ki"][i], gains["kd"][i], config.MIDDLE_REFLECTION,
+                            nominal[i], gains["factor"][i], gains["max_sum"][i]) for i in range(n)]
+    worst = 0.0
+    for _ in range(steps):
+        val = rng.integers(0, 100, n)
+        dt_ms = nominal + rng.integers(0, 30, n) * (rng.random(n) < 0.2)
+        got = batch.compute(val.astype(float), dt_ms)
+        ref = np.array([r.compute(int(val[i]), int(dt_ms[i])) for i, r in enumerate(robots)])
+        worst = max(worst, float(np.max(np.abs(got - ref) / np.maximum(1.0, np.abs(ref)))))
+    return worst
+
+
+# =============================================================================
+# PISTE ET ROBOT
+# =============================================================================
+
+class Stadium:
+    """
+    Piste en stade parcourue dans le sens trigonométrique : deux droites de
+    longueur straight reliées par deux demi-cercles de rayon radius (mm).
+    Le bord suivi sépare le blanc (intérieur, à gauche) du noir (extérieur).
+    """
+
+    def __init__(self, straight: float, radius: float):
+        self.half = straight / 2.0
+        self.radius = radius
+        self.length = 2 * straight + 2 * math.pi * radius
+
+    def offset(self, x, y):
+        """Écart latéral au bord (mm), positif vers l'intérieur (blanc)"""
+        dx = x - np.clip(x, -self.half, self.half)
+        return self.radius - np.hypot(dx, y)
+
+    def abscissa(self, x, y):
+        """Abscisse curviligne (mm) du point de bord le plus proche"""
+        h, r = self.half, self.radius
+        right = h + r * (np.arctan2(y, x - h) + math.pi / 2)
+        left = 2 * h + math.pi * r + 2 * h + r * np.mod(np.arctan2(y, x + h) - math.pi / 2, 2 * math.pi)
+        straight = np.where(y < 0, x + h, 2 * h + math.pi * r + (h - x))
+        return np.where(x > h, right, np.where(x < -h, left, straight))
+
+
+def reflection(offset, width: float):
+    """Réflexion entière (%) du capteur à offset mm du bord (transition linéaire sur width mm)"""
+    k = np.clip(0.5 + offset / width, 0.0, 1.0)
+    return np.round(config.BLACK_REFLECTION + (config.WHITE_REFLECTION - config.BLACK_REFLECTION) * k)
+
+
+def simulate(grid: dict, track: Stadium, args) -> dict:
+    """
+    Un tour de piste par combinaison. Chaque itération reproduit la boucle
+    du robot : attente (dt mesuré, gigue incluse), déplacement avec la
+    commande précédente, lecture de la réflexion, compute(), drive().
+    """
+    n = len(grid["kp"])
+    rng = np.random.default_rng(args.seed)
+    interval = grid["interval"].astype(float)
+    pid = BatchPID(grid["kp"], grid["ki"], grid["kd"], float(config.MIDDLE_REFLECTION),
+                   interval, grid["factor"], grid["max_sum"])
+    speed = grid["speed"].astype(float)
+
+    # Écart au bord où la réflexion vaut la consigne (position d'équilibre)
+    span = config.WHITE_REFLECTION - config.BLACK_REFLECTION
+    target = ((config.MIDDLE_REFLECTION - config.BLACK_REFLECTION) / span - 0.5) * args.sensor_width
+    vmax = args.motor_speed * math.pi * config.WHEEL_DIAMETER / 360.0  # mm/s par roue
+    half_axle = config.AXLE_TRACK / 2.0
+
+    # Départ sur la droite du bas, capteur sur la position d'équilibre, cap +x
+    x = np.full(n, -track.half)
+    y = np.full(n, -track.radius + target)
+    theta = np.zeros(n)
+    turn = np.zeros(n)
+    t = np.zeros(n)
+    progress = np.zeros(n)
+    s_prev = track.abscissa(x + args.sensor_offset, y)
+    sq_err = np.zeros(n)
+    max_err = np.zeros(n)
+    steps = np.zeros(n)
+    ids = np.arange(n)
+
+    out = {"rms": np.full(n, np.nan), "max_err": np.full(n, np.nan),
+           "lap": np.full(n, np.inf), "lost": np.zeros(n, bool)}
+
+    while len(ids):
+        dt_ms = interval + (rng.integers(0, args.jitter + 1, len(ids)) if args.jitter else 0)
+        dt = dt_ms / 1000.0
+
+        # drive(speed, turn) : turn en °/s, positif = sens horaire ; vitesse de roue bornée
+        omega = np.radians(turn)
+        left = np.clip(speed + omega * half_axle, -vmax, vmax)
+        right = np.clip(speed - omega * half_axle, -vmax, vmax)
+        v = (left + right) / 2.0
+        omega = (left - right) / (2.0 * half_axle)
+        mid = theta - omega * dt / 2.0
+        x = x + v * dt * np.cos(mid)
+        y = y + v * dt * np.sin(mid)
+        theta = theta - omega * dt
+        t = t + dt
+
+        sx = x + args.sensor_offset * np.cos(theta)
+        sy = y + args.sensor_offset * np.sin(theta)
+        off = track.offset(sx, sy)
+        s = track.abscissa(sx, sy)
+        progress += np.mod(s - s_prev + track.length / 2, track.length) - track.length / 2
+        s_prev = s
+
+        err = np.abs(off - target)
+        sq_err += err * err
+        max_err = np.maximum(max_err, err)
+        steps += 1
+
+        turn = pid.compute(reflection(off, args.sensor_width), dt_ms)
+
+        lost = err > args.lost
+        done = lost | (progress >= track.length) | (t >= args.max_time)
+        if done.any():
+            fin = ids[done]
+            out["rms"][fin] = np.sqrt(sq_err[done] / steps[done])
+            out["max_err"][fin] = max_err[done]
+            out["lost"][fin] = lost[done]
+            lap = done & ~lost & (progress >= track.length)
+            out["lap"][ids[lap]] = t[lap]
+            keep = ~done
+            ids = ids[keep]
+            x, y, theta, turn, t, progress, s_prev = (a[keep] for a in (x, y, theta, turn, t, progress, s_prev))
+            sq_err, max_err, steps, interval, speed = (a[keep] for a in (sq_err, max_err, steps, interval, speed))
+            pid.select(keep)
+    return out
+
+
+# =============================================================================
+# TRACES ENREGISTRÉES
+# =============================================================================
+
+def load_trace(path: str):
+    """CSV dt_ms,reflection[,turn] (en-tête facultatif) -> (dt_ms, réflexion, turn ou None)"""
+    rows = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            try:
+                rows.append([float(v) for v in row])
+            except ValueError:
+                continue  # En-tête ou ligne illisible
+    if not rows:
+        raise ValueError("Trace vide: " + path)
+    data = np.array(rows)
+    return data[:, 0], data[:, 1], data[:, 2] if data.shape[1] > 2 else None
+
+
+def replay_trace(grid: dict, trace, motor_speed: float) -> dict:
+    """
+    Boucle ouverte : commandes produites par chaque combinaison sur la même
+    suite de mesures. sat : part des itérations où une roue dépasserait la
+    vitesse moteur max ; clamped : part où l'intégrale est en butée.
+    """
+    dt_ms, val, _ = trace
+    n = len(grid["kp"])
+    pid = BatchPID(grid["kp"], grid["ki"], grid["kd"], float(config.MIDDLE_REFLECTION),
+                   grid["interval"].astype(float), grid["factor"], grid["max_sum"])
+    vmax = motor_speed * math.pi * config.WHEEL_DIAMETER / 360.0
+    sq, peak, sat, clamped = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    for k in range(len(val)):
+        cmd = pid.compute(np.full(n, val[k]), np.full(n, dt_ms[k]))
+        sq += cmd * cmd
+        peak = np.maximum(peak, np.abs(cmd))
+        sat += grid["speed"] + np.abs(np.radians(cmd)) * config.AXLE_TRACK / 2.0 > vmax
+        clamped += np.abs(pid.sum_err) >= pid.max_sum
+    return {"cmd_rms": np.sqrt(sq / len(val)), "cmd_max": peak,
+            "sat": sat / len(val), "clamped": clamped / len(val)}
+
+
+def check_trace(trace) -> float:
+    """Écart max entre la commande rejouée (gains de config.py) et la commande enregistrée"""
+    dt_ms, val, turn = trace
+    pid = BatchPID(*(np.array([v], float) for v in (config.KP, config.KI, config.KD)),
+                   float(config.MIDDLE_REFLECTION), np.array([float(config.LOOP_INTERVAL)]),
+                   np.array([float(config.COMMAND_FACTOR)]), np.array([float(config.MAX_SUM_ERROR)]))
+    return max(abs(float(pid.compute(np.array([val[k]]), np.array([dt_ms[k]]))[0]) - turn[k])
+               for k in range(len(val)))
+
+
+# =============================================================================
+# GRILLE ET CLASSEMENT
+# =============================================================================
+
+def parse_values(spec: str) -> list:
+    """"a,b,c" ou "début:fin:n" (n valeurs régulières, bornes incluses)"""
+    if ":" in spec:
+        start, stop, count = spec.split(":")
+        return list(np.linspace(float(start), float(stop), int(count)))
+    return [float(v) for v in spec.split(",")]
+
+
+def build_grid(args) -> dict:
+    """Produit cartésien des valeurs -> {param: tableau (n,)}"""
+    values = [parse_values(getattr(args, p)) for p in PARAMS]
+    combos = np.array(list(itertools.product(*values)), dtype=float)
+    return {p: combos[:, i] for i, p in enumerate(PARAMS)}
+
+
+def rank(grid: dict, result: dict, max_error: float) -> list:
+    """
+    Ordre de classement : tours terminés avec une erreur max sous max_error,
+    du plus rapide au plus lent (puis par erreur RMS) ; ensuite les autres
+    tours terminés, puis les robots sortis de la ligne.
+    """
+    safe = (result["max_err"] <= max_error) & np.isfinite(result["lap"])
+    group = np.where(safe, 0, np.where(np.isfinite(result["lap"]), 1, 2))
+    return list(np.lexsort((result["rms"], result["lap"], group)))
+
+
+def rows(grid: dict, result: dict, order: list) -> list:
+    out = []
+    for i in order:
+        row = {p: float(grid[p][i]) for p in PARAMS}
+        row.update({k: (bool(v[i]) if v.dtype == bool else float(v[i])) for k, v in result.items()})
+        out.append(row)
+    return out
+
+
+def _fmt(v, spec=".2f"):
+    return "-" if v is None or not math.isfinite(v) else format(v, spec)
+
+
+def print_sim(table: list, top: int, max_error: float):
+    print(f"{C.BOLD}{'KP':>6} {'KI':>6} {'KD':>7} {'FACT':>5} {'MAXS':>6} {'VIT':>5} {'PER':>4} "
+          f"{'RMS':>6} {'MAX':>6} {'TOUR':>7}{C.RST}")
+    for r in table[:top]:
+        color = C.GREEN if r["max_err"] <= max_error and math.isfinite(r["lap"]) else \
+            C.RED if r["lost"] else C.YELLOW
+        print(f"{r['kp']:6.3f} {r['ki']:6.3f} {r['kd']:7.4f} {r['factor']:5.2f} {r['max_sum']:6.0f} "
+              f"{r['speed']:5.0f} {r['interval']:4.0f} {color}{_fmt(r['rms']):>6} "
+              f"{_fmt(r['max_err']):>6} {_fmt(r['lap'], '.2f') + ('s' if math.isfinite(r['lap']) else ''):>7}"
+              f"{C.RST}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Balayage des gains PID du suivi de ligne")
+    parser.add_argument("--kp", default=f"{config.KP * 0.25}:{config.KP * 2.5}:10")
+    parser.add_argument("--ki", default=f"0:{config.KI * 3}:4")
+    parser.add_argument("--kd", default=f"0,{config.KD},{config.KD * 10},{config.KD * 50}")
+    parser.add_argument("--factor", default=str(config.COMMAND_FACTOR), help="COMMAND_FACTOR")
+    parser.add_argument("--max-sum", default=str(config.MAX_SUM_ERROR), help="MAX_SUM_ERROR")
+    parser.add_argument("--speed", default=f"{config.BASE_SPEED},{config.BASE_SPEED * 1.5},"
+                                           f"{config.BASE_SPEED * 2}", help="BASE_SPEED (mm/s)")
+    parser.add_argument("--interval", default=f"{config.LOOP_INTERVAL // 2},{config.LOOP_INTERVAL}",
+                        help="LOOP_INTERVAL (ms)")
+    parser.add_argument("--trace", help="Trace CSV dt_ms,reflection[,turn] : rejeu en boucle ouverte")
+    parser.add_argument("--straight", type=float, default=1000.0, help="Longueur des droites (mm)")
+    parser.add_argument("--radius", type=float, default=300.0, help="Rayon des virages (mm)")
+    parser.add_argument("--sensor-offset", type=float, default=60.0,
+                        help="Capteur en avant de l'essieu (mm)")
+    parser.add_argument("--sensor-width", type=float, default=12.0,
+                        help="Largeur de la transition blanc/noir vue par le capteur (mm)")
+    parser.add_argument("--motor-speed", type=float, default=800.0, help="Vitesse moteur max (°/s)")
+    parser.add_argument("--jitter", type=int, default=0, help="Retard aléatoire max par itération (ms)")
+    parser.add_argument("--lost", type=float, default=40.0, help="Écart au bord = ligne perdue (mm)")
+    parser.add_argument("--max-error", type=float, default=10.0,
+                        help="Erreur max acceptée pour un réglage sûr (mm)")
+    parser.add_argument("--max-time", type=float, default=120.0, help="Durée max d'un tour (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=15, help="Lignes affichées")
+    parser.add_argument("--csv", help="Toutes les combinaisons classées (CSV)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Compare le PID vectorisé au PIDController de main.py et quitte")
+    args = parser.parse_args()
+
+    if args.verify:
+        worst = verify(seed=args.seed)
+        ok = worst < 1e-9
+        print(f"{C.GREEN if ok else C.RED}{'✅' if ok else '❌'} BatchPID / PIDController : "
+              f"écart relatif max {worst:.2e}{C.RST}")
+        return 0 if ok else 1
+
+    if args.trace:
+        args.speed = str(config.BASE_SPEED)  # Sans effet sur le PID en boucle ouverte
+    grid = build_grid(args)
+    n = len(grid["kp"])
+
+    if args.trace:
+        trace = load_trace(args.trace)
+        if trace[2] is not None:
+            print(f"{C.GRAY}Gains de config.py : écart max à la commande enregistrée "
+                  f"{check_trace(trace):.3g}°/s{C.RST}")
+        result = replay_trace(grid, trace, args.motor_speed)
+        # Les moins saturés d'abord ; à croiser avec la simulation (boucle fermée)
+        order = list(np.lexsort((result["cmd_max"], result["clamped"], result["sat"])))
+        table = rows(grid, result, order)
+        print(f"{C.CYAN}▶ {n} combinaisons × {len(trace[1])} mesures (boucle ouverte, "
+              f"{config.BASE_SPEED} mm/s){C.RST}")
+        print(f"{C.BOLD}{'KP':>6} {'KI':>6} {'KD':>7} {'FACT':>5} {'MAXS':>6} {'PER':>4} "
+              f"{'CMD RMS':>8} {'CMD MAX':>8} {'SAT':>5} {'BORNÉ':>6}{C.RST}")
+        for r in table[:args.top]:
+            print(f"{r['kp']:6.3f} {r['ki']:6.3f} {r['kd']:7.4f} {r['factor']:5.2f} {r['max_sum']:6.0f} "
+                  f"{r['interval']:4.0f} {r['cmd_rms']:8.1f} {r['cmd_max']:8.1f} {r['sat']:5.0%} "
+                  f"{r['clamped']:6.0%}")
+    else:
+        track = Stadium(args.straight, args.radius)
+        print(f"{C.CYAN}▶ {n} combinaisons, piste {track.length / 1000:.2f} m "
+              f"(droites {args.straight:.0f} mm, virages R{args.radius:.0f}){C.RST}")
+        result = simulate(grid, track, args)
+        table = rows(grid, result, rank(grid, result, args.max_error))
+        safe = sum(1 for r in table if r["max_err"] <= args.max_error and math.isfinite(r["lap"]))
+        lost = sum(1 for r in table if r["lost"])
+        print(f"{C.GRAY}{safe} réglage(s) sûr(s) (erreur max ≤ {args.max_error:.0f} mm), "
+              f"{lost} sortie(s) de ligne{C.RST}\n")
+        print_sim(table, args.top, args.max_error)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(table[0]))
+            writer.writeheader()
+            writer.writerows(table)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())